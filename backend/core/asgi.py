@@ -2,6 +2,9 @@
 ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django, WebSockets to the live pattern editing channel (patterns.consumers).
+Every viewer of a pattern must reach the same process to share its in-memory copy, so
+serve it with a single worker, e.g. ``uvicorn core.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +16,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready
+from patterns.consumers import live_pattern_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "websocket":
+        await live_pattern_socket(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
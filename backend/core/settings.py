@@ -195,12 +195,43 @@ DATABASES = {
     }
 }
 
+# **** Pattern Compilation ****
+# How pattern pieces are rasterized: 'process' (process pool), 'thread' (thread pool) or 'serial'.
+# Starting a process pool takes seconds, more than a whole serial compile, so only the long running
+# CompileWorker uses one by default; anything else compiling in a web process builds serially.
+PATTERN_COMPILE_EXECUTOR = env('PATTERN_COMPILE_EXECUTOR', default='serial')
+PATTERN_WORKER_COMPILE_EXECUTOR = env('PATTERN_WORKER_COMPILE_EXECUTOR', default='process')
+# Worker count for the pool, unset uses min(4, cpu count)
+PATTERN_COMPILE_WORKERS = env.int('PATTERN_COMPILE_WORKERS', default=None)
+
+# **** Pattern Plane Cache ****
+# Memory bound of each process's cache of decoded pattern planes
+PATTERN_CACHE_BYTES = env.int('PATTERN_CACHE_BYTES', default=256 * 1024 * 1024)
+# Optional CACHES alias shared between processes (e.g. Redis), unset keeps the cache per-process
+PATTERN_CACHE_ALIAS = env('PATTERN_CACHE_ALIAS', default=None)
+
+# **** Async Grid Views ****
+# Threads per process for storage reads and writes of the async grid views, matches the S3 client's connection pool
+PATTERN_IO_WORKERS = env.int('PATTERN_IO_WORKERS', default=32)
+# Threads per process for decoding and encoding planes, unset uses the cpu count
+PATTERN_DECODE_WORKERS = env.int('PATTERN_DECODE_WORKERS', default=None)
+
+# **** Pattern Edit Journal ****
+# Uncompacted journal entries a pattern needs before the compile worker folds them into its planes
+PATTERN_JOURNAL_COMPACT_AFTER = env.int('PATTERN_JOURNAL_COMPACT_AFTER', default=50)
+
+# **** Live Pattern Editing ****
+# Seconds between flushes of edits made over the live channel (patterns/consumers.py) to the journal
+PATTERN_LIVE_FLUSH_SECONDS = env.float('PATTERN_LIVE_FLUSH_SECONDS', default=2.0)
+
 # **** Storage Configuration - Based on STAGE ****
 STAGE = env('STAGE', default='local')
 
-# Set AWS variables for compatibility (views.py references these)
+# AWS variables, read by the S3 storage and patterns.tool_functions.object_storage
 AWS_STORAGE_BUCKET_NAME = env('AWS_STORAGE_BUCKET_NAME', default='knittoknit-media')
 AWS_S3_REGION_NAME = env('AWS_S3_REGION_NAME', default='us-east-2')
+# Set to a local S3 stand-in (e.g. MinIO at http://localhost:9000) to run the S3 stage without AWS
+AWS_S3_ENDPOINT_URL = env('AWS_S3_ENDPOINT_URL', default=None)
 
 if STAGE == 'local':
     # Local file storage for development
@@ -228,6 +259,7 @@ else:
             "OPTIONS": {
                 "bucket_name": AWS_STORAGE_BUCKET_NAME,
                 "region_name": AWS_S3_REGION_NAME,
+                "endpoint_url": AWS_S3_ENDPOINT_URL,
                 "querystring_auth": AWS_QUERYSTRING_AUTH,
                 "object_parameters": AWS_S3_OBJECT_PARAMETERS,
             },
@@ -16,6 +16,8 @@ Including another URLconf
 """
 
 # core/urls.py
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -24,3 +26,7 @@ urlpatterns = [
     path("api/", include("authentication.urls")),
     path("api/", include("patterns.urls")),
 ]
+
+# Local media (e.g. pattern thumbnails) in development, S3 serves it otherwise
+if settings.STAGE == 'local':
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -4,6 +4,8 @@ from .models import *
 # Register your models here.
 admin.site.register(Pattern)
 admin.site.register(SeparatedSweater)
+admin.site.register(CompileJob)
+admin.site.register(PatternEdit)
 admin.site.register(Swatch)
 admin.site.register(Torso_Projection)
 admin.site.register(Sleeve_Projection)
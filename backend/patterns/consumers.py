@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import re
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.http.cookie import parse_cookie
+
+from .models import SeparatedSweater
+from .tool_functions.grid_patch import PatchError
+from .tool_functions.live_session import LiveSession
+from .tool_functions.pattern_store import PatternNotFound
+
+logger = logging.getLogger('patterns')
+
+LIVE_PATH = re.compile(r'^/api/patterns/(?P<pattern_id>\d+)/live$')
+
+
+class LiveViewer:
+    """
+    One open socket. Messages go through a queue drained by its own task, so a slow
+    client never holds up broadcasts to the others.
+    """
+    def __init__(self, user, send):
+        self.user = user
+        self.outbox = asyncio.Queue()
+        self.writer = asyncio.create_task(self._write(send))
+
+    async def _write(self, send):
+        while True:
+            message = await self.outbox.get()
+            if message is None:
+                return
+            await send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    def send(self, **message):
+        self.outbox.put_nowait(message)
+
+    async def close(self):
+        self.outbox.put_nowait(None)
+        await self.writer
+
+
+class LiveRoom:
+    """
+    The viewers of one pattern in this process and the LiveSession they share.
+    Session calls run one at a time in a thread, pending edits are flushed every
+    PATTERN_LIVE_FLUSH_SECONDS while anyone is connected and when the last viewer leaves.
+    A room stays registered, and keeps retrying, until a flush after its last viewer left succeeds.
+    """
+    def __init__(self, pattern_id):
+        self.pattern_id = pattern_id
+        self.session = LiveSession(pattern_id)
+        self.viewers = set()
+        self.lock = asyncio.Lock()
+        self.flusher = None
+
+    async def call(self, method, *args):
+        async with self.lock:
+            return await sync_to_async(method)(*args)
+
+    def broadcast(self, message, exclude=None):
+        for viewer in self.viewers:
+            if viewer is not exclude:
+                viewer.send(**message)
+
+    def join(self, viewer):
+        self.viewers.add(viewer)
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._flush_periodically())
+        self.broadcast({'type': 'viewers', 'viewers': [other.user.username for other in self.viewers]})
+
+    async def leave(self, viewer):
+        self.viewers.discard(viewer)
+        if self.viewers:
+            self.broadcast({'type': 'viewers', 'viewers': [other.user.username for other in self.viewers]})
+            return
+        # Someone may have joined while the flush ran
+        if await self.flush() and not self.viewers:
+            self._close()
+
+    def _close(self):
+        if live_rooms.get(self.pattern_id) is self:
+            del live_rooms[self.pattern_id]
+        if self.flusher is not asyncio.current_task():
+            self.flusher.cancel()
+        self.flusher = None
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(settings.PATTERN_LIVE_FLUSH_SECONDS)
+            if await self.flush() and not self.viewers:
+                self._close()
+                return
+
+    async def flush(self):
+        """
+        Journals pending edits and tells viewers what changed. Returns whether it succeeded.
+        """
+        try:
+            written, pulled, dropped = await self.call(self.session.flush)
+        except PatternNotFound:
+            # The pattern was deleted, its edits have nowhere to go
+            logger.warning('Dropping live edits of deleted pattern %s', self.pattern_id)
+            return True
+        except Exception:
+            # Pending edits stay in memory and are retried on the next flush
+            logger.exception('Flushing live edits of pattern %s failed', self.pattern_id)
+            return False
+
+        for (section, plane), cells in pulled.items():
+            for author, patch in cells:
+                self.broadcast({'type': 'delta', 'section': section, 'plane': plane, 'patch': patch, 'author': author})
+        for section, plane in dropped:
+            self.broadcast({'type': 'reload', 'section': section, 'plane': plane})
+        if written:
+            self.broadcast({'type': 'saved', 'version': max(entry.version for entry in written)})
+        return True
+
+
+# Rooms of this process by pattern id
+live_rooms = {}
+
+
+def _headers(scope):
+    return {name.decode('latin1'): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+
+def _origin_allowed(headers):
+    # Browsers send cookies with cross-site socket handshakes, only accept our own pages
+    origin = headers.get('origin')
+    if origin is None:
+        return True
+    return origin in settings.CSRF_TRUSTED_ORIGINS or urlsplit(origin).netloc == headers.get('host')
+
+
+def _session_user(headers):
+    cookies = parse_cookie(headers.get('cookie', ''))
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(cookies.get(settings.SESSION_COOKIE_NAME))
+    return get_user(SimpleNamespace(session=session))
+
+
+async def live_pattern_socket(scope, receive, send):
+    """
+    ASGI app for /api/patterns/<id>/live, the live editing channel of a pattern.
+    Authenticated by the session cookie, like the rest of the API. JSON messages:
+
+    Client -> server
+        {"type": "load", "section", "plane"}                 -> "plane" with the shared copy
+        {"type": "edit", "section", "plane", "patch", "id"}  GridPatch data, answered with "ack"
+        {"type": "flush"}                                    journal pending edits now
+    Server -> client
+        {"type": "plane", "section", "plane", "data", "version"}
+        {"type": "delta", "section", "plane", "patch", "author"}  edits of other viewers or saved elsewhere
+        {"type": "ack", "id"}, {"type": "error", "error", "id"}
+        {"type": "saved", "version"}   pending edits were journaled
+        {"type": "reload", "section", "plane"}  the pattern was recompiled, load the plane again
+        {"type": "viewers", "viewers"}
+    """
+    match = LIVE_PATH.match(scope['path'])
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    headers = _headers(scope)
+    user = await sync_to_async(_session_user)(headers) if match and _origin_allowed(headers) else None
+    if user is None or not user.is_authenticated:
+        await send({'type': 'websocket.close', 'code': 4403 if match else 4404})
+        return
+
+    pattern_id = int(match['pattern_id'])
+    # Same answer for patterns of others as for missing ones, like the REST views
+    if not await SeparatedSweater.objects.filter(id=pattern_id, author=user).aexists():
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    await send({'type': 'websocket.accept'})
+    room = live_rooms.setdefault(pattern_id, LiveRoom(pattern_id))
+    viewer = LiveViewer(user, send)
+    room.join(viewer)
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            try:
+                message = json.loads(event.get('text') or event.get('bytes') or b'')
+                if not isinstance(message, dict):
+                    raise ValueError('Messages must be JSON objects')
+            except ValueError as e:
+                viewer.send(type='error', error=str(e))
+                continue
+            await handle_live_message(room, viewer, message)
+    finally:
+        await room.leave(viewer)
+        await viewer.close()
+
+
+async def handle_live_message(room, viewer, message):
+    kind = message.get('type')
+    section, plane = message.get('section'), message.get('plane')
+
+    if kind == 'flush':
+        await room.flush()
+        return
+
+    if kind not in ('load', 'edit'):
+        viewer.send(type='error', error=f"Unknown message type '{kind}'", id=message.get('id'))
+        return
+    if kind == 'edit' and viewer.user.is_test_account:
+        viewer.send(type='error', error='Test accounts cannot save pattern changes', id=message.get('id'))
+        return
+
+    try:
+        if kind == 'load':
+            data, version = await room.call(room.session.snapshot, section, plane)
+            viewer.send(type='plane', section=section, plane=plane, data=data, version=version)
+            return
+
+        patch = await room.call(room.session.apply, section, plane, message.get('patch'), viewer.user)
+    except PatchError as e:
+        viewer.send(type='error', error=str(e), id=message.get('id'))
+        return
+    except (KeyError, PatternNotFound):
+        viewer.send(type='error', error=f"Unknown section '{section}' or plane '{plane}'", id=message.get('id'))
+        return
+    except (ValueError, TypeError) as e:
+        viewer.send(type='error', error=f'Malformed {kind} message: {e}', id=message.get('id'))
+        return
+    except Exception:
+        # e.g. storage unavailable, the socket stays open for the next message
+        logger.exception('Live %s on pattern %s failed', kind, room.pattern_id)
+        viewer.send(type='error', error=f'The {kind} failed, try again', id=message.get('id'))
+        return
+
+    viewer.send(type='ack', id=message.get('id'))
+    room.broadcast({'type': 'delta', 'section': section, 'plane': plane, 'patch': patch.to_data(),
+                    'author': viewer.user.username}, exclude=viewer)
@@ -0,0 +1,37 @@
+# BenchmarkGeometry.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from ...tool_functions.benchmark import DEFAULT_GAUGES, STAGES, run_benchmark, compare_totals
+from ...tool_functions.rasterizer import FILL_METHODS
+
+
+class Command(BaseCommand):
+    help = 'Times every compile stage for each Pattern Sizes.json preset across a range of gauges.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gauges', type=float, nargs='+', default=list(DEFAULT_GAUGES), help='Gauge multipliers applied to each preset swatch.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per case, min and median are reported.')
+        parser.add_argument('--fill-method', choices=sorted(FILL_METHODS), default='label', help='Outside fill to time.')
+        parser.add_argument('--output', type=str, default='geometry_benchmark.json', help='JSON file to write results to.')
+        parser.add_argument('--compare', type=str, default=None, help='Earlier results file to compare stage totals against.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+
+        results = run_benchmark(options['gauges'], options['repeat'], options['fill_method'])
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(f"{len(results['results'])} cases written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+            self.stdout.write(f"{'stage':<16}{'baseline ms':>14}{'current ms':>14}{'ratio':>8}")
+            for stage, (before, after, ratio) in compare_totals(baseline, results).items():
+                style = self.style.ERROR if ratio > 1.1 else self.style.SUCCESS
+                self.stdout.write(style(f"{stage:<16}{before * 1000:>14.2f}{after * 1000:>14.2f}{ratio:>8.2f}"))
+        else:
+            for stage in STAGES:
+                self.stdout.write(f"{stage:<16}{results['totals'][stage] * 1000:>10.2f} ms")
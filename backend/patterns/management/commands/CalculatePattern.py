@@ -1,9 +1,8 @@
 # CalculatePattern.py
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from ...models import Pattern
-from ...views import recalculate_pattern
-from rest_framework.test import APIRequestFactory, force_authenticate
+from ...models import SeparatedSweater
+from ...tool_functions.services import recompile_pattern
 
 User = get_user_model()
 
@@ -15,6 +14,7 @@ class Command(BaseCommand):
         # Add arguments for user ID and pattern ID
         parser.add_argument('user_id', type=int, help='ID of the user who owns the pattern')
         parser.add_argument('pattern_id', type=int, help='ID of the pattern to recalculate')
+        parser.add_argument('--discard-edits', action='store_true', help='Recalculate even if a changed piece loses its edits')
 
     def handle(self, *args, **options):
         user_id = options['user_id']
@@ -23,29 +23,21 @@ class Command(BaseCommand):
         try:
             # Get the user and pattern based on provided IDs
             user = User.objects.get(id=user_id)
-            pattern = Pattern.objects.get(id=pattern_id)
-
-            self.stdout.write(f"Recalculating pattern: {pattern}")
-
-            # Create a request using the RequestFactory
-            factory = APIRequestFactory()
-            request = factory.post(f'/api/pattern-view/{pattern_id}/')
-
-            # Authenticate the request with the user
-            force_authenticate(request, user=user)
-
-            # Call the view function
-            response = recalculate_pattern(request, pattern_id=pattern_id)
-
-            # Check the response status code
-            if response.status_code == 200:
-                self.stdout.write(self.style.SUCCESS("Pattern recalculated successfully."))
-            else:
-                self.stdout.write(self.style.ERROR(f"Error recalculating pattern: {response.data}"))
-
+            pattern = SeparatedSweater.objects.get(id=pattern_id, author=user)
         except User.DoesNotExist:
             raise CommandError(f"User with ID {user_id} does not exist.")
-        except Pattern.DoesNotExist:
-            raise CommandError(f"Pattern with ID {pattern_id} does not exist.")
-        except Exception as e:
-            raise CommandError(f"An error occurred: {str(e)}")
+        except SeparatedSweater.DoesNotExist:
+            raise CommandError(f"Pattern with ID {pattern_id} does not exist for user {user_id}.")
+
+        self.stdout.write(f"Recalculating pattern: {pattern}")
+
+        # Rebuild the pattern file in place
+        _, error, discarded, skipped = recompile_pattern(pattern.id, options['discard_edits'])
+        if error is not None:
+            raise CommandError(f"Error recalculating pattern: {error}")
+        if skipped:
+            raise CommandError(f"Recalculating would discard the edits of {', '.join(skipped)}, "
+                               f"pass --discard-edits to do so.")
+        if discarded:
+            self.stdout.write(self.style.WARNING(f"Discarded the edits of {', '.join(discarded)}"))
+        self.stdout.write(self.style.SUCCESS("Pattern recalculated successfully."))
@@ -0,0 +1,55 @@
+# CompileWorker.py
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...tool_functions.compile_executor import EXECUTOR_MODES, get_compile_executor
+from ...tool_functions.journal import compact_journals
+from ...tool_functions.services import claim_compile_job, run_compile_job
+from django.conf import settings
+
+
+class Command(BaseCommand):
+    help = ('Runs queued pattern compile jobs. Polls the database, so no broker is needed. '
+            'While the queue is empty, compacts long pattern edit journals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty instead of polling.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait between polls of an empty queue.')
+        parser.add_argument('--stale-after', type=int, default=600, help='Seconds before a running job is considered abandoned and claimed again.')
+        parser.add_argument('--executor', choices=EXECUTOR_MODES, default=None, help='Overrides PATTERN_WORKER_COMPILE_EXECUTOR.')
+        parser.add_argument('--workers', type=int, default=None, help='Overrides PATTERN_COMPILE_WORKERS.')
+        parser.add_argument('--compact-after', type=int, default=None, help='Overrides PATTERN_JOURNAL_COMPACT_AFTER.')
+
+    def handle(self, *args, **options):
+        # The worker outlives many jobs, so a process pool's startup is paid once
+        executor = get_compile_executor(options['executor'] or settings.PATTERN_WORKER_COMPILE_EXECUTOR,
+                                        options['workers'] or settings.PATTERN_COMPILE_WORKERS)
+        stale_after = timedelta(seconds=options['stale_after'])
+        compact_after = options['compact_after'] or settings.PATTERN_JOURNAL_COMPACT_AFTER
+
+        self.stdout.write(f"Compile worker started ({executor.mode}, {executor.workers} workers)")
+        try:
+            while True:
+                # Long running process, drop connections the database may have closed
+                close_old_connections()
+
+                job = claim_compile_job(stale_after)
+                if job is None:
+                    for pattern_id, entries in compact_journals(compact_after).items():
+                        self.stdout.write(f"Compacted {entries} journal entries of pattern {pattern_id}")
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"Compiling job {job.id} for pattern {job.pattern_id}")
+                job = run_compile_job(job, executor)
+                if job.status == job.DONE:
+                    self.stdout.write(self.style.SUCCESS(f"Job {job.id} done."))
+                else:
+                    self.stdout.write(self.style.ERROR(f"Job {job.id} failed: {job.error}"))
+        except KeyboardInterrupt:
+            self.stdout.write("Compile worker stopped.")
@@ -0,0 +1,58 @@
+# RecompilePatterns.py
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from ...models import SeparatedSweater
+from ...tool_functions.services import recompile_patterns, load_checkpoint
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Recompiles stored patterns in parallel, e.g. to rebuild every pattern after a geometry change.'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--all', action='store_true', help='Recompile every pattern in the system.')
+        target.add_argument('--user', type=str, help='Recompile the patterns of the user with this username.')
+        target.add_argument('--ids', type=int, nargs='+', help='Recompile the patterns with these IDs.')
+        parser.add_argument('--chunk-size', type=int, default=50, help='Patterns per chunk between checkpoints.')
+        parser.add_argument('--processes', type=int, default=None, help='Worker processes, defaults to the CPU count.')
+        parser.add_argument('--discard-edits', action='store_true', help='Recompile patterns even where a changed piece loses its edits. Without it those patterns are skipped and listed.')
+        parser.add_argument('--checkpoint', type=str, default=None, help='JSON file to record progress in. Rerunning with the same file resumes after the last finished chunk.')
+
+    def handle(self, *args, **options):
+        patterns = SeparatedSweater.objects.all()
+        if options['user']:
+            try:
+                patterns = patterns.filter(author=User.objects.get(username=options['user']))
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist.")
+        elif options['ids']:
+            patterns = patterns.filter(id__in=options['ids'])
+
+        checkpoint = load_checkpoint(options['checkpoint'])
+        if checkpoint['last_id']:
+            self.stdout.write(f"Resuming after pattern {checkpoint['last_id']} ({checkpoint['done']} already done)")
+        self.stdout.write(f"Recompiling {patterns.filter(id__gt=checkpoint['last_id']).count()} patterns")
+
+        def report(stats):
+            self.stdout.write(f"{stats['done']} done, {stats['failed']} failed, {stats['skipped']} skipped, "
+                              f"up to pattern {stats['last_id']} "
+                              f"- {stats['rate']:.2f} patterns/sec")
+
+        stats = recompile_patterns(patterns, chunk_size=options['chunk_size'], processes=options['processes'],
+                                   checkpoint_path=options['checkpoint'], on_chunk=report,
+                                   discard_edits=options['discard_edits'])
+
+        for pattern_id, error in stats['errors'].items():
+            self.stdout.write(self.style.ERROR(f"Pattern {pattern_id} failed: {error}"))
+        for pattern_id, sections in stats['skipped_sections'].items():
+            self.stdout.write(self.style.WARNING(f"Pattern {pattern_id} skipped, recompiling would discard the edits "
+                                                 f"of {', '.join(sections)}. Rerun it with --discard-edits to do so."))
+        for pattern_id, sections in stats['discarded'].items():
+            self.stdout.write(self.style.WARNING(f"Pattern {pattern_id} lost the edits of {', '.join(sections)}"))
+
+        style = self.style.SUCCESS if not stats['failed'] and not stats['skipped'] else self.style.WARNING
+        self.stdout.write(style(f"Recompiled {stats['done']} patterns in {stats['elapsed']:.1f}s "
+                                f"({stats['rate']:.2f} patterns/sec), {stats['failed']} failed, "
+                                f"{stats['skipped']} skipped."))
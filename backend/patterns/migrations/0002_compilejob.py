@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patterns', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompileJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=7)),
+                ('error', models.TextField(blank=True, default='')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('started_on', models.DateTimeField(blank=True, null=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compile_jobs', to='patterns.separatedsweater')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_on'], name='patterns_co_status_2820cc_idx')],
+            },
+        ),
+    ]
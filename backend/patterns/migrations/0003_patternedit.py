@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patterns', '0002_compilejob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatternEdit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('section', models.CharField(max_length=20)),
+                ('plane', models.CharField(max_length=20)),
+                ('kind', models.CharField(choices=[('edit', 'Edit'), ('undo', 'Undo'), ('redo', 'Redo'), ('restore', 'Restore')], default='edit', max_length=7)),
+                ('batch', models.PositiveIntegerField()),
+                ('undone', models.BooleanField(default=False)),
+                ('compacted', models.BooleanField(default=False)),
+                ('cells', models.PositiveIntegerField()),
+                ('delta', models.BinaryField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('pattern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='edits', to='patterns.separatedsweater')),
+                ('reverts', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patterns.patternedit')),
+            ],
+            options={
+                'ordering': ['version'],
+                'indexes': [models.Index(fields=['pattern', 'compacted', 'version'], name='patterns_pa_pattern_fc0b39_idx')],
+                'constraints': [models.UniqueConstraint(fields=('pattern', 'version'), name='unique_pattern_edit_version')],
+            },
+        ),
+    ]
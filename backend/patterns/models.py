@@ -9,6 +9,8 @@ from django.core.files.storage import default_storage
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .tool_functions.pattern_store import PatternStore
+
 User = get_user_model()
 
 # Create your models here.
@@ -65,7 +67,10 @@ class SeparatedSweater(Pattern):
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        # Delete the file associated with this instance
+        # Delete the planes stored next to the manifest, then the file associated with this instance
+        PatternStore(self.id).delete()
+        if self.thumbnail:
+            self.thumbnail.delete(save=False)
         if self.sweater_file:
             self.sweater_file.delete(save=False)
         super().delete(*args, **kwargs)
@@ -74,6 +79,95 @@ class SeparatedSweater(Pattern):
         return f"Separated Sweater: {self.name}"
 
 
+class CompileJob(models.Model):
+    """
+    A queued compile of a pattern's data file.
+    Created by compile_pattern and claimed by the CompileWorker management command.
+    Fields:
+        - pattern: ForeignKey to the SeparatedSweater being compiled.
+        - status: queued -> running -> done or failed.
+        - error: The failure message when status is failed.
+        - attempts: Number of times a worker has claimed the job.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    pattern = models.ForeignKey(SeparatedSweater, on_delete=models.CASCADE, related_name='compile_jobs')
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    created_on = models.DateTimeField(auto_now_add=True)
+    started_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_on'])]
+
+    def __str__(self):
+        return f"Compile Job {self.id} ({self.status}) for {self.pattern_id}"
+
+
+class PatternEdit(models.Model):
+    """
+    One entry of a pattern's append-only edit journal: cells of one plane of one section
+    changed from their before values to their after values.
+    Entries are folded into the stored planes by journal compaction, reads apply the
+    entries not compacted yet on top of them.
+    Fields:
+        - pattern: ForeignKey to the edited SeparatedSweater.
+        - version: Position in the pattern's journal, increasing by 1 per entry.
+        - section, plane: The plane the cells belong to.
+        - kind: edit, or the undo/redo/restore that produced the entry.
+        - batch: Version of the first entry written by the same operation, e.g. one restore
+          over several planes; undo and redo treat a batch as one step.
+        - reverts: The edit an undo or redo entry reverts or reapplies.
+        - undone: Whether an edit is currently undone, for finding undo and redo targets.
+        - compacted: Whether the entry has been folded into the stored planes.
+        - cells: Number of cells changed.
+        - delta: The changed cells, see journal.CellDelta.
+    """
+    EDIT = 'edit'
+    UNDO = 'undo'
+    REDO = 'redo'
+    RESTORE = 'restore'
+    KIND_CHOICES = [
+        (EDIT, 'Edit'),
+        (UNDO, 'Undo'),
+        (REDO, 'Redo'),
+        (RESTORE, 'Restore'),
+    ]
+
+    pattern = models.ForeignKey(SeparatedSweater, on_delete=models.CASCADE, related_name='edits')
+    version = models.PositiveIntegerField()
+    section = models.CharField(max_length=20)
+    plane = models.CharField(max_length=20)
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES, default=EDIT)
+    batch = models.PositiveIntegerField()
+    reverts = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    undone = models.BooleanField(default=False)
+    compacted = models.BooleanField(default=False)
+    cells = models.PositiveIntegerField()
+    delta = models.BinaryField()
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['version']
+        indexes = [models.Index(fields=['pattern', 'compacted', 'version'])]
+        constraints = [models.UniqueConstraint(fields=['pattern', 'version'], name='unique_pattern_edit_version')]
+
+    def __str__(self):
+        return f"Edit {self.version} ({self.kind}) of {self.section}/{self.plane} for {self.pattern_id}"
+
+
 class Swatch(models.Model):
     """
     Description: There can be many swatches per 1 user.
@@ -0,0 +1,32 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .tool_functions.grid_codec import GridPayload, encode_grid
+
+
+class PatternGridRenderer(BaseRenderer):
+    """
+    Renders a GridPayload as raw little-endian planes behind a small JSON header,
+    see tool_functions.grid_codec. Chosen with 'Accept: application/octet-stream' or ?format=bin.
+    Any other data, e.g. an error response, is rendered as JSON.
+    """
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, GridPayload):
+            return encode_grid(data.planes, **data.meta)
+
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+class PatternRLERenderer(JSONRenderer):
+    """
+    JSON with every plane run-length encoded per row, chosen with ?format=rle.
+    The views build the encoded planes, see grid_codec.rle_encode.
+    """
+    format = 'rle'
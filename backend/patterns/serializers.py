@@ -1,7 +1,7 @@
 from re import fullmatch
 
 from rest_framework import serializers
-from .models import Pattern, Swatch, Torso_Projection, Sleeve_Projection, SeparatedSweater
+from .models import Pattern, Swatch, Torso_Projection, Sleeve_Projection, SeparatedSweater, CompileJob, PatternEdit
 
 
 def set_default_if_none(instance, data):
@@ -18,7 +18,25 @@ def set_default_if_none(instance, data):
 class GetPatternSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pattern
-        fields = ['id', 'name', 'content', 'created_on', 'edited_on']
+        fields = ['id', 'name', 'content', 'created_on', 'edited_on', 'thumbnail']
+
+
+class CompileJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    pattern_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = CompileJob
+        fields = ['job_id', 'pattern_id', 'status', 'error', 'attempts', 'created_on', 'started_on', 'finished_on']
+
+
+class PatternEditSerializer(serializers.ModelSerializer):
+    reverts = serializers.IntegerField(source='reverts.version', read_only=True, default=None)
+    author = serializers.CharField(source='author.username', read_only=True, default=None)
+
+    class Meta:
+        model = PatternEdit
+        fields = ['version', 'batch', 'section', 'plane', 'kind', 'reverts', 'undone', 'compacted', 'cells', 'author', 'created_on']
 
 
 class SwatchSerializer(serializers.ModelSerializer):
@@ -1,4 +1,4 @@
-from ...tool_functions import tool_functions as tf
+from ...tool_functions import rasterizer, shaping
 
 
 class Neck:
@@ -37,51 +37,42 @@ class Neck:
         half_stitches = self.stitches // 2  # We only need half the stitches for one side of the neck
         remaining_rows = self.rows - self.offset_rows  # Number of decreasing rows
 
-        # Decrease Arrays
+        # Decrease Schedule
         print('half_stitches', half_stitches)
-        self.stitches_decrease = tf.create_stitch_decreases(half_stitches)
-
         print('remaining_rows', remaining_rows)
-        self.rows_decrease = [self.offset_rows] + tf.create_row_decreases(remaining_rows,
-                                                                          len(self.stitches_decrease) - 1)
+        self.schedule = shaping.neck_schedule(half_stitches, self.offset_rows, remaining_rows)
+        self.stitches_decrease = self.schedule.stitches
+        self.rows_decrease = self.schedule.rows
 
         print('stitches_decrease', self.stitches_decrease)
         print('rows_decrease', self.rows_decrease)
 
+    def geometry_key(self):
+        # Everything outline_paths depends on, used to key the shape cache
+        return self.starting_stitch, self.stitches, self.total_stitches, self.schedule.key()
+
+    def outline_paths(self):
+        # Left part of the top edge
+        left_edge = [(0, 0), (self.starting_stitch - 1, 0)]
+
+        # Left side steps down the rows then across the stitches of each decrease
+        left_line_vertices = self.schedule.staircase(self.starting_stitch, 0)
+        print(f'Left vertices: {left_line_vertices.tolist()}')
+
+        # Right side mirrors it back up to the top edge
+        x, y = left_line_vertices[-1]
+        right_line_vertices = self.schedule.staircase(x, y, y_step=-1, rows_first=False, reverse=True)
+        print(f'Right vertices: {right_line_vertices.tolist()}')
+
+        # Right part of the top edge
+        right_edge = [(self.starting_stitch + self.stitches, 0), (self.total_stitches - 1, 0)]
+
+        return [left_edge, left_line_vertices, right_line_vertices, right_edge]
+
+    def outline_segments(self):
+        # (N, 4) array of x0, y0, x1, y1 segments for the outline
+        return rasterizer.paths_to_segments(self.outline_paths())
+
     def add_to_array(self, array):
-        # Draw the left part of the neckline
-        x_0, y_0 = 0, 0
-        x_1, y_1 = self.starting_stitch - 1, 0
-        tf.draw_path_on_array(array, [(x_0, y_0), (x_1, y_1)])
-
-        # Build and Draw Neckline
-        x = self.starting_stitch  # set start x
-        y = 0  # set start y
-
-        # Create Vertices for left side
-        left_line_vertices = [(x, y)]
-        for i in range(len(self.rows_decrease)):
-            y += self.rows_decrease[i]
-            left_line_vertices.append((x, y))
-            x += self.stitches_decrease[i]
-            left_line_vertices.append((x, y))
-        print(f'Left vertices: {left_line_vertices}')
-
-        # Create Vertices for right side
-        right_line_vertices = [(x, y)]
-        for i in range(len(self.rows_decrease) - 1, -1, -1):
-            x += self.stitches_decrease[i]
-            right_line_vertices.append((x, y))
-            y -= self.rows_decrease[i]
-            right_line_vertices.append((x, y))
-        print(f'Right vertices: {right_line_vertices}')
-
-        # Add left side of neckline to array
-        tf.draw_path_on_array(array, left_line_vertices)
-        # Add right side of neckline to array
-        tf.draw_path_on_array(array, right_line_vertices)
-
-        # Draw the right part of the neckline
-        x_0, y_0 = self.starting_stitch + self.stitches, 0
-        x_1, y_1 = self.total_stitches - 1, 0
-        tf.draw_path_on_array(array, [(x_0, y_0), (x_1, y_1)])
+        # Draw the top edge and both sides of the neckline
+        rasterizer.draw_segments(array, self.outline_segments())
@@ -2,7 +2,8 @@ from pathlib import Path
 import numpy as np
 
 from ..pattern_objects import Ribbing, Taper, Neck
-from ...tool_functions import tool_functions as tf
+from ...tool_functions import tool_functions as tf, rasterizer
+from ...tool_functions.shape_cache import shape_cache
 
 
 class Part:
@@ -37,7 +38,7 @@ class Part:
 
         self.debug_mode = True  # debug!
 
-    async def do_calculations(self, SPI, RPI, needle_size):
+    def do_calculations(self, SPI, RPI, needle_size):
         self.SPI = SPI
         self.RPI = RPI
         self.stitches = round(self.width*self.SPI)
@@ -71,19 +72,21 @@ class Part:
         if self.neck_offset_width != 0 and self.neck_offset_height != 0 and self.neck_depth != 0:
             self.neck = Neck(self.neck_offset_width, self.neck_offset_height, self.neck_depth, self.width, self.height, self.stitches, self.rows)
 
-    def build_array(self):
-        if self.debug_mode:
-            print(f'\nInitializing array of size {self.stitches}x{self.rows}')
-        array = tf.initialize_array(self.stitches, self.rows)
+    def shape_key(self):
+        # Computed stitch/row counts and shaping schedules; equal keys give equal shape planes
+        return (
+            self.stitches,
+            self.rows,
+            self.working_rows,
+            self.ribbing.geometry_key() if self.ribbing else None,
+            self.taper.geometry_key() if self.taper else None,
+            self.neck.geometry_key() if self.neck else None,
+        )
 
-        if self.ribbing:
-            if self.taper:
-                self.ribbing.add_to_array(array, hem_stitches=self.taper.hem_stitches, taper_style=self.taper.taper_style)
-            else:
-                self.ribbing.add_to_array(array)
+    def outline_paths(self):
+        paths = []
 
         # Define the top edge of the torso (including neckline, if applicable)
-        x_0, y_0 = 0, 0
         if self.neck:
             # Debug: Print starting stitch, rows decrease, and stitches decrease for the neckline
             if self.debug_mode:
@@ -91,35 +94,63 @@ class Part:
                 print(f'rows_decrease: {self.neck.rows_decrease}')
                 print(f'stitches_decrease: {self.neck.stitches_decrease}')
 
-            # Draw Neck Line
-            self.neck.add_to_array(array)
+            # Neck Line
+            paths += self.neck.outline_paths()
         else:
             x_0, y_0 = 0, 0
             x_1, y_1 = self.stitches - 1, 0
-            tf.draw_path_on_array(array, [(x_0, y_0), (x_1, y_1)])
+            paths.append([(x_0, y_0), (x_1, y_1)])
 
         if self.taper:
-            # Draw Taper Line
-            self.taper.add_to_array(array)
+            # Taper Line
+            paths += self.taper.outline_paths()
         else:
             # Define the sides and bottom edge of the torso
             x_left, y_bottom = 0, self.working_rows - 1
             x_right = self.stitches - 1
 
-            # Draw left edge
-            tf.draw_path_on_array(array, [(0, 0), (x_left, y_bottom)])
+            # Left edge
+            paths.append([(0, 0), (x_left, y_bottom)])
 
-            # Draw right edge
-            tf.draw_path_on_array(array, [(x_right, 0), (x_right, y_bottom)])
+            # Right edge
+            paths.append([(x_right, 0), (x_right, y_bottom)])
 
-            # Draw bottom edge
-            tf.draw_path_on_array(array, [(0, y_bottom), (x_right, y_bottom)])
+            # Bottom edge
+            paths.append([(0, y_bottom), (x_right, y_bottom)])
 
-        # Fill outside to -1
-        tf.flood_fill_outside(array)
+        return paths
+
+    def outline_segments(self):
+        # (N, 4) array of x0, y0, x1, y1 segments for the whole outline
+        return rasterizer.paths_to_segments(self.outline_paths())
+
+    def build_array(self, use_cache: bool = True):
+        if self.debug_mode:
+            print(f'\nInitializing array of size {self.stitches}x{self.rows}')
+        array = tf.initialize_array(self.stitches, self.rows)
+
+        # Reuse the shape plane of an identical piece if one was already built
+        if use_cache:
+            array['shape'] = shape_cache.get_or_build(self.shape_key(), lambda: self.draw_shape(array))
+            if self.debug_mode:
+                print(f'Shape cache: {shape_cache.info()}')
+        else:
+            self.draw_shape(array)
 
         return array
 
+    def draw_shape(self, array):
+        # Rasterizes the piece into array, returns its shape plane
+        if self.ribbing:
+            if self.taper:
+                self.ribbing.add_to_array(array, hem_stitches=self.taper.hem_stitches, taper_style=self.taper.taper_style)
+            else:
+                self.ribbing.add_to_array(array)
+
+        # Draw the outline and fill outside to 0
+        rasterizer.rasterize(array, self.outline_segments())
+        return array['shape']
+
     # Should be broken in this version
     def save_as_array(self, path, part_name):
         if self.debug_mode:
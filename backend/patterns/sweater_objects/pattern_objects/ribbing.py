@@ -40,6 +40,10 @@ class Ribbing:
             print("Working_rows,", parent.working_rows, "\nWorking_Height,", parent.working_height)
             print("RPI,", parent.RPI, "\nrows,", parent.rows, "\nHeight,", parent.height)
 
+    def geometry_key(self):
+        # Everything add_to_array depends on, apart from the taper's hem
+        return self.rows, self.working_rows, self.total_stitches
+
     def add_to_array(self, array, hem_stitches=None, taper_style=None):  # hem_stitches is width of hem
         # Calculate hem offset
         if hem_stitches is not None:
@@ -1,7 +1,7 @@
-import asyncio
 from pathlib import Path
 from ..mappers import map_swatch_model_to_class, map_torso_model_to_classes, map_sleeve_model_to_classes
 from ..tool_functions import KnittingConversions as knitC, tool_functions as tf
+from ..tool_functions.compile_executor import CompileExecutor
 from PIL import Image
 
 from django.conf import settings
@@ -20,32 +20,29 @@ class Sweater:
         self.image_paths = None
         self.sweater_id = sweater_info.id
 
-    async def do_calculations(self):
+    def do_calculations(self, executor: CompileExecutor = None):
         # Calculate per inch vals
         self.SPI, self.RPI = knitC.calculate_spi(swatch=self.swatch)
 
-        # Run torso and sleeve calculations asynchronously
-        await asyncio.gather(
-            self.front_torso.do_calculations(self.SPI, self.RPI, self.needle_size),
-            self.back_torso.do_calculations(self.SPI, self.RPI, self.needle_size),
-            self.left_sleeve.do_calculations(self.SPI, self.RPI, self.needle_size),
-            self.right_sleeve.do_calculations(self.SPI, self.RPI, self.needle_size)
-        )
+        # Stitch/row counts and shaping schedules are cheap, work them out in order
+        for part in self.parts():
+            part.do_calculations(self.SPI, self.RPI, self.needle_size)
 
         # Build and return arrays
-        return self.build_arrays()
+        return self.build_arrays(executor)
 
     def getSpi(self):
         return self.SPI, self.RPI
 
-    def build_arrays(self):
-        front_torso_array = self.front_torso.build_array()
-        back_torso_array = self.back_torso.build_array()
-        left_sleeve_array = self.left_sleeve.build_array()
-        right_sleeve_array = self.right_sleeve.build_array()
+    def parts(self):
+        return self.front_torso, self.back_torso, self.left_sleeve, self.right_sleeve
 
-        # Once they have been saved load images
-        return front_torso_array, back_torso_array, left_sleeve_array, right_sleeve_array
+    def build_arrays(self, executor: CompileExecutor = None):
+        if executor is None:
+            return tuple(part.build_array() for part in self.parts())
+
+        # Rasterizing is the CPU-bound part, spread it over the executor's workers
+        return tuple(executor.compile(self.parts()))
 
     # Depreciated
     def save_arrays(self):
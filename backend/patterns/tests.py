@@ -1,30 +1,1151 @@
-from django.test import TestCase, RequestFactory
+import asyncio
+import contextlib
+import gzip
+import io
+import itertools
+import json
+import os
+import tempfile
+from datetime import timedelta
+from multiprocessing.shared_memory import SharedMemory
+from unittest import mock
+
+import boto3
+import numpy as np
+from asgiref.sync import async_to_sync
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, InMemoryStorage
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
 from django.contrib.auth import get_user_model
-from rest_framework.test import force_authenticate
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-from .models import Pattern
-from .views import recalculate_pattern
+from .consumers import live_pattern_socket, live_rooms
+from .models import CompileJob, SeparatedSweater, Swatch, Torso_Projection, Sleeve_Projection, PatternEdit
+from .tool_functions.benchmark import STAGES, load_presets, preset_parts, run_benchmark
+from .tool_functions.grid_codec import encode_grid, decode_grid, rle_encode, rle_decode, iter_grid_json, \
+    compress_chunks, negotiate_encoding
+from .tool_functions.grid_patch import GridPatch, PatchError
+from .tool_functions.pattern_grid import PLANES, PLANE_DTYPES, SECTIONS, LEGACY_DTYPE, PatternGrid, \
+    save_pattern_file, window_bounds, read_plane_window
+from .tool_functions.pattern_store import PatternStore
+from .tool_functions.object_storage import S3Objects
+from .tool_functions.plane_cache import PlaneCache
+from .tool_functions.rasterizer import FILL_METHODS, draw_paths, draw_segments, fill_outside, rasterize, \
+    segment_points
+from .tool_functions.shape_cache import shape_cache
+from .tool_functions.shaping import ShapingSchedule, even_distribution, front_loaded_distribution, \
+    triangular_distribution, taper_schedule
+from .tool_functions import compile_executor
+from .tool_functions.compile_executor import CompileExecutor, get_compile_executor
+from .tool_functions.services import claim_compile_job, compile_sweater_file, enqueue_compile, recompile_patterns, \
+    run_compile_job
+from .tool_functions.journal import CellChange, compact_journals, current_plane, record_edit, undo, \
+    write_color_map
+from .tool_functions.rendering import render_rgba
+from .tool_functions.thumbnails import render_thumbnail
+from .tool_functions.tool_functions import bresenham_line, draw_path_on_array, flood_fill_outside, \
+    initialize_array
+from PIL import Image
 
 User = get_user_model()
 
-# Useless right now
-class TestRecalculatePattern(TestCase):
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_sweater(user, name='Test Sweater', **torso):
+    sweater = SeparatedSweater.objects.create(author=user, name=name, content='')
+    Swatch.objects.create(pattern=sweater, user=user, width=4, height=4, stitches=18, rows=24, needle_size=4.5)
+    Torso_Projection.objects.create(sweater=sweater, **{'width': 20, 'height': 24, 'ribbing': 'normal',
+                                                        'neck_offset_width': 6, 'neck_offset_height': 1,
+                                                        'neck_depth': 3, **torso})
+    Sleeve_Projection.objects.create(sweater=sweater, width=14, height=20, ribbing='thin', taper_offset=2, taper_hem=8)
+    # Ids are reused once a test's transaction rolls back, the files of an earlier test's pattern aren't
+    PatternStore(sweater.id).delete()
+    return sweater
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestRecompilePatterns(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweaters = [create_sweater(self.user, name=f'Sweater {i}') for i in range(3)]
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+
+    def test_recompile_writes_every_section(self):
+        stats = recompile_patterns(SeparatedSweater.objects.all(), chunk_size=2, processes=1)
+        self.assertEqual(stats['done'], 3)
+        self.assertEqual(stats['failed'], 0)
+
+        sweater = SeparatedSweater.objects.get(id=self.sweaters[0].id)
+        store = PatternStore(sweater.id).load()
+        self.assertEqual(sweater.sweater_file.name, store.manifest_path)
+        self.assertEqual(store.sections(), list(SECTIONS))
+        front = store.read_section('front_torso')
+        self.assertEqual(front.shape, (round(24 * 6), round(20 * 4.5)))
+
+    def test_checkpoint_resumes_after_last_chunk(self):
+        recompile_patterns(SeparatedSweater.objects.filter(id__lte=self.sweaters[1].id), chunk_size=1,
+                           processes=1, checkpoint_path=self.checkpoint)
+        with open(self.checkpoint) as file:
+            self.assertEqual(json.load(file)['last_id'], self.sweaters[1].id)
+
+        # Only the pattern after the checkpoint is compiled on the rerun
+        stats = recompile_patterns(SeparatedSweater.objects.all(), processes=1, checkpoint_path=self.checkpoint)
+        self.assertEqual(stats['done'], 1)
+        self.assertEqual(stats['last_id'], self.sweaters[2].id)
+
+    def test_failures_are_recorded_without_stopping(self):
+        Swatch.objects.filter(pattern=self.sweaters[1]).update(width=0)
+
+        stats = recompile_patterns(SeparatedSweater.objects.all(), processes=1, checkpoint_path=self.checkpoint)
+        self.assertEqual(stats['done'], 2)
+        self.assertEqual(list(stats['errors']), [str(self.sweaters[1].id)])
+
+    def edit(self, sweater, section, plane, value):
+        store = PatternStore(sweater.id).load()
+        record_edit(store, section, plane, CellChange(np.array([0, 1]), np.array([0, 1]), np.array([value, value])))
+
+    def test_unchanged_pieces_keep_their_edits(self):
+        sweater = self.sweaters[0]
+        compile_sweater_file(sweater, get_compile_executor('serial'))
+        self.edit(sweater, 'front_torso', 'color', 3)
+        self.edit(sweater, 'left_sleeve', 'stitch_type', 2)
+        write_color_map(PatternStore(sweater.id).load(), ['#000', '#fff', '#f00', '#0f0'])
+
+        stats = recompile_patterns(SeparatedSweater.objects.filter(id=sweater.id), processes=1)
+        self.assertEqual((stats['done'], stats['skipped'], stats['discarded']), (1, 0, {}))
+        store = PatternStore(sweater.id).load()
+        self.assertEqual(store.color_map(), ['#000', '#fff', '#f00', '#0f0'])
+        self.assertEqual(current_plane(store, 'front_torso', 'color')[1, 1], 3)
+        self.assertEqual(current_plane(store, 'left_sleeve', 'stitch_type')[0, 0], 2)
+
+        # The journal is kept too, the last edit can still be undone
+        undo(store)
+        self.assertEqual(current_plane(PatternStore(sweater.id).load(), 'left_sleeve', 'stitch_type')[0, 0], 0)
+
+    def test_changed_pieces_with_edits_are_skipped_unless_discarded(self):
+        sweater = self.sweaters[0]
+        compile_sweater_file(sweater, get_compile_executor('serial'))
+        self.edit(sweater, 'front_torso', 'color', 3)
+        self.edit(sweater, 'left_sleeve', 'color', 4)
+        Torso_Projection.objects.filter(sweater=sweater).update(width=24)
+        patterns = SeparatedSweater.objects.filter(id=sweater.id)
+
+        stats = recompile_patterns(patterns, processes=1)
+        self.assertEqual((stats['done'], stats['skipped']), (0, 1))
+        self.assertEqual(stats['skipped_sections'], {str(sweater.id): ['front_torso']})
+        store = PatternStore(sweater.id).load()
+        self.assertEqual(store.section_shape('front_torso')[1], round(20 * 4.5))
+
+        stats = recompile_patterns(patterns, processes=1, discard_edits=True)
+        self.assertEqual((stats['done'], stats['skipped']), (1, 0))
+        self.assertEqual(stats['discarded'], {str(sweater.id): ['front_torso']})
+        store = PatternStore(sweater.id).load()
+        self.assertEqual(store.section_shape('front_torso')[1], round(24 * 4.5))
+        self.assertFalse(current_plane(store, 'front_torso', 'color').any())
+        # The sleeve's edit is folded into its planes, the journal before the recompile is closed
+        self.assertEqual(store.read_plane('left_sleeve', 'color')[1, 1], 4)
+        self.assertFalse(PatternEdit.objects.filter(pattern=sweater, compacted=False).exists())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestCompileJobs(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.cookies['sessionid'] = 'session'
+
+    def test_each_job_is_claimed_once(self):
+        first, second = (enqueue_compile(create_sweater(self.user, name=f'Sweater {i}')) for i in range(2))
+
+        claimed = [claim_compile_job(), claim_compile_job()]
+        self.assertEqual([job.id for job in claimed], [first.id, second.id])
+        self.assertTrue(all(job.status == CompileJob.RUNNING and job.attempts == 1 for job in claimed))
+        self.assertIsNone(claim_compile_job())
+
+    def test_stale_running_jobs_are_claimed_again(self):
+        job = enqueue_compile(create_sweater(self.user))
+        claim_compile_job()
+        self.assertIsNone(claim_compile_job(stale_after=timedelta(minutes=10)))
+
+        # A worker killed mid-compile leaves its job running
+        CompileJob.objects.filter(id=job.id).update(started_on=timezone.now() - timedelta(hours=1))
+        reclaimed = claim_compile_job(stale_after=timedelta(minutes=10))
+        self.assertEqual((reclaimed.id, reclaimed.status, reclaimed.attempts), (job.id, CompileJob.RUNNING, 2))
+        self.assertIsNone(claim_compile_job(stale_after=timedelta(minutes=10)))
+
+    def test_run_records_whether_the_compile_finished(self):
+        done = enqueue_compile(create_sweater(self.user, name='Sweater 0'))
+        failed = enqueue_compile(create_sweater(self.user, name='Sweater 1'))
+        Swatch.objects.filter(pattern=failed.pattern).update(width=0)
+
+        for job in (claim_compile_job(), claim_compile_job()):
+            run_compile_job(job, get_compile_executor('serial'))
+
+        done.refresh_from_db()
+        self.assertEqual((done.status, done.error), (CompileJob.DONE, ''))
+        self.assertIsNotNone(done.finished_on)
+        self.assertEqual(PatternStore(done.pattern_id).load().sections(), list(SECTIONS))
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, CompileJob.FAILED)
+        self.assertIn('division', failed.error)
+        self.assertIsNotNone(failed.finished_on)
+
+    def test_compile_pattern_queues_a_job(self):
+        response = self.client.post('/api/pattern-compile/', {
+            'pattern_type': 'SeparatedSweater', 'name': 'Queued', 'content': 'A queued sweater',
+            'swatch': {'width': 4, 'height': 4, 'stitches': 18, 'rows': 24, 'needle_size': 4.5},
+            'torso_projection': {'width': 20, 'height': 24, 'ribbing': 'normal', 'neck_offset_width': 6,
+                                 'neck_offset_height': 1, 'neck_depth': 3},
+            'sleeve_projection': {'width': 14, 'height': 20, 'ribbing': 'thin', 'taper_offset': 2, 'taper_hem': 8},
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = CompileJob.objects.get(id=response.json()['job_id'])
+        self.assertEqual((job.pattern_id, job.status), (response.json()['pattern_id'], CompileJob.QUEUED))
+
+    def test_job_status_is_scoped_to_the_author(self):
+        job = enqueue_compile(create_sweater(self.user))
+        run_compile_job(claim_compile_job(), get_compile_executor('serial'))
+
+        response = self.client.get(f'/api/compile-jobs/{job.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['job_id'], response.json()['status']), (job.id, CompileJob.DONE))
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='stranger', password='123'))
+        self.assertEqual(other.get(f'/api/compile-jobs/{job.id}').status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestGridConditionalGet(TestCase):
     def setUp(self):
-        # Create a test user and pattern (assumes the `Pattern` model and other dependencies exist)
-        self.user, created = User.objects.get_or_create(username='admin', defaults={'password': '123'})
-        self.factory = RequestFactory()
-        self.pattern = Pattern.objects.get(id=12)
-        print(self.pattern)
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweater = create_sweater(self.user)
+        compile_sweater_file(self.sweater, get_compile_executor('serial'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/patterns/{self.sweater.id}/file-mode'
+        self.params = {'section': 'front_torso', 'view_mode': 'color'}
+
+    def test_unchanged_grid_is_not_resent(self):
+        response = self.client.get(self.url, self.params)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Each plane and format has its own ETag
+        other = self.client.get(self.url, {**self.params, 'view_mode': 'shape'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other.status_code, 200)
+
+        self.client.post(f'/api/patterns/{self.sweater.id}/save_changes',
+                         {**self.params, 'patch': {'cells': {'rows': [0], 'cols': [0], 'values': 1}}}, format='json')
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestAsyncGridViews(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweater = create_sweater(self.user)
+        compile_sweater_file(self.sweater, get_compile_executor('serial'))
+        self.url = f'/api/patterns/{self.sweater.id}'
+
+    def test_asgi_saves_and_streamed_reads(self):
+        async def session():
+            client = AsyncClient()
+            await client.aforce_login(self.user)
+            saved = await client.post(f'{self.url}/save_changes',
+                                      {'section': 'front_torso', 'view_mode': 'color',
+                                       'patch': {'cells': {'rows': [0], 'cols': [0], 'values': 7}}},
+                                      content_type='application/json')
+            response = await client.get(f'{self.url}/file-mode', {'section': 'front_torso', 'view_mode': 'color'},
+                                        headers={'Accept-Encoding': 'gzip'})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+            return saved.json(), response, body
+
+        saved, response, body = async_to_sync(session)()
+        # Encoded block by block off the event loop, not collected into one body first
+        self.assertTrue(response.is_async)
+        data = json.loads(gzip.decompress(body))['mode_data']
+        self.assertEqual((data['version'], data['color'][0][0]), (saved['version'], 7))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestGridFormats(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweater = create_sweater(self.user)
+        compile_sweater_file(self.sweater, get_compile_executor('serial'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/patterns/{self.sweater.id}'
+        self.client.post(f'{self.url}/save_changes', {'section': 'front_torso', 'view_mode': 'color',
+                                                       'patch': {'cells': {'rows': [2], 'cols': [3], 'values': 7}}},
+                         format='json')
+        store = PatternStore(self.sweater.id).load()
+        self.planes = {plane: current_plane(store, 'front_torso', plane) for plane in PLANES}
+
+    def test_binary_planes_round_trip(self):
+        for params, headers in (({}, {'HTTP_ACCEPT': 'application/octet-stream'}), ({'format': 'bin'}, {})):
+            response = self.client.get(f'{self.url}/file', {'section': 'front_torso', **params}, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/octet-stream')
 
-    def test_recalculate_pattern(self):
-        # Simulate a POST request with the pattern ID
-        request = self.factory.post(f'/api/pattern-view/{self.pattern.id}/')
+            planes, header = decode_grid(response.content)
+            self.assertEqual(list(planes), list(PLANES))
+            for plane, data in planes.items():
+                self.assertEqual(data.dtype, PLANE_DTYPES[plane])
+                np.testing.assert_array_equal(data, self.planes[plane])
+            self.assertEqual(planes['color'][2, 3], 7)
+            self.assertIn('version', header)
 
-        force_authenticate(request, user=self.user)
+        # Errors stay JSON
+        response = self.client.get(f'{self.url}/file', {'section': 'collar', 'format': 'bin'})
+        self.assertEqual((response.status_code, response['Content-Type']), (400, 'application/json'))
 
-        # Call view function and pass pattern ID
-        response = recalculate_pattern(request, pattern_id=self.pattern.id)
+    def test_rle_planes_round_trip(self):
+        response = self.client.get(f'{self.url}/file-mode', {'section': 'front_torso', 'view_mode': 'color',
+                                                             'format': 'rle'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        data = response.json()['mode_data']
+        self.assertEqual(data['encoding'], 'rle')
+        self.assertIn('color_map', data)
+        np.testing.assert_array_equal(rle_decode(data['color'], PLANE_DTYPES['color']), self.planes['color'])
 
-        # Assert the response status code is 200
+    def test_windows_hold_just_their_cells(self):
+        height, width = self.planes['shape'].shape
+        window = {'row_start': 1, 'row_end': 4, 'col_start': 2, 'col_end': width + 10}
+        response = self.client.get(f'{self.url}/file', {'section': 'front_torso', **window})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['message'], "Pattern recalculated successfully")
+
+        data = json.loads(b''.join(response.streaming_content))['file_data']
+        self.assertEqual(data['window'], {'row_start': 1, 'row_end': 4, 'col_start': 2, 'col_end': width,
+                                          'height': height, 'width': width})
+        for plane in PLANES:
+            np.testing.assert_array_equal(data[plane], self.planes[plane][1:4, 2:])
+
+        # Binary windows carry their bounds in the header
+        response = self.client.get(f'{self.url}/file-mode', {'section': 'front_torso', 'view_mode': 'color',
+                                                             'format': 'bin', **window})
+        planes, header = decode_grid(response.content)
+        np.testing.assert_array_equal(planes['color'], self.planes['color'][1:4, 2:])
+        self.assertEqual(header['window']['col_end'], width)
+
+    def test_empty_windows_are_rejected(self):
+        height, width = self.planes['shape'].shape
+        for window in ({'row_start': 5, 'row_end': 2}, {'col_start': 3, 'col_end': 3}, {'row_start': height},
+                       {'col_start': width + 1, 'col_end': width + 5}, {'row_end': 0}, {'row_start': -1}):
+            for view in ('file', 'file-mode'):
+                response = self.client.get(f'{self.url}/{view}', {'section': 'front_torso', 'view_mode': 'color',
+                                                                  **window})
+                self.assertEqual(response.status_code, 400, (view, window))
+                self.assertIn('error', response.json())
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestEditJournal(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweater = create_sweater(self.user)
+        compile_sweater_file(self.sweater, get_compile_executor('serial'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/patterns/{self.sweater.id}'
+
+    def save(self, view_mode, rows, cols, values, patch_rects=(), **extra):
+        patch = {'cells': {'rows': rows, 'cols': cols, 'values': values}, 'rects': list(patch_rects)}
+        return self.client.post(f'{self.url}/save_changes', {'section': 'front_torso', 'view_mode': view_mode,
+                                                              'patch': patch, **extra},
+                                format='json').json()['version']
+
+    def read(self, view_mode):
+        response = self.client.get(f'{self.url}/file-mode', {'section': 'front_torso', 'view_mode': view_mode})
+        return np.array(json.loads(b''.join(response.streaming_content))['mode_data'][view_mode])
+
+    def test_undo_redo_and_restore(self):
+        original = self.read('color')
+        first = self.save('color', [0, 1], [0, 1], 7)
+        self.save('color', [1, 2], [1, 2], 9)
+        self.save('shape', [3], [3], 5)
+        edited = self.read('color')
+        self.assertEqual(edited[1, 1], 9)
+
+        # Undo takes back the shape edit, then the last color edit, and redo puts it back
+        self.client.post(f'{self.url}/undo')
+        self.client.post(f'{self.url}/undo')
+        self.assertEqual(self.read('color')[1, 1], 7)
+        self.assertEqual(self.client.post(f'{self.url}/redo').status_code, 200)
+        np.testing.assert_array_equal(self.read('color'), edited)
+        self.client.post(f'{self.url}/redo')
+        self.assertEqual(self.read('shape')[3, 3], 5)
+
+        # Restoring before the first edit spans both planes, and is undone as one step
+        response = self.client.post(f'{self.url}/restore', {'version': first - 1}, format='json')
+        self.assertEqual({edit['plane'] for edit in response.json()['edits']}, {'color', 'shape'})
+        np.testing.assert_array_equal(self.read('color'), original)
+        self.client.post(f'{self.url}/undo')
+        np.testing.assert_array_equal(self.read('color'), edited)
+        self.assertEqual(self.read('shape')[3, 3], 5)
+
+        self.assertEqual(self.client.post(f'{self.url}/restore', {'version': 100}, format='json').status_code, 409)
+        history = self.client.get(f'{self.url}/history').json()['edits']
+        self.assertEqual([edit['kind'] for edit in history[:4]], ['undo', 'undo', 'restore', 'restore'])
+
+    def test_journal_endpoints_are_scoped_to_the_author(self):
+        self.save('color', [0], [0], 7)
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='stranger', password='123'))
+        for endpoint in ('undo', 'redo', 'restore'):
+            self.assertEqual(other.post(f'{self.url}/{endpoint}', {'version': 0}, format='json').status_code, 404)
+        self.assertEqual(other.get(f'{self.url}/history').status_code, 404)
+        self.assertEqual(self.read('color')[0, 0], 7)
+        self.assertEqual(PatternEdit.objects.filter(pattern=self.sweater).count(), 1)
+
+    def test_concurrent_saves_merge_unless_cells_overlap(self):
+        response = self.client.get(f'{self.url}/file', {'section': 'front_torso'})
+        base = json.loads(b''.join(response.streaming_content))['file_data']['version']
+        self.save('color', [0], [0], 7, base_version=base)
+        self.save('color', [5], [5], 8, base_version=base)
+        color = self.read('color')
+        self.assertEqual((color[0, 0], color[5, 5]), (7, 8))
+
+        # Another save made on the same base may not overwrite either cell
+        response = self.client.post(f'{self.url}/save_changes', {
+            'section': 'front_torso', 'view_mode': 'color', 'base_version': base,
+            'patch': {'cells': {'rows': [5, 6], 'cols': [5, 6], 'values': 9}}}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([edit['version'] for edit in response.json()['conflicts']], [base + 2])
+        np.testing.assert_array_equal(self.read('color'), color)
+
+    def test_saves_only_read_the_cells_they_write(self):
+        response = self.client.get(f'{self.url}/file', {'section': 'front_torso'})
+        base = json.loads(b''.join(response.streaming_content))['file_data']['version']
+        self.save('color', [0, 1], [0, 1], 7)
+
+        with mock.patch.object(PatternStore, 'read_plane', side_effect=AssertionError('read the whole plane')), \
+                mock.patch('patterns.tool_functions.journal.touch_pattern') as touch:
+            # Writing the value a cell had at base_version leaves a newer edit of it alone
+            version = self.save('color', [0, 1, 2], [0, 0, 2], [0, 5, 5], base_version=base,
+                                patch_rects=[[3, 3, 2, 2, 4]])
+        self.assertEqual(touch.call_count, 1)
+
+        entry = PatternEdit.objects.get(pattern=self.sweater, version=version)
+        self.assertEqual(entry.cells, 6)
+        color = self.read('color')
+        self.assertEqual((color[0, 0], color[1, 1], color[1, 0], color[2, 2]), (7, 7, 5, 5))
+        self.assertTrue((color[3:5, 3:5] == 4).all())
+
+    def test_concurrent_color_maps_merge_unless_ids_differ(self):
+        def save_colors(row, colors):
+            return self.client.post(f'{self.url}/save_changes', {
+                'section': 'front_torso', 'view_mode': 'color', 'base_version': 0,
+                'color_map': {'idToColorArray': colors},
+                'patch': {'cells': {'rows': [row], 'cols': [0], 'values': len(colors) - 1}}}, format='json')
+
+        def stored():
+            return PatternStore(self.sweater.id).load().color_map()['idToColorArray']
+
+        self.assertEqual(save_colors(0, ['#ff0000']).status_code, 200)
+        # Colors appended on top of the stored ones are kept, as are stored ones a stale save lacks
+        self.assertEqual(save_colors(1, ['#ff0000', '#00ff00']).status_code, 200)
+        self.assertEqual(save_colors(2, ['#ff0000']).status_code, 200)
+        self.assertEqual(stored(), ['#ff0000', '#00ff00'])
+
+        response = save_colors(3, ['#0000ff'])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(stored(), ['#ff0000', '#00ff00'])
+        self.assertEqual(self.read('color')[3, 0], 0)
+
+    def test_compaction_folds_entries_into_planes(self):
+        self.save('color', [0], [0], 7)
+        self.save('shape', [4], [2], 3)
+        edited = self.read('shape')
+
+        self.assertEqual(compact_journals(min_entries=2), {self.sweater.id: 2})
+        store = PatternStore(self.sweater.id).load()
+        np.testing.assert_array_equal(store.read_plane('front_torso', 'shape'), edited)
+        self.assertEqual(store.read_plane('front_torso', 'color')[0, 0], 7)
+        np.testing.assert_array_equal(self.read('shape'), edited)
+
+        # Compacted entries can still be undone
+        self.client.post(f'{self.url}/undo')
+        self.assertNotEqual(self.read('shape')[4, 2], 3)
+
+        # Edits made before a recompile that changed the piece belong to the old planes
+        Torso_Projection.objects.filter(sweater=self.sweater).update(width=24)
+        compile_sweater_file(SeparatedSweater.objects.get(id=self.sweater.id), get_compile_executor('serial'),
+                             discard_edits=True)
+        self.assertEqual(self.client.post(f'{self.url}/undo').status_code, 409)
+
+
+class LiveSocket:
+    """
+    Test client for live_pattern_socket, speaking the ASGI WebSocket protocol.
+    """
+    def __init__(self, path, cookie):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {'type': 'websocket', 'path': path, 'headers': [(b'cookie', cookie.encode())]}
+        self.task = asyncio.create_task(live_pattern_socket(scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return (await self.outgoing.get())['type']
+
+    async def send(self, **message):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(message)})
+
+    async def receive(self, kind):
+        # Next message of a kind, skipping others
+        while True:
+            message = json.loads((await asyncio.wait_for(self.outgoing.get(), 5))['text'])
+            if message['type'] == kind:
+                return message
+
+    async def close(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await self.task
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestThumbnails(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweater = create_sweater(self.user)
+        compile_sweater_file(self.sweater, get_compile_executor('serial'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_palette_lookup(self):
+        shape = np.array([[0, 1, 2], [3, 1, 1]], dtype=np.int8)
+        color = np.array([[1, 1, 1], [0, 7, 2]], dtype=np.int16)
+        rgba = render_rgba(shape, color, {'idToColorArray': ['#ff0000', '#00ff00', 'not a color']})
+        # Outside stays transparent, unmapped ids fall back to the shape's color
+        self.assertEqual(rgba.tolist(), [[[0, 0, 0, 0], [0, 255, 0, 255], [0, 255, 0, 255]],
+                                         [[255, 0, 0, 255], [255, 255, 255, 255], [255, 255, 255, 255]]])
+
+    def test_compile_and_saves_render_thumbnails(self):
+        compiled = self.client.get('/api/user-patterns/').json()[0]['thumbnail']
+        self.sweater.refresh_from_db()
+        self.assertTrue(compiled.endswith(self.sweater.thumbnail.name))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(f'/api/patterns/{self.sweater.id}/save_changes',
+                             {'section': 'front_torso', 'view_mode': 'color', 'color_map': {'idToColorArray': ['#ff0000']},
+                              'patch': {'cells': {'rows': [0], 'cols': [0], 'values': 0}}}, format='json')
+        self.assertEqual(len(callbacks), 1)
+
+        # Rendered here instead of on the background thread, which can't see the test's transaction
+        previous = self.sweater.thumbnail.name
+        name = render_thumbnail(self.sweater.id)
+        self.assertNotEqual(name, previous)
+        self.assertFalse(default_storage.exists(previous))
+        with default_storage.open(name) as file:
+            image = Image.open(file)
+            self.assertLessEqual(max(image.size), 256)
+            self.assertIn((255, 0, 0, 255), [color for _, color in image.getcolors(1 << 16)])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestLivePatternSocket(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='knitter', password='123')
+        self.sweater = create_sweater(self.user)
+        compile_sweater_file(self.sweater, get_compile_executor('serial'))
+        self.client.force_login(self.user)
+        self.cookie = f'sessionid={self.client.cookies["sessionid"].value}'
+        self.path = f'/api/patterns/{self.sweater.id}/live'
+
+    def test_edits_are_broadcast_and_flushed_to_the_journal(self):
+        async def session():
+            editor, viewer = LiveSocket(self.path, self.cookie), LiveSocket(self.path, self.cookie)
+            self.assertEqual(await editor.connect(), 'websocket.accept')
+            await viewer.connect()
+
+            await viewer.send(type='load', section='front_torso', plane='color')
+            self.assertEqual((await viewer.receive('plane'))['data'][0][0], 0)
+
+            await editor.send(type='edit', section='front_torso', plane='color', id=1,
+                              patch={'cells': {'rows': [0, 1], 'cols': [0, 1], 'values': 7}})
+            self.assertEqual((await editor.receive('ack'))['id'], 1)
+            delta = await viewer.receive('delta')
+            self.assertEqual(delta['patch']['cells'], {'rows': [0, 1], 'cols': [0, 1], 'values': 7})
+
+            await editor.send(type='edit', section='front_torso', plane='color', id=2, patch={'cells': {'rows': [999]}})
+            self.assertEqual((await editor.receive('error'))['id'], 2)
+
+            await editor.send(type='flush')
+            saved = await viewer.receive('saved')
+            await editor.close()
+            await viewer.close()
+            return saved
+
+        saved = async_to_sync(session)()
+        edit = PatternEdit.objects.get(pattern=self.sweater)
+        self.assertEqual((edit.version, edit.cells, edit.author), (saved['version'], 2, self.user))
+
+    @override_settings(PATTERN_LIVE_FLUSH_SECONDS=0.05)
+    def test_bad_messages_and_failed_flushes_keep_edits(self):
+        def unavailable():
+            raise OSError('storage unavailable')
+
+        async def session():
+            editor = LiveSocket(self.path, self.cookie)
+            await editor.connect()
+            await editor.send(type='edit', section=['front_torso'], plane='color', id=1, patch={})
+            self.assertEqual((await editor.receive('error'))['id'], 1)
+
+            room = live_rooms[self.sweater.id]
+            room.session.flush = unavailable
+            await editor.send(type='edit', section='front_torso', plane='color', id=2,
+                              patch={'cells': {'rows': [0], 'cols': [0], 'values': 7}})
+            await editor.receive('ack')
+            await editor.close()
+            # The last viewer left, but the room stays until its edits are journaled
+            self.assertIs(live_rooms.get(self.sweater.id), room)
+
+            del room.session.flush
+            for _ in range(100):
+                if self.sweater.id not in live_rooms:
+                    break
+                await asyncio.sleep(0.05)
+
+        async_to_sync(session)()
+        self.assertNotIn(self.sweater.id, live_rooms)
+        self.assertEqual(PatternEdit.objects.get(pattern=self.sweater).cells, 1)
+
+    def test_sockets_to_patterns_of_others_are_refused(self):
+        other = User.objects.create_user(username='stranger', password='123')
+        self.client.force_login(other)
+        cookie = f'sessionid={self.client.cookies["sessionid"].value}'
+
+        async def connect():
+            return await LiveSocket(self.path, cookie).connect()
+
+        self.assertEqual(async_to_sync(connect)(), 'websocket.close')
+        self.assertNotIn(self.sweater.id, live_rooms)
+
+    def test_sockets_without_a_session_are_refused(self):
+        async def connect():
+            return await LiveSocket(self.path, '').connect()
+
+        self.assertEqual(async_to_sync(connect)(), 'websocket.close')
+
+
+class TestGeometryBenchmark(SimpleTestCase):
+    def test_every_stage_is_timed(self):
+        results = run_benchmark(gauges=[0.5], repeat=1)
+        self.assertEqual(set(results['totals']), set(STAGES))
+        self.assertTrue(results['results'])
+        for result in results['results']:
+            self.assertGreater(result['rows'] * result['stitches'], 0)
+            self.assertGreater(result['stages']['fill']['median'], 0)
+
+
+class TestShapeCache(SimpleTestCase):
+    def test_identical_parts_are_rasterized_once(self):
+        _, _, size_data = next(load_presets())
+        parts = [preset_parts(size_data)['left_sleeve'] for _ in range(2)]
+        shape_cache.clear()
+        hits, misses = shape_cache.hits, shape_cache.misses
+        with contextlib.redirect_stdout(io.StringIO()):
+            for part in parts:
+                part.do_calculations(5, 6, 4.5)
+            built, cached = (part.build_array()['shape'] for part in parts)
+            uncached = parts[0].build_array(use_cache=False)['shape']
+
+        self.assertEqual((shape_cache.hits - hits, shape_cache.misses - misses), (1, 1))
+        np.testing.assert_array_equal(cached, built)
+        np.testing.assert_array_equal(uncached, built)
+
+        # Hits are copies, editing one leaves the cached plane alone
+        cached[0, 0] = 3
+        self.assertNotEqual(shape_cache.get(parts[1].shape_key())[0, 0], 3)
+
+
+def outlined_array(part, paths=False):
+    # Ribbing and outline of a part before the fill, drawn with the original per-path loop if paths
+    array = initialize_array(part.stitches, part.rows)
+    if part.ribbing:
+        if part.taper:
+            part.ribbing.add_to_array(array, hem_stitches=part.taper.hem_stitches, taper_style=part.taper.taper_style)
+        else:
+            part.ribbing.add_to_array(array)
+    if paths:
+        for vertices in part.outline_paths():
+            draw_path_on_array(array, vertices)
+    else:
+        draw_segments(array, part.outline_segments())
+    return array
+
+
+def bfs_filled(shape):
+    array = PatternGrid(shape.copy())
+    flood_fill_outside(array)
+    return array['shape']
+
+
+class TestRasterizer(SimpleTestCase):
+    def assert_fills_match_bfs(self, shape):
+        expected = bfs_filled(shape)
+        for method in FILL_METHODS:
+            with self.subTest(method=method):
+                array = PatternGrid(shape.copy())
+                fill_outside(array, method)
+                np.testing.assert_array_equal(array['shape'], expected)
+
+    def test_fill_methods_match_bfs_on_preset_parts(self):
+        cases = [(preset, size, size_data, gauge) for preset, size, size_data in load_presets()
+                 for gauge in (0.5, 1.0, 2.0)]
+        for preset, size, size_data, gauge in cases:
+            swatch = size_data['swatch']
+            for part_name, part in preset_parts(size_data).items():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    part.do_calculations(swatch['stitches'] / swatch['width'] * gauge,
+                                         swatch['rows'] / swatch['height'] * gauge, size_data['needle_size'])
+                    expected = bfs_filled(outlined_array(part, paths=True)['shape'])
+                    outlined, segments = outlined_array(part), part.outline_segments()
+
+                for method in FILL_METHODS:
+                    with self.subTest(preset=preset, size=size, gauge=gauge, part=part_name, method=method):
+                        array = rasterize(outlined.copy(), segments, fill_method=method)
+                        np.testing.assert_array_equal(array['shape'], expected)
+
+    def test_segment_points_match_bresenham(self):
+        segments = [
+            (3, 3, 3, 3),      # Degenerate, a single point
+            (9, 2, 1, 2),      # Horizontal, drawn right to left
+            (4, 8, 4, 0),      # Vertical, drawn bottom to top
+            (0, 0, 7, 3),      # Shallow diagonal
+            (7, 3, 5, 9),      # Steep diagonal sharing the previous end point
+            (-2, 4, 12, 4),    # Out of bounds on both ends
+            (5, -3, -1, 3),    # Out of bounds diagonal
+        ]
+        xs, ys = segment_points(segments)
+        expected = np.array([point for segment in segments for point in bresenham_line(*segment)])
+        order, expected_order = np.lexsort((ys, xs)), np.lexsort((expected[:, 1], expected[:, 0]))
+        np.testing.assert_array_equal(np.column_stack((xs, ys))[order], expected[expected_order])
+        self.assertEqual(segment_points(np.empty((0, 4)))[0].size, 0)
+
+    def test_out_of_bounds_segments_are_clipped_like_the_path_loop(self):
+        paths = [[(-3, -3), (4, 4), (12, 4)], [(2, 9), (2, -1)], [(20, 20), (20, 20)]]
+        array, expected = initialize_array(10, 8), initialize_array(10, 8)
+        with self.assertLogs('patterns', 'WARNING'):
+            draw_paths(array, paths)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for vertices in paths:
+                draw_path_on_array(expected, vertices)
+        np.testing.assert_array_equal(array['shape'], expected['shape'])
+
+    def test_fill_edge_cases_match_bfs(self):
+        blank = np.ones((6, 9), dtype=np.int8)
+        self.assert_fills_match_bfs(blank)
+        self.assert_fills_match_bfs(np.full((6, 9), 2, dtype=np.int8))
+        self.assert_fills_match_bfs(np.ones((1, 9), dtype=np.int8))
+        self.assert_fills_match_bfs(np.ones((9, 1), dtype=np.int8))
+
+        # Two boxes sharing a wall, and one touching the border
+        touching = blank.copy()
+        touching[1:5, 1:5] = touching[1:5, 4:8] = 2
+        touching[2:4, 2:4] = touching[2:4, 5:7] = 1
+        touching[0:3, 8] = 2
+        self.assert_fills_match_bfs(touching)
+
+        # A diagonal outline only closes the region for 4-connected fills
+        diagonal = blank.copy()
+        for i in range(6):
+            diagonal[i, i] = 2
+        diagonal[5, :6] = 2
+        self.assert_fills_match_bfs(diagonal)
+
+        # Random outlines give nested regions, spirals and runs touching at corners
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            height, width = rng.integers(1, 30, 2)
+            shape = np.where(rng.random((height, width)) < rng.uniform(0.2, 0.6), 2, 1).astype(np.int8)
+            self.assert_fills_match_bfs(shape)
+
+    def test_unknown_fill_method_is_rejected(self):
+        with self.assertRaises(ValueError):
+            fill_outside(initialize_array(3, 3), 'flood')
+
+
+def calculated_parts(gauge=1.0):
+    parts = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _, _, size_data in itertools.islice(load_presets(), 2):
+            swatch = size_data['swatch']
+            for part in preset_parts(size_data).values():
+                part.do_calculations(swatch['stitches'] / swatch['width'] * gauge,
+                                     swatch['rows'] / swatch['height'] * gauge, size_data['needle_size'])
+                part.debug_mode = False
+                parts.append(part)
+    return parts
+
+
+class TestCompileExecutor(SimpleTestCase):
+    def compile(self, mode, parts):
+        # Nothing from the cache, every distinct part goes to the pool
+        shape_cache.clear()
+        executor = CompileExecutor(mode, workers=2, min_parallel_cells=0)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return executor.compile(parts)
+        finally:
+            executor.shutdown()
+            shape_cache.clear()
+
+    def test_every_mode_builds_the_same_planes(self):
+        parts = calculated_parts()
+        serial = self.compile('serial', parts)
+        for mode in ('thread', 'process'):
+            with self.subTest(mode=mode):
+                for grid, expected in zip(self.compile(mode, parts), serial):
+                    np.testing.assert_array_equal(grid['shape'], expected['shape'])
+
+    def test_shared_memory_is_released_after_a_failing_part(self):
+        parts = calculated_parts()
+        # Still hashes into the shape key, but fails once the worker draws the ribbing
+        parts[0].taper.hem_stitches = 'broken'
+
+        blocks = []
+
+        def tracked(*args, **kwargs):
+            shm = SharedMemory(*args, **kwargs)
+            blocks.append(shm.name)
+            return shm
+
+        with mock.patch.object(compile_executor, 'SharedMemory', tracked):
+            with self.assertRaises(TypeError):
+                self.compile('process', parts)
+
+        self.assertEqual(len(blocks), 1)
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name=blocks[0])
+
+    def test_compiles_outside_the_worker_build_serially(self):
+        self.assertEqual(settings.PATTERN_COMPILE_EXECUTOR, 'serial')
+        self.assertEqual(get_compile_executor().mode, 'serial')
+
+
+class TestShaping(SimpleTestCase):
+    def test_even_distribution(self):
+        np.testing.assert_array_equal(even_distribution(10, 4), [2, 3, 2, 3])
+        self.assertEqual(even_distribution(5, 0).size, 0)
+        for total in range(40):
+            for steps in range(1, 12):
+                parts = even_distribution(total, steps)
+                self.assertEqual((len(parts), parts.sum()), (steps, total))
+                self.assertLessEqual(parts.max() - parts.min(), 1)
+
+    def test_front_loaded_distribution(self):
+        np.testing.assert_array_equal(front_loaded_distribution(10, 4), [3, 3, 2, 2])
+        for total in range(40):
+            for steps in range(1, 12):
+                parts = front_loaded_distribution(total, steps)
+                self.assertEqual((len(parts), parts.sum()), (steps, total))
+                self.assertTrue(np.all(np.diff(parts) <= 0))
+                self.assertLessEqual(parts[0] - parts[-1], 1)
+
+    def test_triangular_distribution(self):
+        np.testing.assert_array_equal(triangular_distribution(12), [2, 3, 3, 4])
+        self.assertEqual(triangular_distribution(0).size, 0)
+        for target in range(1, 300):
+            parts = triangular_distribution(target)
+            n = len(parts)
+            self.assertEqual(parts.sum(), target)
+            self.assertLessEqual(n * (n + 1) // 2, target)
+            self.assertGreater((n + 1) * (n + 2) // 2, target)
+            self.assertTrue(np.all(np.diff(parts) <= 1) and np.all(np.diff(parts) >= 0))
+
+    def test_taper_schedule_reaches_the_hem(self):
+        for rows, stitches in [(5, 12), (40, 6), (9, 9), (1, 30), (30, 1)]:
+            schedule = taper_schedule(rows, stitches)
+            self.assertEqual(len(schedule), min(rows, stitches))
+            self.assertEqual((schedule.rows.sum(), schedule.stitches.sum()), (rows, stitches))
+            # One step per row when rows are scarce, per stitch otherwise
+            single = schedule.rows if rows <= stitches else schedule.stitches
+            self.assertTrue(np.all(single == 1))
+        self.assertEqual(len(taper_schedule(0, 5)), 0)
+        self.assertEqual(len(taper_schedule(10, -2)), 0)
+
+    def test_staircase_matches_the_vertex_loops(self):
+        rng = np.random.default_rng(0)
+        for steps in range(6):
+            rows, stitches = rng.integers(0, 5, steps), rng.integers(1, 5, steps)
+            schedule = ShapingSchedule(rows, stitches)
+
+            # Left side of a neckline: down the rows of each step, then across
+            x, y, left = 7, 0, [(7, 0)]
+            for row, stitch in zip(rows, stitches):
+                y += row
+                left.append((x, y))
+                x += stitch
+                left.append((x, y))
+            np.testing.assert_array_equal(schedule.staircase(7, 0), np.array(left).reshape(-1, 2))
+
+            # Right side: back up the steps in reverse, across first
+            right = [(x, y)]
+            for row, stitch in zip(rows[::-1], stitches[::-1]):
+                x += stitch
+                right.append((x, y))
+                y -= row
+                right.append((x, y))
+            np.testing.assert_array_equal(schedule.staircase(*right[0], y_step=-1, rows_first=False, reverse=True),
+                                          np.array(right).reshape(-1, 2))
+
+        np.testing.assert_array_equal(ShapingSchedule([2, 3], [1, 2]).staircase(10, 0, x_step=-1),
+                                      [[10, 0], [10, 2], [9, 2], [9, 5], [7, 5]])
+
+
+class TestGridCodec(SimpleTestCase):
+    def test_round_trip_keeps_dtypes_and_alignment(self):
+        shape = np.random.default_rng(0).integers(0, 4, (37, 19), dtype=np.int8)
+        color = np.arange(37 * 19, dtype=np.int16).reshape(37, 19)
+
+        planes, header = decode_grid(encode_grid({'shape': shape, 'color': color}, color_map=['#fff']))
+        np.testing.assert_array_equal(planes['shape'], shape)
+        np.testing.assert_array_equal(planes['color'], color)
+        self.assertEqual(planes['color'].dtype, np.int16)
+        self.assertEqual(header['color_map'], ['#fff'])
+        self.assertTrue(all(entry['offset'] % 8 == 0 for entry in header['planes']))
+
+    def test_rle_runs_stay_within_rows(self):
+        plane = np.zeros((4, 6), dtype=np.int8)
+        plane[1:3, 2:5] = 2
+        plane[:, 0] = 3
+
+        encoded = rle_encode(plane)
+        np.testing.assert_array_equal(rle_decode(encoded, np.int8), plane)
+        self.assertEqual(encoded['row_offsets'].tolist(), [0, 2, 6, 10, 12])
+        self.assertEqual(encoded['lengths'][2:6].tolist(), [1, 1, 3, 1])
+
+
+    def test_streamed_json_matches_full_encoding(self):
+        planes = {'shape': np.arange(150, dtype=np.int8).reshape(30, 5), 'color': np.zeros((30, 5), dtype=np.int16)}
+        chunks = compress_chunks(iter_grid_json('file_data', planes, cells_per_chunk=35, color_map=['#fff']),
+                                 negotiate_encoding('br, gzip;q=0.5, deflate;q=0'))
+        data = json.loads(gzip.decompress(b''.join(chunks)))
+
+        self.assertEqual(data, {'file_data': {**{name: plane.tolist() for name, plane in planes.items()},
+                                              'color_map': ['#fff']}})
+        self.assertIsNone(negotiate_encoding('identity, gzip;q=0'))
+
+
+class TestPlaneWindows(SimpleTestCase):
+    def test_window_matches_slice_of_full_plane(self):
+        color = np.arange(40 * 25, dtype=np.int16).reshape(40, 25)
+        grids = {section: PatternGrid(np.ones((40, 25)), color) for section in SECTIONS}
+
+        file = io.BytesIO()
+        save_pattern_file(file, grids, np.array([], dtype='U7'))
+        file.seek(0)
+        npz_data = np.load(file, allow_pickle=True)
+
+        rows, cols = window_bounds((40, 25), row_start=7, row_end=19, col_start=20, col_end=99)
+        window = read_plane_window(file, npz_data, 'left_sleeve', 'color', rows, cols)
+        np.testing.assert_array_equal(window, color[7:19, 20:25])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class TestPatternStore(SimpleTestCase):
+    def test_legacy_npz_is_read_and_upgraded_on_write(self):
+        records = np.zeros((12, 9), dtype=LEGACY_DTYPE)
+        records['shape'] = 1
+        legacy = io.BytesIO()
+        np.savez(legacy, front_torso=records, color_map=np.array(['#ff0000']))
+        store = PatternStore('legacy_test')
+        default_storage.save(store.legacy_path, ContentFile(legacy.getvalue()))
+
+        store = PatternStore('legacy_test').load()
+        self.assertTrue(store.is_legacy)
+        self.assertEqual(store.color_map(), ['#ff0000'])
+        np.testing.assert_array_equal(store.read_plane('front_torso', 'shape'), records['shape'])
+
+        color = np.arange(12 * 9, dtype=np.int16).reshape(12, 9)
+        store.write_plane('front_torso', 'color', color)
+
+        # Every plane moved to its own object, the manifest now takes precedence
+        store = PatternStore('legacy_test').load()
+        self.assertFalse(store.is_legacy)
+        self.assertEqual(store.section_shape('front_torso'), (12, 9))
+        np.testing.assert_array_equal(store.read_plane_window('front_torso', 'color', slice(3, 7), slice(2, 5)),
+                                      color[3:7, 2:5])
+        np.testing.assert_array_equal(store.read_plane('front_torso', 'shape'), records['shape'])
+        store.delete()
+
+    def test_local_planes_are_memory_mapped_and_patched_in_place(self):
+        grids = {'front_torso': PatternGrid(np.ones((20, 10)))}
+        store = PatternStore('mmap_test')
+        store.save(grids, color_map=[])
+        path = default_storage.path(store.plane_path('front_torso', 'color'))
+        inode = os.stat(path).st_ino
+
+        self.assertIsInstance(store.read_plane('front_torso', 'shape'), np.memmap)
+        store.patch_plane('front_torso', 'color', GridPatch.from_data({'rects': [[2, 3, 4, 5, 7]]}, np.int16))
+
+        expected = np.zeros((20, 10), dtype=np.int16)
+        expected[2:6, 3:8] = 7
+        np.testing.assert_array_equal(store.read_plane('front_torso', 'color'), expected)
+        self.assertEqual(os.stat(path).st_ino, inode)
+        store.delete()
+
+
+class TestPlaneCache(SimpleTestCase):
+    def test_lru_evicts_to_the_memory_bound(self):
+        cache = PlaneCache(max_bytes=250)
+        for name in 'abc':
+            cache.put(('1', 1, name), np.zeros(100, dtype=np.int8))
+        self.assertIsNone(cache.get(('1', 1, 'a')))
+        self.assertIsNotNone(cache.get(('1', 1, 'c')))
+
+        info = cache.info()
+        self.assertEqual((info['evictions'], info['evicted_bytes'], info['bytes']), (1, 100, 200))
+        self.assertEqual(info['hit_ratio'], 0.5)
+
+    def test_store_reads_are_cached_by_version_and_invalidated_on_write(self):
+        cache = PlaneCache()
+        storage = InMemoryStorage()
+        PatternStore(5, storage, cache=cache).save({'front_torso': PatternGrid(np.ones((8, 6)))}, color_map=[])
+
+        store = PatternStore(5, storage, version=1, cache=cache).load()
+        store.read_plane('front_torso', 'shape')
+        store = PatternStore(5, storage, version=1, cache=cache).load()
+        np.testing.assert_array_equal(store.read_plane_window('front_torso', 'shape', slice(0, 2), slice(0, 2)),
+                                      np.ones((2, 2)))
+        self.assertEqual(cache.info()['hits'], 2)
+
+        store.write_plane('front_torso', 'shape', np.full((8, 6), 2))
+        self.assertEqual(cache.info()['size'], 0)
+        store = PatternStore(5, storage, version=2, cache=cache).load()
+        self.assertEqual(store.read_plane('front_torso', 'shape')[0, 0], 2)
+
+
+class MemoryS3Client:
+    """
+    The S3 calls S3Objects makes, on a dict. Instances can be shared like a bucket.
+    """
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        data = self.objects[Key]
+        if Range is not None:
+            start, end = map(int, Range.removeprefix('bytes=').split('-'))
+            data = data[start:end + 1]
+        return {'Body': StreamingBody(io.BytesIO(data), len(data))}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = bytes(Body)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class TestS3Objects(SimpleTestCase):
+    def setUp(self):
+        self.client = boto3.client('s3', region_name='us-east-2', aws_access_key_id='test',
+                                   aws_secret_access_key='test')
+        self.objects = S3Objects('bucket', self.client, location='media')
+
+    def test_reads_are_single_gets_and_misses_are_remembered(self):
+        legacy = 'patterns/pattern_1/pattern_pieces.npz'
+        plane = 'patterns/pattern_1/front_torso/shape.npy'
+        with Stubber(self.client) as stubber:
+            stubber.add_client_error('get_object', 'NoSuchKey', http_status_code=404,
+                                     expected_params={'Bucket': 'bucket', 'Key': f'media/{legacy}'})
+            stubber.add_response('get_object', {'Body': StreamingBody(io.BytesIO(b'NUMPY'), 5)},
+                                 {'Bucket': 'bucket', 'Key': f'media/{plane}', 'Range': 'bytes=1-5'})
+
+            with self.assertRaises(FileNotFoundError):
+                self.objects.read(legacy)
+            # Known missing, no second request
+            with self.assertRaises(FileNotFoundError):
+                self.objects.read(legacy)
+            self.assertFalse(self.objects.exists(legacy))
+            self.assertEqual(self.objects.read_range(plane, 1, 5), b'NUMPY')
+            stubber.assert_no_pending_responses()
+
+    def test_legacy_upgrade_is_seen_by_other_processes(self):
+        client = MemoryS3Client()
+        records = np.zeros((6, 5), dtype=LEGACY_DTYPE)
+        records['shape'] = 1
+        legacy = io.BytesIO()
+        np.savez(legacy, front_torso=records, color_map=np.array([]))
+        client.put_object(Bucket='bucket', Key='patterns/pattern_1/pattern_pieces.npz', Body=legacy.getvalue())
+
+        # Each store has its own S3Objects, as two processes would
+        stale = PatternStore(1, objects=S3Objects('bucket', client)).load()
+        self.assertTrue(stale.is_legacy)
+        upgrading = PatternStore(1, objects=S3Objects('bucket', client)).load()
+        upgrading.patch_plane('front_torso', 'color', GridPatch.from_data({'rects': [[1, 1, 2, 2, 7]]}, np.int16))
+        self.assertNotIn('patterns/pattern_1/pattern_pieces.npz', client.objects)
+
+        # The process that remembered the manifest as missing reads the upgraded planes
+        store = PatternStore(1, objects=stale.objects).load()
+        self.assertFalse(store.is_legacy)
+        self.assertEqual(store.read_plane('front_torso', 'color')[1, 1], 7)
+
+        # and a write from its stale legacy copy doesn't upgrade the old planes over them
+        stale.write_color_map(['#ff0000'])
+        store = PatternStore(1, objects=S3Objects('bucket', client)).load()
+        self.assertEqual(store.read_plane('front_torso', 'color')[1, 1], 7)
+        self.assertEqual(store.color_map(), ['#ff0000'])
+
+
+class TestPatternStoreCells(SimpleTestCase):
+    def test_cells_are_read_from_their_rows_only(self):
+        client = MemoryS3Client()
+        fetched = []
+        get_object = client.get_object
+
+        def counting_get(**kwargs):
+            response = get_object(**kwargs)
+            fetched.append(response['Body']._content_length)
+            return response
+
+        client.get_object = counting_get
+        shape = (np.arange(1000 * 60) % 4).astype(np.int8).reshape(1000, 60)
+        PatternStore(1, objects=S3Objects('bucket', client)).save({'front_torso': PatternGrid(shape)}, [])
+
+        store = PatternStore(1, objects=S3Objects('bucket', client)).load()
+        fetched.clear()
+        rows, cols = np.array([40, 42, 41]), np.array([3, 59, 0])
+        np.testing.assert_array_equal(store.read_cells('front_torso', 'shape', rows, cols), shape[rows, cols])
+        self.assertLess(sum(fetched), shape.nbytes // 10)
+        self.assertEqual(store.read_cells('front_torso', 'shape', [], []).size, 0)
+
+
+class TestGridPatch(SimpleTestCase):
+    def test_cells_and_rects_are_applied_in_place(self):
+        plane = np.zeros((6, 8), dtype=np.int16)
+        patch = GridPatch.from_data({'cells': {'rows': [0, 5], 'cols': [7, 0], 'values': [300, -2]},
+                                     'rects': [[2, 1, 2, 3, 9]]}, plane.dtype)
+        patch.apply(plane)
+
+        expected = np.zeros((6, 8), dtype=np.int16)
+        expected[0, 7], expected[5, 0] = 300, -2
+        expected[2:4, 1:4] = 9
+        np.testing.assert_array_equal(plane, expected)
+        self.assertEqual(len(patch), 8)
+
+    def test_out_of_range_patches_are_rejected(self):
+        with self.assertRaises(PatchError):
+            GridPatch.from_data({'cells': {'rows': [0], 'cols': [0], 'values': [200]}}, np.int8)
+        with self.assertRaises(PatchError):
+            GridPatch.from_data({'rects': [[4, 0, 3, 1, 1]]}, np.int8).apply(np.zeros((6, 8), dtype=np.int8))
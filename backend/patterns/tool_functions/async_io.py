@@ -0,0 +1,70 @@
+import asyncio
+import atexit
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name: str, workers: int = None):
+    """
+    Per-process thread pool for one kind of work, created on first use.
+    Bounded, so work beyond workers queues instead of starting more threads.
+    """
+    with _lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(workers or os.cpu_count() or 1,
+                                                  thread_name_prefix=f'pattern-{name}')
+        return _executors[name]
+
+
+def io_executor():
+    # Storage round trips, mostly waiting on the network
+    return get_executor('io', settings.PATTERN_IO_WORKERS)
+
+
+def decode_executor():
+    # NumPy work: decoding planes, applying journal tails, encoding responses
+    return get_executor('decode', settings.PATTERN_DECODE_WORKERS)
+
+
+async def run_io(fn, *args, **kwargs):
+    """
+    Awaits fn(*args, **kwargs) on the storage I/O pool. fn must not touch the database,
+    pool threads have no request to close their connections, use sync_to_async for that.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def run_decode(fn, *args, **kwargs):
+    """
+    Awaits fn(*args, **kwargs) on the decode pool. Same rule as run_io for the database.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(decode_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def iterate_in_decode(iterator):
+    """
+    Async iterator over a sync one, each item produced on the decode pool.
+    Items are pulled one at a time, so a generator never runs in two threads at once.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        item = await run_decode(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+@atexit.register
+def _shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,153 @@
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from . import rasterizer, tool_functions as tf
+from .pattern_grid import save_pattern_file
+from ..sweater_objects.sweater_pieces import Torso, Sleeve
+
+SIZES_PATH = Path(__file__).resolve().parent.parent / 'data' / 'sizes' / 'Pattern Sizes.json'
+
+# Stages timed for every part. do_calculations includes the ribbing/taper/neck construction.
+STAGES = ('do_calculations', 'ribbing', 'taper', 'neck', 'outline', 'fill', 'savez')
+DEFAULT_GAUGES = (0.5, 1.0, 2.0, 4.0)
+
+
+def load_presets(path=SIZES_PATH):
+    """
+    Yields (preset, size, size_data) for every size of every preset in Pattern Sizes.json.
+    """
+    with open(path) as file:
+        data = json.load(file)
+    for preset, preset_data in data['patterns'].items():
+        for size, size_data in preset_data['sizes'].items():
+            yield preset, size, size_data
+
+
+def preset_parts(size_data):
+    """
+    Front torso (with the neckline) and sleeve of a preset size, the two distinct part shapes.
+    """
+    torso, sleeve = size_data['torso'], size_data['sleeve']
+    front_torso = Torso(torso['width'], torso['height'], torso['ribbing'], torso['taper_offset'], torso['taper_hem'],
+                        None, torso['neck_offset_width'], torso['neck_offset_height'], torso['neck_depth'])
+    left_sleeve = Sleeve(sleeve['width'], sleeve['height'], sleeve['ribbing'], sleeve['taper_offset'],
+                         sleeve['taper_hem'], sleeve['taper_style'], 0, 0, 0)
+    return {'front_torso': front_torso, 'left_sleeve': left_sleeve}
+
+
+def _timed(timings, stage, method):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start
+        return result
+    return wrapper
+
+
+def time_part(part, spi, rpi, needle_size, fill_method='label'):
+    """
+    Runs one part through every stage of a compile.
+    Returns ({stage: seconds}, (rows, stitches)); stages the part doesn't have are left out.
+    """
+    timings = {}
+
+    # Time the construction of each piece from inside do_calculations
+    for stage in ('ribbing', 'taper', 'neck'):
+        setattr(part, f'create_{stage}', _timed(timings, stage, getattr(part, f'create_{stage}')))
+    _timed(timings, 'do_calculations', part.do_calculations)(spi, rpi, needle_size)
+
+    start = time.perf_counter()
+    array = tf.initialize_array(part.stitches, part.rows)
+    if part.ribbing:
+        if part.taper:
+            part.ribbing.add_to_array(array, hem_stitches=part.taper.hem_stitches, taper_style=part.taper.taper_style)
+        else:
+            part.ribbing.add_to_array(array)
+    rasterizer.draw_segments(array, part.outline_segments())
+    timings['outline'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rasterizer.fill_outside(array, method=fill_method)
+    timings['fill'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    save_pattern_file(io.BytesIO(), {'section': array}, np.array([], dtype='U7'))
+    timings['savez'] = time.perf_counter() - start
+
+    return timings, array.shape
+
+
+def run_benchmark(gauges=DEFAULT_GAUGES, repeat=3, fill_method='label', presets_path=SIZES_PATH):
+    """
+    Times every stage for every preset size and part, scaled to each gauge multiplier.
+    Each case runs repeat times; min and median seconds are reported per stage.
+    """
+    results = []
+    for preset, size, size_data in load_presets(presets_path):
+        swatch = size_data['swatch']
+        for gauge in gauges:
+            spi = swatch['stitches'] / swatch['width'] * gauge
+            rpi = swatch['rows'] / swatch['height'] * gauge
+
+            for part_name in preset_parts(size_data):
+                runs = []
+                for _ in range(repeat):
+                    # Fresh part every run, do_calculations mutates it
+                    part = preset_parts(size_data)[part_name]
+                    part.debug_mode = False
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        timings, shape = time_part(part, spi, rpi, size_data['needle_size'], fill_method)
+                    runs.append(timings)
+
+                results.append({
+                    'preset': preset,
+                    'size': size,
+                    'gauge': gauge,
+                    'part': part_name,
+                    'rows': shape[0],
+                    'stitches': shape[1],
+                    'stages': {stage: {'min': min(run.get(stage, 0.0) for run in runs),
+                                       'median': statistics.median(run.get(stage, 0.0) for run in runs)}
+                               for stage in STAGES},
+                })
+
+    totals = {stage: sum(result['stages'][stage]['median'] for result in results) for stage in STAGES}
+    return {'meta': benchmark_meta(gauges, repeat, fill_method), 'totals': totals, 'results': results}
+
+
+def benchmark_meta(gauges, repeat, fill_method):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'gauges': list(gauges),
+        'repeat': repeat,
+        'fill_method': fill_method,
+    }
+
+
+def compare_totals(baseline, current):
+    """
+    {stage: (baseline seconds, current seconds, current / baseline)} for two benchmark results.
+    """
+    comparison = {}
+    for stage in STAGES:
+        before, after = baseline['totals'].get(stage, 0.0), current['totals'].get(stage, 0.0)
+        comparison[stage] = (before, after, after / before if before else float('nan'))
+    return comparison
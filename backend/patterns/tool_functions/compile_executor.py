@@ -0,0 +1,156 @@
+import atexit
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .pattern_grid import PatternGrid, PLANE_DTYPES
+from .shape_cache import shape_cache
+
+EXECUTOR_MODES = ('process', 'thread', 'serial')
+
+
+def _attach_shared_memory(name):
+    # The parent owns the block and unlinks it. Pool workers share the parent's resource
+    # tracker, so on older Pythons registering it again here is harmless.
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return SharedMemory(name=name)
+
+
+def _build_shape_into(part, shm_name, offset):
+    """
+    Process pool task: rasterizes one part and writes its shape plane straight into
+    the parent's shared memory block, so no array is pickled on the way back.
+    """
+    shm = _attach_shared_memory(shm_name)
+    try:
+        shape = part.build_array()['shape']
+        target = np.ndarray(shape.shape, dtype=shape.dtype, buffer=shm.buf, offset=offset)
+        target[...] = shape
+        del target
+    finally:
+        shm.close()
+
+
+def _build_shape(part):
+    return part.build_array()['shape']
+
+
+class CompileExecutor:
+    """
+    Rasterizes the pieces of a pattern in parallel.
+
+    - 'process': a persistent process pool; shape planes come back through shared memory.
+      Starting the pool costs seconds, so it only pays off in long running processes.
+    - 'thread': a thread pool, NumPy releases the GIL for most of the rasterizing work.
+    - 'serial': builds every piece in the calling thread.
+
+    Pieces with the same Part.shape_key() are only built once, and pieces already in the
+    shape cache are not dispatched at all. Work smaller than min_parallel_cells is built
+    serially since dispatching it would cost more than it saves.
+    """
+    def __init__(self, mode: str = 'serial', workers: int = None, min_parallel_cells: int = 50_000):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown compile executor mode '{mode}', expected one of {EXECUTOR_MODES}")
+        self.mode = mode
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.min_parallel_cells = min_parallel_cells
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.mode == 'process':
+                # forkserver/spawn keep Django state and DB connections out of the workers
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            else:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='pattern-compile')
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def compile(self, parts):
+        """
+        Builds a PatternGrid for every part. do_calculations must already have run on each.
+        """
+        keys = [part.shape_key() for part in parts]
+
+        # One build per distinct geometry, skipping anything already cached
+        planes = {}
+        pending = {}
+        for key, part in zip(keys, parts):
+            if key in planes or key in pending:
+                continue
+            cached = shape_cache.get(key)
+            if cached is not None:
+                planes[key] = cached
+            else:
+                pending[key] = part
+
+        built = self._build_shapes(pending)
+        for key, plane in built.items():
+            shape_cache.put(key, plane)
+        planes.update(built)
+
+        return [PatternGrid(planes[key].copy()) for key in keys]
+
+    def _build_shapes(self, pending):
+        total_cells = sum(part.stitches * part.rows for part in pending.values())
+        if self.mode == 'serial' or len(pending) < 2 or total_cells < self.min_parallel_cells:
+            return {key: _build_shape(part) for key, part in pending.items()}
+        if self.mode == 'thread':
+            futures = {key: self.pool.submit(_build_shape, part) for key, part in pending.items()}
+            return {key: future.result() for key, future in futures.items()}
+        return self._build_shapes_in_processes(pending)
+
+    def _build_shapes_in_processes(self, pending):
+        dtype = PLANE_DTYPES['shape']
+        layout = {}
+        offset = 0
+        for key, part in pending.items():
+            layout[key] = (offset, (part.rows, part.stitches))
+            offset += part.rows * part.stitches * dtype.itemsize
+
+        shm = SharedMemory(create=True, size=max(1, offset))
+        try:
+            futures = [self.pool.submit(_build_shape_into, part, shm.name, layout[key][0])
+                       for key, part in pending.items()]
+            # Let every task finish before raising a failure, none may still attach once the block is unlinked
+            wait(futures)
+            for future in futures:
+                future.result()
+
+            # Copy the planes out before the block is released
+            return {key: np.ndarray(dims, dtype=dtype, buffer=shm.buf, offset=start).copy()
+                    for key, (start, dims) in layout.items()}
+        finally:
+            shm.close()
+            shm.unlink()
+
+
+_executors = {}
+
+
+def get_compile_executor(mode: str = 'serial', workers: int = None):
+    """
+    Per-process executor for the given mode and worker count, created on first use
+    so the pool is reused across requests.
+    """
+    key = (mode, workers)
+    if key not in _executors:
+        _executors[key] = CompileExecutor(mode, workers)
+    return _executors[key]
+
+
+@atexit.register
+def _shutdown_executors():
+    for executor in _executors.values():
+        executor.shutdown()
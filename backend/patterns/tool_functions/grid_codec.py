@@ -0,0 +1,180 @@
+import json
+import struct
+import zlib
+
+import numpy as np
+
+# BINARY GRID FORMAT
+# magic (4 bytes) | header length (uint32 LE) | JSON header | plane data
+# The header lists each plane's name, dtype, shape and byte offset from the start of the
+# payload. Offsets are 8 byte aligned so clients can view planes as typed arrays in place.
+GRID_MAGIC = b'KTKG'
+GRID_FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<4sI')
+_ALIGN = 8
+
+
+def _aligned(size: int):
+    return -(-size // _ALIGN) * _ALIGN
+
+
+def encode_grid(planes: dict, **meta):
+    """
+    Encodes {name: 2D array} as the binary grid format, little-endian.
+    Extra keyword arguments (e.g. color_map) must be JSON serializable and go in the header.
+    """
+    arrays = {name: np.ascontiguousarray(data, dtype=np.asarray(data).dtype.newbyteorder('<'))
+              for name, data in planes.items()}
+
+    def build_header(data_start):
+        offset = data_start
+        entries = []
+        for name, data in arrays.items():
+            entries.append({'name': name, 'dtype': data.dtype.name, 'shape': list(data.shape), 'offset': offset})
+            offset = _aligned(offset + data.nbytes)
+        return {'version': GRID_FORMAT_VERSION, 'planes': entries, **meta}, offset
+
+    # Offsets depend on the header length, which depends on the offsets; grow until it fits
+    data_start = 0
+    while True:
+        header, total = build_header(data_start)
+        header_bytes = json.dumps(header).encode()
+        if _PREFIX.size + len(header_bytes) <= data_start:
+            break
+        data_start = _aligned(_PREFIX.size + len(header_bytes))
+    header_bytes += b' ' * (data_start - _PREFIX.size - len(header_bytes))
+
+    payload = bytearray(total)
+    payload[:data_start] = _PREFIX.pack(GRID_MAGIC, len(header_bytes)) + header_bytes
+    view = np.frombuffer(payload, dtype=np.uint8)
+    for entry, data in zip(header['planes'], arrays.values()):
+        view[entry['offset']:entry['offset'] + data.nbytes] = data.reshape(-1).view(np.uint8)
+    del view
+    return bytes(payload)
+
+
+def decode_grid(payload: bytes):
+    """
+    Decodes the binary grid format into ({name: array}, header).
+    """
+    magic, header_length = _PREFIX.unpack_from(payload)
+    if magic != GRID_MAGIC:
+        raise ValueError('Not a binary pattern grid')
+    header = json.loads(payload[_PREFIX.size:_PREFIX.size + header_length])
+
+    planes = {}
+    for entry in header['planes']:
+        dtype = np.dtype(entry['dtype']).newbyteorder('<')
+        count = int(np.prod(entry['shape']))
+        planes[entry['name']] = np.frombuffer(payload, dtype=dtype, count=count,
+                                              offset=entry['offset']).reshape(entry['shape'])
+    return planes, header
+
+
+class GridPayload:
+    """
+    Planes to send in the binary grid format, with header metadata such as the color_map.
+    Returned as Response data when the binary renderer was negotiated.
+    """
+    def __init__(self, planes: dict, **meta):
+        self.planes = planes
+        self.meta = meta
+
+
+# RUN-LENGTH ENCODING
+def rle_encode(plane):
+    """
+    Run-length encodes each row of a 2D plane without a Python loop over cells.
+
+    Runs never cross rows. Returns {'shape', 'values', 'lengths', 'row_offsets'} where the runs
+    of row r are values/lengths[row_offsets[r]:row_offsets[r + 1]].
+    """
+    plane = np.asarray(plane)
+    height, width = plane.shape
+
+    # A run starts at column 0 and wherever a cell differs from its left neighbour
+    starts_mask = np.ones(plane.shape, dtype=bool)
+    starts_mask[:, 1:] = plane[:, 1:] != plane[:, :-1]
+    starts = np.flatnonzero(starts_mask)
+
+    row_offsets = np.zeros(height + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(starts_mask, axis=1), out=row_offsets[1:])
+
+    return {
+        'shape': [height, width],
+        'values': plane.ravel()[starts],
+        'lengths': np.diff(starts, append=plane.size),
+        'row_offsets': row_offsets,
+    }
+
+
+def rle_decode(encoded, dtype=None):
+    height, width = encoded['shape']
+    values = np.asarray(encoded['values'], dtype=dtype)
+    return np.repeat(values, encoded['lengths']).reshape(height, width)
+
+
+def rle_to_json(encoded):
+    return {key: value if key == 'shape' else value.tolist() for key, value in encoded.items()}
+
+
+# STREAMING JSON
+def iter_grid_json(key: str, planes: dict, cells_per_chunk: int = 32768, **extra):
+    """
+    Yields {key: {plane: nested lists, **extra}} as JSON bytes, about cells_per_chunk cells
+    (whole rows) at a time, so neither the nested lists of a whole plane nor its JSON string exist at once.
+    Output matches the compact JSON DRF renders.
+    """
+    yield b'{' + json.dumps(key).encode() + b':{'
+    for index, (name, data) in enumerate(planes.items()):
+        yield (b',' if index else b'') + json.dumps(name).encode() + b':['
+        rows_per_chunk = max(1, cells_per_chunk // max(1, data.shape[1]))
+        for start in range(0, len(data), rows_per_chunk):
+            rows = json.dumps(np.asarray(data[start:start + rows_per_chunk]).tolist(), separators=(',', ':'))
+            yield (b',' if start else b'') + rows[1:-1].encode()
+        yield b']'
+    for name, value in extra.items():
+        yield b',' + json.dumps(name).encode() + b':' + json.dumps(value, separators=(',', ':')).encode()
+    yield b'}}'
+
+
+# Content-Encodings compress_chunks can produce, by preference, with their zlib wbits
+STREAM_ENCODINGS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def negotiate_encoding(accept_encoding: str):
+    """
+    First of STREAM_ENCODINGS the Accept-Encoding header allows, or None for identity.
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in STREAM_ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_chunks(chunks, encoding: str = None, level: int = 6):
+    """
+    Compresses a stream of bytes chunks on the fly, passing it through unchanged without an encoding.
+    """
+    if encoding is None:
+        yield from chunks
+        return
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, STREAM_ENCODINGS[encoding])
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,117 @@
+import numpy as np
+
+
+class PatchError(ValueError):
+    """
+    A patch that is malformed or reaches outside the plane.
+    """
+
+
+def _index_array(values, name):
+    array = np.asarray(values)
+    if array.ndim != 1 or (array.size and not np.issubdtype(array.dtype, np.integer)):
+        raise PatchError(f"'{name}' must be a list of integers")
+    return array.astype(np.int64, copy=False)
+
+
+def _checked_values(values, dtype, name='values'):
+    array = np.asarray(values)
+    if array.size and not np.issubdtype(array.dtype, np.integer):
+        raise PatchError(f"'{name}' must be integers")
+    limits = np.iinfo(dtype)
+    if array.size and (array.min() < limits.min or array.max() > limits.max):
+        raise PatchError(f"'{name}' must be between {limits.min} and {limits.max}")
+    return array.astype(dtype)
+
+
+class GridPatch:
+    """
+    Sparse changes to one plane.
+
+    - cells: {'rows': [...], 'cols': [...], 'values': [...] or one value for every cell}
+    - rects: [[row, col, height, width, value], ...] filled rectangles, applied after the cells
+
+    Parsing checks types and value ranges, apply checks the bounds against the plane.
+    """
+    def __init__(self, rows, cols, values, rects):
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+        self.rects = rects
+
+    @classmethod
+    def from_data(cls, data, dtype):
+        if not isinstance(data, dict):
+            raise PatchError("'patch' must be an object with 'cells' and/or 'rects'")
+
+        cells = data.get('cells') or {}
+        rows = _index_array(cells.get('rows', []), 'rows')
+        cols = _index_array(cells.get('cols', []), 'cols')
+        if rows.shape != cols.shape:
+            raise PatchError("'rows' and 'cols' must be the same length")
+        values = _checked_values(cells.get('values', []), dtype)
+        if values.ndim > 1 or (values.ndim == 1 and values.shape != rows.shape):
+            raise PatchError("'values' must be one value or one per cell")
+
+        rects = np.asarray(data.get('rects') or np.zeros((0, 5)), dtype=object)
+        if rects.ndim != 2 or rects.shape[1] != 5:
+            raise PatchError("'rects' must be a list of [row, col, height, width, value]")
+        rect_values = _checked_values(rects[:, 4].tolist(), dtype, 'rects')
+        rects = _index_array(rects[:, :4].ravel().tolist(), 'rects').reshape(-1, 4)
+        if (rects[:, 2:] < 0).any():
+            raise PatchError("'rects' height and width can't be negative")
+
+        return cls(rows, cols, values, list(zip(rects.tolist(), rect_values.tolist())))
+
+    def __len__(self):
+        # Number of cells written
+        return len(self.rows) + sum(height * width for (_, _, height, width), _ in self.rects)
+
+    def check_bounds(self, shape):
+        height, width = shape
+        if len(self.rows) and (self.rows.min() < 0 or self.rows.max() >= height
+                               or self.cols.min() < 0 or self.cols.max() >= width):
+            raise PatchError(f'Patch cells fall outside the {height}x{width} plane')
+        for (row, col, rect_height, rect_width), _ in self.rects:
+            if row < 0 or col < 0 or row + rect_height > height or col + rect_width > width:
+                raise PatchError(f'Patch rect {[row, col, rect_height, rect_width]} falls outside the {height}x{width} plane')
+
+    def to_data(self):
+        # Inverse of from_data, e.g. to pass a patch on to other clients
+        return {'cells': {'rows': self.rows.tolist(), 'cols': self.cols.tolist(), 'values': self.values.tolist()},
+                'rects': [[*rect, value] for rect, value in self.rects]}
+
+    def mask(self, shape):
+        """
+        Boolean array of the cells the patch writes.
+        """
+        self.check_bounds(shape)
+        written = np.zeros(shape, dtype=bool)
+        written[self.rows, self.cols] = True
+        for (row, col, height, width), _ in self.rects:
+            written[row:row + height, col:col + width] = True
+        return written
+
+    def cells(self, shape):
+        """
+        (rows, cols, values) of every cell the patch writes, the rects' cells after the single ones.
+        """
+        self.check_bounds(shape)
+        rows, cols = [self.rows], [self.cols]
+        values = [np.broadcast_to(self.values, self.rows.shape)]
+        for (row, col, height, width), value in self.rects:
+            rect_rows, rect_cols = np.mgrid[row:row + height, col:col + width]
+            rows.append(rect_rows.ravel())
+            cols.append(rect_cols.ravel())
+            values.append(np.full(rect_rows.size, value, dtype=self.values.dtype))
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+    def apply(self, plane):
+        """
+        Writes the patch into plane in place.
+        """
+        self.check_bounds(plane.shape)
+        plane[self.rows, self.cols] = self.values
+        for (row, col, height, width), value in self.rects:
+            plane[row:row + height, col:col + width] = value
+        return plane
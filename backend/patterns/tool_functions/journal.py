@@ -0,0 +1,458 @@
+import logging
+from collections import defaultdict
+
+import numpy as np
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from ..models import Pattern, PatternEdit
+from .grid_codec import encode_grid, decode_grid
+from .pattern_store import PatternNotFound, PatternStore
+
+logger = logging.getLogger('patterns')
+
+
+class JournalError(Exception):
+    """
+    Nothing to undo or redo, or a version outside the journal.
+    """
+
+
+class EditConflict(JournalError):
+    """
+    An edit made on an older version changes cells that newer entries changed too.
+    entries are those newer entries.
+    """
+    def __init__(self, message, entries=()):
+        super().__init__(message)
+        self.entries = list(entries)
+
+
+class CellDelta:
+    """
+    Cells of one plane changed from before to after values, the delta of a PatternEdit.
+
+    Values are absolute, so replaying entries in version order over planes that already hold
+    some of them gives the same planes. Reads and appends rely on this to race compaction.
+    """
+    def __init__(self, rows, cols, before, after):
+        self.rows = rows
+        self.cols = cols
+        self.before = before
+        self.after = after
+
+    def __len__(self):
+        return len(self.rows)
+
+    def encode(self):
+        return encode_grid({'rows': self.rows, 'cols': self.cols, 'before': self.before, 'after': self.after})
+
+    @classmethod
+    def decode(cls, payload):
+        planes, _ = decode_grid(bytes(payload))
+        return cls(**planes)
+
+    def inverted(self):
+        return CellDelta(self.rows, self.cols, self.after, self.before)
+
+    def apply(self, plane):
+        plane[self.rows, self.cols] = self.after
+        return plane
+
+    def apply_window(self, data, rows: slice, cols: slice):
+        """
+        Applies the cells inside rows x cols to data, a window read at (rows.start, cols.start).
+        """
+        inside = (self.rows >= rows.start) & (self.rows < rows.stop) & (self.cols >= cols.start) & (self.cols < cols.stop)
+        data[self.rows[inside] - rows.start, self.cols[inside] - cols.start] = self.after[inside]
+        return data
+
+
+def cell_keys(rows, cols):
+    # One sortable int64 per cell, for matching cells of different edits
+    return (np.asarray(rows, dtype=np.int64) << 32) | np.asarray(cols, dtype=np.int64)
+
+
+class CellChange:
+    """
+    Values an edit writes to cells of one plane, kept sorted by cell.
+    A cell written more than once keeps the value written last.
+    """
+    def __init__(self, rows, cols, values):
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        values = np.broadcast_to(values, rows.shape)
+        # np.unique keeps the first of equal keys, so look at the writes last to first
+        self.keys, last = np.unique(cell_keys(rows, cols)[::-1], return_index=True)
+        self.rows, self.cols, self.values = rows[::-1][last], cols[::-1][last], values[::-1][last]
+
+    @classmethod
+    def of_deltas(cls, deltas):
+        """
+        The after values of deltas, as if applied in the order given.
+        """
+        deltas = list(deltas)
+        return cls(np.concatenate([delta.rows for delta in deltas] or [[]]),
+                   np.concatenate([delta.cols for delta in deltas] or [[]]),
+                   np.concatenate([delta.after for delta in deltas] or [[]]))
+
+    @classmethod
+    def of_plane(cls, data):
+        # Every cell of a full plane, as older clients send them
+        rows, cols = np.indices(np.shape(data))
+        return cls(rows.ravel(), cols.ravel(), np.asarray(data).ravel())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, rows, cols):
+        """
+        (positions, found): where the cells at rows, cols are among these cells, and which of them are.
+        """
+        keys = cell_keys(rows, cols)
+        if not len(self):
+            return np.zeros(0, dtype=np.intp), np.zeros(keys.shape, dtype=bool)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self) - 1)
+        found = self.keys[positions] == keys
+        return positions[found], found
+
+    def subset(self, keep):
+        change = CellChange.__new__(CellChange)
+        change.keys, change.rows, change.cols, change.values = \
+            self.keys[keep], self.rows[keep], self.cols[keep], self.values[keep]
+        return change
+
+
+class DeltaChain:
+    """
+    Deltas applied one after another, in the order given.
+    """
+    def __init__(self, deltas):
+        self.deltas = deltas
+
+    def apply(self, plane):
+        for delta in self.deltas:
+            delta.apply(plane)
+        return plane
+
+
+# READS
+def load_tail(store, section: str, planes):
+    """
+    {plane: [CellDelta, ...]} of a section's entries not compacted into the stored planes yet, oldest first.
+    """
+    tail = {plane: [] for plane in planes}
+    entries = PatternEdit.objects.filter(pattern_id=store.pattern_id, compacted=False, version__gt=store.journal_base,
+                                         section=section, plane__in=list(planes))
+    for plane, delta in entries.order_by('version').values_list('plane', 'delta'):
+        tail[plane].append(CellDelta.decode(delta))
+    return tail
+
+
+def apply_tail(data, deltas, window=None):
+    """
+    Stored plane (or window of it, given as (rows, cols)) with the journal tail applied.
+    Returns data itself when there is nothing to apply.
+    """
+    if not deltas:
+        return data
+    data = np.array(data)
+    for delta in deltas:
+        if window is None:
+            delta.apply(data)
+        else:
+            delta.apply_window(data, *window)
+    return data
+
+
+def current_plane(store, section: str, plane: str):
+    return apply_tail(store.read_plane(section, plane), load_tail(store, section, [plane])[plane])
+
+
+def current_cells(store, section: str, plane: str, change: CellChange):
+    """
+    Current values of the cells change writes: the stored plane indexed at them, with the
+    journal tail applied at just those cells.
+    """
+    values = np.array(store.read_cells(section, plane, change.rows, change.cols))
+    for delta in load_tail(store, section, [plane])[plane]:
+        positions, found = change.find(delta.rows, delta.cols)
+        values[positions] = delta.after[found]
+    return values
+
+
+# WRITES
+def latest_version(pattern_id):
+    return PatternEdit.objects.filter(pattern_id=pattern_id).aggregate(Max('version'))['version__max'] or 0
+
+
+def touch_pattern(pattern_id):
+    """
+    Moves a pattern to a new version (see services.pattern_version) after anything it's read from changed:
+    its journal or its stored planes and manifest. Cached planes and grid ETags are keyed by it.
+    Called after the write, so a reader can't cache the old planes under the new version.
+    """
+    Pattern.objects.filter(id=pattern_id).update(edited_on=timezone.now())
+
+
+def lock_pattern(pattern_id):
+    # Serializes undo, redo, restore, color_map saves, compaction and compiles of one pattern inside a transaction,
+    # so each works from a settled journal and manifest
+    Pattern.objects.select_for_update().filter(id=pattern_id).exists()
+
+
+def plane_versions(pattern_id):
+    """
+    {section: {plane: version of the plane's latest entry}}, for planes with any entries.
+    """
+    versions = defaultdict(dict)
+    rows = PatternEdit.objects.filter(pattern_id=pattern_id).values('section', 'plane').annotate(latest=Max('version'))
+    for row in rows:
+        versions[row['section']][row['plane']] = row['latest']
+    return dict(versions)
+
+
+def merge_concurrent(store, section: str, plane: str, change: CellChange, base_version: int):
+    """
+    The part of change to write when it was made on the plane as of base_version.
+    Cells that entries since then changed are compared by cell, not by rebuilding the old plane:
+    where change writes the value a cell had at base_version it didn't touch that cell, and the
+    newer value is kept. Raises EditConflict if change writes any other value to such a cell.
+    """
+    if base_version < store.journal_base:
+        raise EditConflict('The pattern was recompiled since this version')
+
+    later = [(entry, CellDelta.decode(entry.delta)) for entry in
+             PatternEdit.objects.filter(pattern_id=store.pattern_id, section=section, plane=plane,
+                                        version__gt=base_version).select_related('author').order_by('version')]
+    if not later:
+        return change
+
+    # Value at base_version of every cell of change that later entries changed: the before value
+    # of the first entry to change it
+    base = np.array(change.values)
+    touched = np.zeros(len(change), dtype=bool)
+    for _, delta in reversed(later):
+        positions, found = change.find(delta.rows, delta.cols)
+        base[positions] = delta.before[found]
+        touched[positions] = True
+
+    conflicting = touched & (change.values != base)
+    if conflicting.any():
+        conflicts = [entry for entry, delta in later if conflicting[change.find(delta.rows, delta.cols)[0]].any()]
+        raise EditConflict(f'Cells were changed since version {base_version}', conflicts)
+    return change.subset(~touched)
+
+
+def record_edit(store, section: str, plane: str, change: CellChange, author=None, kind=PatternEdit.EDIT,
+                reverts=None, batch=None, base_version=None, attempts=5):
+    """
+    Appends the cells of change (a CellChange) that differ from their current values to the
+    journal, or returns None if none do. Only those cells are read, see current_cells, so the
+    work grows with the cells written rather than the plane.
+    Entries written by one operation pass the version of its first entry as batch.
+
+    With base_version, change is taken as made on the plane at that version and merged into
+    the current plane, see merge_concurrent. Appends are optimistic: an entry computed from a
+    version another writer appended to first fails the (pattern, version) constraint and is
+    computed again from the new version, so saves never wait on each other.
+    """
+    for _ in range(attempts):
+        version = latest_version(store.pattern_id) + 1
+        if base_version is not None and base_version >= version:
+            raise JournalError(f'Unknown version {base_version}')
+
+        cells = change if base_version is None else merge_concurrent(store, section, plane, change, base_version)
+        before = current_cells(store, section, plane, cells)
+        after = cells.values.astype(before.dtype)
+        changed = before != after
+        if not changed.any():
+            return None
+        delta = CellDelta(cells.rows[changed].astype(np.int32), cells.cols[changed].astype(np.int32),
+                          before[changed], after[changed])
+
+        try:
+            with transaction.atomic():
+                entry = PatternEdit.objects.create(
+                    pattern_id=store.pattern_id, version=version, batch=batch or version, section=section,
+                    plane=plane, kind=kind, reverts=reverts, cells=len(delta), delta=delta.encode(), author=author,
+                )
+        except IntegrityError:
+            continue
+        touch_pattern(store.pattern_id)
+        return entry
+    raise JournalError('The pattern is being edited too quickly, try again')
+
+
+def _color_list(color_map):
+    # Colors of a color_map by id, as the editor saves it ({'idToColorArray': [...]}) or a bare list
+    if isinstance(color_map, dict):
+        return list(color_map.get('idToColorArray') or [])
+    return list(color_map or [])
+
+
+def write_color_map(store, color_map, base_version=None):
+    """
+    Saves a pattern's color_map, reloading the manifest under the pattern lock so nothing else
+    written to it in the meantime is lost. Returns the color_map stored.
+
+    With base_version, the color_map is taken as edited from the one current at that version.
+    If another save changed it since, the one that extends the other is kept (colors are only
+    ever appended), and EditConflict is raised if they assign different colors to an id.
+    """
+    with transaction.atomic():
+        lock_pattern(store.pattern_id)
+        store.load(fresh=True)
+        if base_version is not None and base_version < store.journal_base:
+            raise EditConflict('The pattern was recompiled since this version')
+
+        stored, sent = _color_list(store.color_map()), _color_list(color_map)
+        # Saved at base_version counts as unseen too: color_maps aren't journaled, so saves made
+        # at the same version can't be told apart by it
+        if base_version is not None and store.color_map_version >= base_version and stored != sent:
+            shorter, longer = sorted((stored, sent), key=len)
+            if longer[:len(shorter)] != shorter:
+                raise EditConflict(f'The color map was changed since version {base_version}')
+            if longer is stored:
+                return store.color_map()
+
+        store.write_color_map(color_map, latest_version(store.pattern_id))
+        touch_pattern(store.pattern_id)
+    return color_map
+
+
+def _record_batch(store, changes, author, kind):
+    """
+    Records [(section, plane, CellChange, reverts), ...] as one batch, returns the entries written.
+    """
+    entries = []
+    for section, plane, change, reverts in changes:
+        entry = record_edit(store, section, plane, change, author, kind, reverts,
+                            batch=entries[0].version if entries else None)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+def undo(store, author=None):
+    """
+    Reverts the cells of the latest edit (or batch of them) that isn't undone, as new undo entries.
+    Returns the edits that were undone.
+    """
+    with transaction.atomic():
+        lock_pattern(store.pattern_id)
+        undoable = PatternEdit.objects.filter(pattern_id=store.pattern_id, version__gt=store.journal_base,
+                                              kind__in=[PatternEdit.EDIT, PatternEdit.RESTORE], undone=False)
+        latest = undoable.order_by('-version').first()
+        if latest is None:
+            raise JournalError('Nothing to undo')
+
+        targets = list(undoable.filter(batch=latest.batch).order_by('-version'))
+        _record_batch(store, [(target.section, target.plane,
+                               CellChange.of_deltas([CellDelta.decode(target.delta).inverted()]), target)
+                              for target in targets], author, PatternEdit.UNDO)
+        PatternEdit.objects.filter(id__in=[target.id for target in targets]).update(undone=True)
+    return targets
+
+
+def redo(store, author=None):
+    """
+    Reapplies the most recently undone edit (or batch), as new redo entries, unless there were edits since.
+    Returns the edits that were redone.
+    """
+    with transaction.atomic():
+        lock_pattern(store.pattern_id)
+        undos = PatternEdit.objects.filter(pattern_id=store.pattern_id, version__gt=store.journal_base,
+                                           kind=PatternEdit.UNDO, reverts__undone=True)
+        last_undo = undos.order_by('-version').first()
+        if last_undo is None or PatternEdit.objects.filter(pattern_id=store.pattern_id, version__gt=last_undo.version,
+                                                           kind__in=[PatternEdit.EDIT, PatternEdit.RESTORE]).exists():
+            raise JournalError('Nothing to redo')
+
+        # Reapplied oldest first, as they were originally made
+        targets = [undo_entry.reverts for undo_entry in
+                   undos.filter(batch=last_undo.batch).select_related('reverts').order_by('reverts__version')]
+        _record_batch(store, [(target.section, target.plane, CellChange.of_deltas([CellDelta.decode(target.delta)]),
+                               target)
+                              for target in targets], author, PatternEdit.REDO)
+        PatternEdit.objects.filter(id__in=[target.id for target in targets]).update(undone=False)
+    return targets
+
+
+def version_at(store, timestamp):
+    """
+    Journal version current at timestamp, not older than the planes' compile.
+    """
+    version = PatternEdit.objects.filter(pattern_id=store.pattern_id, created_on__lte=timestamp) \
+        .aggregate(Max('version'))['version__max'] or 0
+    return max(version, store.journal_base)
+
+
+def restore(store, version: int, author=None):
+    """
+    Puts every plane back to how it was at a journal version, as one batch of restore
+    entries (one per plane that differs). Earlier states come from replaying the before values of
+    later entries backwards, so no old snapshots need keeping.
+    Returns the restore entries.
+    """
+    with transaction.atomic():
+        lock_pattern(store.pattern_id)
+        latest = latest_version(store.pattern_id)
+        if not store.journal_base <= version <= latest:
+            raise JournalError(f'Version must be between {store.journal_base} and {latest}')
+
+        later = defaultdict(list)
+        entries = PatternEdit.objects.filter(pattern_id=store.pattern_id, version__gt=version).order_by('-version')
+        for section, plane, delta in entries.values_list('section', 'plane', 'delta'):
+            later[section, plane].append(CellDelta.decode(delta).inverted())
+
+        return _record_batch(store, [(section, plane, CellChange.of_deltas(inverses), None)
+                                     for (section, plane), inverses in later.items()], author, PatternEdit.RESTORE)
+
+
+# COMPACTION
+def compact_journal(pattern_id):
+    """
+    Folds a pattern's uncompacted entries into its stored planes and marks them compacted.
+    Runs under the pattern lock, as compiles do, so a compile can't replace the planes between
+    reading journal_base and writing: entries of an old geometry never reach new planes.
+    Returns the number of entries folded.
+    """
+    with transaction.atomic():
+        lock_pattern(pattern_id)
+        store = PatternStore(pattern_id).load(fresh=True)
+        entries = list(PatternEdit.objects.filter(pattern_id=pattern_id, compacted=False,
+                                                  version__gt=store.journal_base)
+                       .order_by('version').values_list('version', 'section', 'plane', 'delta'))
+        if not entries:
+            return 0
+
+        by_plane = defaultdict(list)
+        for _, section, plane, delta in entries:
+            by_plane[section, plane].append(CellDelta.decode(delta))
+        for (section, plane), deltas in by_plane.items():
+            store.patch_plane(section, plane, DeltaChain(deltas))
+
+        # Other processes may hold the uncompacted planes under the current version
+        touch_pattern(pattern_id)
+        # Marked after the planes are written; a read in between applies them twice, which is harmless
+        PatternEdit.objects.filter(pattern_id=pattern_id, compacted=False,
+                                   version__lte=entries[-1][0]).update(compacted=True)
+    return len(entries)
+
+
+def compact_journals(min_entries: int = 20):
+    """
+    Compacts every pattern with at least min_entries uncompacted entries.
+    Returns {pattern_id: entries folded}.
+    """
+    pending = PatternEdit.objects.filter(compacted=False).values('pattern_id') \
+        .annotate(entries=Count('id')).filter(entries__gte=min_entries)
+
+    compacted = {}
+    for row in pending:
+        try:
+            compacted[row['pattern_id']] = compact_journal(row['pattern_id'])
+        except PatternNotFound:
+            logger.warning("Pattern %s has journal entries but no stored planes", row['pattern_id'])
+    return compacted
@@ -0,0 +1,145 @@
+from collections import defaultdict
+
+import numpy as np
+
+from ..models import PatternEdit
+from .grid_patch import GridPatch
+from .journal import CellChange, CellDelta, EditConflict, current_plane, latest_version, record_edit
+from .pattern_grid import PLANE_DTYPES
+from .pattern_store import PatternStore
+from .rendering import RENDERED_PLANES
+from .thumbnails import schedule_thumbnail
+
+
+class LivePlane:
+    """
+    In-memory copy of one plane, as of journal version, plus the cells each author edited
+    since the last flush.
+    """
+    def __init__(self, data, version: int):
+        self.data = np.array(data)
+        self.version = version
+        self.pending = {}
+
+
+class LiveSession:
+    """
+    One in-memory copy of a pattern, shared by every live viewer of it in this process.
+
+    Edits apply to the copy straight away and are journaled by flush, one entry per plane
+    and author, see journal.record_edit. Entries saved by anything else in the meantime
+    (HTTP saves, other processes) are pulled into the copy first; where they changed cells
+    still pending here, they win, as an overlapping HTTP save with an old base_version would
+    be refused. Methods touch the database and storage, async callers run them one at a time.
+    """
+    def __init__(self, pattern_id):
+        self.pattern_id = pattern_id
+        self.planes = {}
+        self.authors = {}
+
+    def _store(self):
+        # Loaded per call, a recompile replaces the manifest
+        return PatternStore(self.pattern_id).load()
+
+    def plane(self, section: str, plane: str):
+        key = (section, plane)
+        if key not in self.planes:
+            if plane not in PLANE_DTYPES:
+                raise KeyError(plane)
+            store = self._store()
+            # Read before the plane, so the copy holds at least every entry up to it
+            version = latest_version(self.pattern_id)
+            self.planes[key] = LivePlane(current_plane(store, section, plane), version)
+        return self.planes[key]
+
+    def snapshot(self, section: str, plane: str):
+        # (nested lists, version) of the shared copy, for viewers joining
+        live = self.plane(section, plane)
+        return live.data.tolist(), live.version
+
+    def apply(self, section: str, plane: str, patch_data, author):
+        """
+        Applies an edit batch (GridPatch data) to the copy. Returns the parsed patch.
+        Raises PatchError for malformed batches and KeyError for unknown sections or planes.
+        """
+        live = self.plane(section, plane)
+        patch = GridPatch.from_data(patch_data, PLANE_DTYPES[plane])
+        written = patch.mask(live.data.shape)
+        patch.apply(live.data)
+
+        self.authors[author.id] = author
+        # The latest author of a cell journals it, so entries of one flush never overlap
+        for other in live.pending.values():
+            other &= ~written
+        if author.id in live.pending:
+            live.pending[author.id] |= written
+        else:
+            live.pending[author.id] = written
+        return patch
+
+    def _pull(self, store, section: str, plane: str, exclude=()):
+        """
+        Applies entries newer than the copy to it and moves the copy's version past them.
+        Returns their cells as [(author username, patch data)]. Cells they change are no longer pending here.
+        """
+        live = self.planes[section, plane]
+        entries = (PatternEdit.objects.filter(pattern_id=self.pattern_id, section=section, plane=plane,
+                                              version__gt=live.version)
+                   .exclude(id__in=list(exclude)).select_related('author').order_by('version'))
+
+        pulled = []
+        for entry in entries:
+            delta = CellDelta.decode(entry.delta)
+            delta.apply(live.data)
+            for mask in live.pending.values():
+                mask[delta.rows, delta.cols] = False
+            cells = {'rows': delta.rows.tolist(), 'cols': delta.cols.tolist(), 'values': delta.after.tolist()}
+            pulled.append((entry.author.username if entry.author else None, {'cells': cells}))
+            live.version = max(live.version, entry.version)
+        return pulled
+
+    def flush(self):
+        """
+        Journals pending edits and pulls entries saved elsewhere.
+        Returns (entries written, {(section, plane): pulled cells}, planes dropped), where
+        dropped planes belonged to a geometry replaced by a recompile and must be loaded again.
+        """
+        store = self._store()
+        written, pulled, dropped = [], defaultdict(list), []
+        batches = {}
+
+        for (section, plane), live in list(self.planes.items()):
+            if live.version < store.journal_base:
+                del self.planes[section, plane]
+                dropped.append((section, plane))
+                continue
+
+            pulled[section, plane] += self._pull(store, section, plane)
+
+            own = []
+            for author_id, mask in list(live.pending.items()):
+                if not mask.any():
+                    del live.pending[author_id]
+                    continue
+                rows, cols = np.nonzero(mask)
+                change = CellChange(rows, cols, live.data[rows, cols])
+                try:
+                    entry = record_edit(store, section, plane, change, self.authors[author_id],
+                                        batch=batches.get(author_id), base_version=live.version)
+                except EditConflict:
+                    # Saved elsewhere since the pull, the next flush pulls it and retries the rest
+                    continue
+                del live.pending[author_id]
+                if entry is not None:
+                    batches.setdefault(author_id, entry.version)
+                    own.append(entry)
+
+            if own:
+                # Entries merged in under ours aren't in the copy yet
+                pulled[section, plane] += self._pull(store, section, plane, exclude=[entry.id for entry in own])
+                live.version = max(live.version, *(entry.version for entry in own))
+                written += own
+
+        if any(entry.plane in RENDERED_PLANES for entry in written):
+            schedule_thumbnail(self.pattern_id)
+        return written, {key: cells for key, cells in pulled.items() if cells}, dropped
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage, FileSystemStorage
+from storages.backends.s3 import S3Storage
+
+# S3 error codes meaning the key doesn't exist (HEAD requests only return the status code)
+MISSING_KEY_CODES = ('NoSuchKey', '404', 'NotFound')
+
+
+class StorageObjects:
+    """
+    Adapter giving PatternStore whole-object and byte-range access to a Django storage.
+    Used for local filesystem storage, and for any storage without a dedicated adapter.
+    """
+    def __init__(self, storage=None):
+        self.storage = storage or default_storage
+
+    def local_path(self, path: str):
+        """
+        Filesystem path of an object, or None for storages without one.
+        """
+        if not isinstance(self.storage, FileSystemStorage):
+            return None
+        return self.storage.path(path)
+
+    def read(self, path: str, fresh=False):
+        with self.storage.open(path, 'rb') as file:
+            return file.read()
+
+    def read_range(self, path: str, start: int, length: int):
+        with self.storage.open(path, 'rb') as file:
+            file.seek(start)
+            return file.read(length)
+
+    def write(self, path: str, content: bytes):
+        local_path = self.local_path(path)
+        if local_path is not None:
+            # Replace instead of truncating, so memmaps of the old file stay valid
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            temp_path = f'{local_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as file:
+                file.write(content)
+            os.replace(temp_path, local_path)
+            return
+
+        try:
+            # Overwrites in place, storage.save would pick a new name for an existing file
+            with self.storage.open(path, 'wb') as file:
+                file.write(content)
+        except FileNotFoundError:
+            self.storage.save(path, ContentFile(content))
+
+    def delete(self, path: str):
+        self.storage.delete(path)
+
+
+class S3Objects:
+    """
+    Direct S3 access with one pooled client per process, see get_s3_client.
+
+    Reads are a single GET; a missing key raises FileNotFoundError instead of needing a HEAD first.
+    Whether a key exists is remembered for exists_ttl seconds, so hot misses don't go to S3 on
+    every request. Pass fresh=True for keys that may appear at any time (e.g. a pattern's
+    manifest): the read goes past what is remembered, and its miss isn't remembered either. Point endpoint_url at a local S3 stand-in (MinIO, LocalStack) for development.
+    """
+    def __init__(self, bucket_name: str, client=None, location: str = '', exists_ttl: float = 60.0,
+                 exists_maxsize: int = 4096):
+        self.bucket_name = bucket_name
+        self.location = location.strip('/')
+        self.client = client or get_s3_client()
+        self.exists_ttl = exists_ttl
+        self.exists_maxsize = exists_maxsize
+        self._exists = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_storage(cls, storage, **kwargs):
+        # Same bucket, key prefix, endpoint and region the storage's settings point at
+        client = get_s3_client(storage.region_name, storage.endpoint_url)
+        return cls(storage.bucket_name, client, storage.location, **kwargs)
+
+    def key(self, path: str):
+        return f'{self.location}/{path}' if self.location else path
+
+    def local_path(self, path: str):
+        return None
+
+    def _remember(self, path: str, exists: bool):
+        with self._lock:
+            if len(self._exists) >= self.exists_maxsize:
+                self._exists.clear()
+            self._exists[path] = (exists, time.monotonic() + self.exists_ttl)
+
+    def known_missing(self, path: str):
+        with self._lock:
+            exists, expires = self._exists.get(path, (True, 0.0))
+        return not exists and time.monotonic() < expires
+
+    def _get(self, path: str, fresh: bool, **kwargs):
+        if not fresh and self.known_missing(path):
+            raise FileNotFoundError(path)
+        try:
+            body = self.client.get_object(Bucket=self.bucket_name, Key=self.key(path), **kwargs)['Body']
+        except ClientError as e:
+            if e.response['Error']['Code'] in MISSING_KEY_CODES:
+                if not fresh:
+                    self._remember(path, False)
+                raise FileNotFoundError(path) from e
+            raise
+        self._remember(path, True)
+        with body:
+            return body.read()
+
+    def read(self, path: str, fresh=False):
+        return self._get(path, fresh)
+
+    def read_range(self, path: str, start: int, length: int):
+        if length <= 0:
+            return b''
+        return self._get(path, False, Range=f'bytes={start}-{start + length - 1}')
+
+    def write(self, path: str, content: bytes):
+        self.client.put_object(Bucket=self.bucket_name, Key=self.key(path), Body=content)
+        self._remember(path, True)
+
+    def delete(self, path: str):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self.key(path))
+        self._remember(path, False)
+
+    def exists(self, path: str):
+        with self._lock:
+            exists, expires = self._exists.get(path, (None, 0.0))
+        if exists is not None and time.monotonic() < expires:
+            return exists
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=self.key(path))
+        except ClientError as e:
+            if e.response['Error']['Code'] not in MISSING_KEY_CODES:
+                raise
+            self._remember(path, False)
+            return False
+        self._remember(path, True)
+        return True
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(region_name: str = None, endpoint_url: str = None):
+    """
+    Per-process S3 client, created on first use. boto3 clients are thread-safe and keep a
+    connection pool, so every request in the process shares one instead of building its own.
+    """
+    key = (os.getpid(), region_name, endpoint_url)
+    with _clients_lock:
+        if key not in _clients:
+            session = boto3.session.Session()
+            _clients[key] = session.client('s3', region_name=region_name, endpoint_url=endpoint_url,
+                                           config=Config(max_pool_connections=32,
+                                                         retries={'max_attempts': 3, 'mode': 'standard'}))
+        return _clients[key]
+
+
+_default_objects = {}
+
+
+def get_object_storage(storage=None):
+    """
+    Object access for a Django storage: S3Objects for S3 storage, StorageObjects otherwise.
+    The S3 adapter for default_storage is shared by the process, so its existence cache is too.
+    """
+    storage = storage or default_storage
+    if not isinstance(storage, S3Storage):
+        return StorageObjects(storage)
+
+    key = (os.getpid(), id(storage))
+    if key not in _default_objects:
+        _default_objects[key] = S3Objects.from_storage(storage)
+    return _default_objects[key]
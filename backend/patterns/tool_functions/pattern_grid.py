@@ -0,0 +1,246 @@
+import struct
+import zipfile
+
+import numpy as np
+
+# Pieces of a separated sweater, in the order they are compiled
+SECTIONS = ('front_torso', 'back_torso', 'left_sleeve', 'right_sleeve')
+
+# Planes of a pattern grid and their storage dtypes
+PLANE_DTYPES = {
+    'shape': np.dtype(np.int8),
+    'color': np.dtype(np.int16),
+    'stitch_type': np.dtype(np.int8),
+}
+PLANES = tuple(PLANE_DTYPES)
+
+# Interleaved record dtype used by older pattern_pieces.npz files
+LEGACY_DTYPE = np.dtype([(plane, dtype) for plane, dtype in PLANE_DTYPES.items()])
+
+
+class PatternGrid:
+    """
+    A pattern piece stored as separate contiguous planes (shape, color, stitch_type).
+
+    Planes are indexed by name like the fields of the legacy record array, so
+    grid['shape'][y, x] works the same way array['shape'][y, x] used to, and grid.shape
+    is (height, width) like a NumPy array's.
+    """
+    def __init__(self, shape, color=None, stitch_type=None):
+        shape = np.ascontiguousarray(shape, dtype=PLANE_DTYPES['shape'])
+        if shape.ndim != 2:
+            raise ValueError(f'Pattern planes must be 2D, got shape {shape.shape}')
+
+        self.planes = {'shape': shape}
+        for plane, data in (('color', color), ('stitch_type', stitch_type)):
+            if data is None:
+                data = np.zeros(shape.shape, dtype=PLANE_DTYPES[plane])
+            self[plane] = data
+
+    @classmethod
+    def blank(cls, width: int, height: int):
+        # Every cell starts as blank inside (1), no color and no stitch type
+        return cls(np.ones((height, width), dtype=PLANE_DTYPES['shape']))
+
+    @classmethod
+    def from_records(cls, records):
+        # Convert a legacy (shape, color, stitch_type) record array
+        return cls(*(records[plane] for plane in PLANES))
+
+    def to_records(self):
+        records = np.zeros(self.shape, dtype=LEGACY_DTYPE)
+        for plane, data in self.planes.items():
+            records[plane] = data
+        return records
+
+    @property
+    def shape(self):
+        return self.planes['shape'].shape
+
+    @property
+    def height(self):
+        return self.shape[0]
+
+    @property
+    def width(self):
+        return self.shape[1]
+
+    @property
+    def nbytes(self):
+        return sum(data.nbytes for data in self.planes.values())
+
+    def __getitem__(self, plane):
+        return self.planes[plane]
+
+    def __setitem__(self, plane, data):
+        if plane not in PLANE_DTYPES:
+            raise KeyError(f"Unknown plane '{plane}', expected one of {PLANES}")
+        if plane in self.planes:
+            # Write into the existing contiguous buffer, casting to the plane dtype
+            self.planes[plane][...] = data
+            return
+        data = np.ascontiguousarray(data, dtype=PLANE_DTYPES[plane])
+        if data.shape != self.shape:
+            raise ValueError(f"Plane '{plane}' has shape {data.shape}, expected {self.shape}")
+        self.planes[plane] = data
+
+    def __eq__(self, other):
+        if not isinstance(other, PatternGrid):
+            return NotImplemented
+        return all(np.array_equal(self[plane], other[plane]) for plane in PLANES)
+
+    def copy(self):
+        return PatternGrid(*(self[plane].copy() for plane in PLANES))
+
+
+# NPZ FILES
+def plane_key(section: str, plane: str):
+    return f'{section}/{plane}'
+
+
+def grids_to_npz_arrays(grids: dict, color_map):
+    """
+    Flattens {section: PatternGrid} into the arrays np.savez should write, one per plane.
+    """
+    arrays = {plane_key(section, plane): grid[plane] for section, grid in grids.items() for plane in PLANES}
+    arrays['color_map'] = color_map
+    return arrays
+
+
+def save_pattern_file(file, grids: dict, color_map):
+    np.savez(file, **grids_to_npz_arrays(grids, color_map))
+
+
+def npz_sections(npz_data):
+    """
+    Names of the sections stored in a loaded .npz, in planar or legacy layout.
+    """
+    return [section for section in SECTIONS
+            if plane_key(section, 'shape') in npz_data.files or section in npz_data.files]
+
+
+def read_section(npz_data, section: str):
+    """
+    Reads one section of a loaded .npz as a PatternGrid.
+    Handles both the planar layout and legacy (shape, color, stitch_type) record arrays.
+    Raises KeyError if the section is missing.
+    """
+    if plane_key(section, 'shape') in npz_data.files:
+        return PatternGrid(*(npz_data[plane_key(section, plane)] for plane in PLANES))
+    if section in npz_data.files:
+        return PatternGrid.from_records(npz_data[section])
+    raise KeyError(section)
+
+
+def read_plane(npz_data, section: str, plane: str):
+    """
+    Reads a single plane of one section without loading the other planes.
+    """
+    if plane_key(section, plane) in npz_data.files:
+        return npz_data[plane_key(section, plane)]
+    if section in npz_data.files:
+        return np.ascontiguousarray(npz_data[section][plane])
+    raise KeyError(section)
+
+
+def read_color_map(npz_data):
+    if 'color_map' not in npz_data.files:
+        return []
+    return npz_data['color_map'].tolist()
+
+
+# PARTIAL READS
+# np.savez stores members uncompressed, so a plane's rows sit at a fixed byte offset in the file
+_ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+
+def read_npy_header(file):
+    """
+    Reads a .npy header at the file's current position, leaving the file at the start of the data.
+    Returns (dtype, shape, fortran_order).
+    """
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+    return dtype, shape, fortran_order
+
+
+def read_rows(file, offset: int, dtype, shape, rows: slice, cols: slice):
+    """
+    Reads rows x cols of a C-order 2D array whose data starts at offset in file.
+    """
+    height, width = shape
+    rows = slice(*rows.indices(height)[:2])
+    row_count = max(0, rows.stop - rows.start)
+    row_bytes = width * dtype.itemsize
+
+    file.seek(offset + rows.start * row_bytes)
+    data = np.frombuffer(file.read(row_count * row_bytes), dtype=dtype).reshape(row_count, width)
+    return np.ascontiguousarray(data[:, cols])
+
+
+def _array_layout(file, npz_data, key: str):
+    """
+    (data offset, dtype, shape) of an uncompressed C-order array in a .npz, or None if it
+    can't be read in place.
+    """
+    info = npz_data.zip.getinfo(f'{key}.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    file.seek(info.header_offset)
+    _, name_length, extra_length = _ZIP_LOCAL_HEADER.unpack(file.read(_ZIP_LOCAL_HEADER.size))
+    file.seek(info.header_offset + _ZIP_LOCAL_HEADER.size + name_length + extra_length)
+
+    dtype, shape, fortran_order = read_npy_header(file)
+    if fortran_order or dtype.hasobject or len(shape) != 2:
+        return None
+    return file.tell(), dtype, shape
+
+
+class WindowError(ValueError):
+    """
+    A requested window holds no cells of the plane.
+    """
+
+
+def window_bounds(shape, row_start=None, row_end=None, col_start=None, col_end=None):
+    """
+    Clips a [row_start, row_end) x [col_start, col_end) window to a plane of the given shape.
+    Missing bounds cover the whole axis. Returns (row slice, col slice).
+    Raises WindowError if nothing of the plane is left, e.g. the window is inverted or starts past its end.
+    """
+    height, width = shape
+    rows = slice(*slice(row_start, row_end).indices(height)[:2])
+    cols = slice(*slice(col_start, col_end).indices(width)[:2])
+    if rows.start >= rows.stop or cols.start >= cols.stop:
+        raise WindowError(f'Window rows {row_start}:{row_end}, columns {col_start}:{col_end} '
+                          f'holds no cells of the {height}x{width} section')
+    return rows, cols
+
+
+def read_plane_window(file, npz_data, section: str, plane: str, rows: slice, cols: slice):
+    """
+    Reads rows x cols of one plane, seeking to just the rows needed instead of loading the
+    whole plane. file is the open file npz_data was loaded from. Legacy record arrays and
+    compressed members fall back to a full read.
+    """
+    key = plane_key(section, plane)
+    layout = _array_layout(file, npz_data, key) if key in npz_data.files else None
+    if layout is None:
+        return np.ascontiguousarray(read_plane(npz_data, section, plane)[rows, cols])
+
+    return read_rows(file, *layout, rows, cols)
+
+
+def plane_shape(file, npz_data, section: str):
+    """
+    (height, width) of a section, read from the shape plane's header alone when possible.
+    """
+    key = plane_key(section, 'shape')
+    layout = _array_layout(file, npz_data, key) if key in npz_data.files else None
+    if layout is None:
+        return read_plane(npz_data, section, 'shape').shape
+    return layout[2]
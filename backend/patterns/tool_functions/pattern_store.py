@@ -0,0 +1,340 @@
+import io
+import json
+
+import numpy as np
+
+from .object_storage import get_object_storage
+from .pattern_grid import PLANES, PLANE_DTYPES, PatternGrid, npz_sections, read_npy_header, \
+    read_plane as read_npz_plane, read_color_map as read_npz_color_map
+from .plane_cache import plane_cache
+
+MANIFEST_VERSION = 2
+MANIFEST_FILE = 'manifest.json'
+LEGACY_FILE = 'pattern_pieces.npz'
+# Bytes fetched for a plane's .npy header before a windowed read, headers are 128 bytes for 2D planes
+NPY_HEADER_READ = 1024
+
+
+class PatternNotFound(Exception):
+    """
+    Neither a manifest nor a legacy pattern_pieces.npz exists for the pattern.
+    """
+
+
+def pattern_directory(pattern_id):
+    return f'patterns/pattern_{pattern_id}'
+
+
+class PatternStore:
+    """
+    Storage for one pattern, one object per section and plane plus a small manifest:
+
+        patterns/pattern_{id}/manifest.json
+        patterns/pattern_{id}/{section}/{plane}.npy
+
+    The manifest records each section's shape and plane dtypes, and the color_map.
+    Reads and writes only touch the objects they need. Patterns still stored as a legacy
+    pattern_pieces.npz are read from it, and converted to this layout on their first write.
+    Objects go through get_object_storage, so on S3 every read is one GET on a pooled client.
+
+    On local filesystem storage (STAGE == 'local') planes are memory-mapped instead: reads
+    return read-only memmaps and patches are written in place through 'r+' memmaps.
+    Other storages keep decoded planes and the manifest in plane_cache when a version is
+    given, see pattern_version; any write drops the pattern from this process's cache.
+    """
+    def __init__(self, pattern_id, storage=None, version=None, cache=None, objects=None):
+        self.pattern_id = pattern_id
+        self.objects = objects or get_object_storage(storage)
+        self.version = version
+        self.cache = cache if cache is not None else plane_cache
+        self.directory = pattern_directory(pattern_id)
+        self.manifest_path = f'{self.directory}/{MANIFEST_FILE}'
+        self.legacy_path = f'{self.directory}/{LEGACY_FILE}'
+        self._manifest = None
+        self._legacy = None
+
+    def plane_path(self, section: str, plane: str):
+        return f'{self.directory}/{section}/{plane}.npy'
+
+    def _local_path(self, path: str):
+        return self.objects.local_path(path)
+
+    @property
+    def _caching(self):
+        # Local planes are memory-mapped, the OS page cache already holds them
+        return self.version is not None and self._local_path(self.manifest_path) is None
+
+    def _cache_key(self, name: str):
+        return str(self.pattern_id), self.version, name
+
+    # LOADING
+    def load(self, fresh=False):
+        """
+        Reads the manifest, falling back to the legacy npz. Raises PatternNotFound if neither exists.
+        Each is a single read, a missing object is only known from the read failing.
+        The manifest is always read past remembered misses: another process may have just
+        upgraded the pattern, and its legacy npz is gone then. fresh also skips the plane cache.
+        """
+        if self._caching and not fresh:
+            manifest = self.cache.get(self._cache_key(MANIFEST_FILE))
+            if manifest is not None:
+                self._manifest, self._legacy = json.loads(manifest), None
+                return self
+
+        try:
+            manifest = self.objects.read(self.manifest_path, fresh=True)
+            self._manifest, self._legacy = json.loads(manifest), None
+            if self._caching:
+                self.cache.put(self._cache_key(MANIFEST_FILE), manifest)
+        except FileNotFoundError:
+            try:
+                legacy = self.objects.read(self.legacy_path, fresh=fresh)
+            except FileNotFoundError:
+                if not fresh:
+                    # An upgrade may have replaced the npz with a manifest since the manifest was read
+                    return self.load(fresh=True)
+                raise PatternNotFound(self.pattern_id)
+            self._legacy = np.load(io.BytesIO(legacy), allow_pickle=True)
+            self._manifest = self._legacy_manifest()
+        return self
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self.load()
+        return self._manifest
+
+    @property
+    def is_legacy(self):
+        return self.manifest is not None and self._legacy is not None
+
+    def _legacy_manifest(self):
+        sections = {}
+        for section in npz_sections(self._legacy):
+            shape = read_npz_plane(self._legacy, section, 'shape').shape
+            sections[section] = {'shape': list(shape), 'planes': {plane: PLANE_DTYPES[plane].name for plane in PLANES}}
+        return {'version': 1, 'sections': sections, 'color_map': read_npz_color_map(self._legacy)}
+
+    def sections(self):
+        return list(self.manifest['sections'])
+
+    def section_shape(self, section: str):
+        return tuple(self.manifest['sections'][section]['shape'])
+
+    def color_map(self):
+        return self.manifest['color_map']
+
+    @property
+    def color_map_version(self):
+        # Journal version when the color_map was last saved, see journal.write_color_map
+        return self.manifest.get('color_map_version', 0)
+
+    @property
+    def journal_base(self):
+        # Journal version the planes were compiled at, older edits belong to a previous geometry
+        return self.manifest.get('journal_base', 0)
+
+    # READS
+    def read_plane(self, section: str, plane: str):
+        if section not in self.manifest['sections']:
+            raise KeyError(section)
+        if self._legacy is not None:
+            return read_npz_plane(self._legacy, section, plane)
+
+        local_path = self._local_path(self.plane_path(section, plane))
+        if local_path is not None:
+            return np.load(local_path, mmap_mode='r')
+
+        if self._caching:
+            key = self._cache_key(f'{section}/{plane}')
+            data = self.cache.get(key)
+            if data is None:
+                data = self._read_plane_object(section, plane)
+                self.cache.put(key, data)
+            return data
+        return self._read_plane_object(section, plane)
+
+    def _read_plane_object(self, section: str, plane: str):
+        return np.load(io.BytesIO(self.objects.read(self.plane_path(section, plane))))
+
+    def read_plane_window(self, section: str, plane: str, rows: slice, cols: slice):
+        """
+        Reads rows x cols of a plane, seeking to the rows needed instead of loading the whole plane.
+        """
+        if section not in self.manifest['sections']:
+            raise KeyError(section)
+        if self._legacy is not None:
+            return np.ascontiguousarray(read_npz_plane(self._legacy, section, plane)[rows, cols])
+
+        local_path = self._local_path(self.plane_path(section, plane))
+        if local_path is not None:
+            # Only the pages under the window are read
+            return np.ascontiguousarray(np.load(local_path, mmap_mode='r')[rows, cols])
+        if self._caching:
+            # Cached planes are sliced in memory, a miss caches the whole plane for later windows
+            return np.ascontiguousarray(self.read_plane(section, plane)[rows, cols])
+        return self._read_rows(section, plane, rows, cols)
+
+    def _read_rows(self, section: str, plane: str, rows: slice, cols: slice):
+        # Two ranged reads: the .npy header, then just the rows under the window
+        path = self.plane_path(section, plane)
+        header = io.BytesIO(self.objects.read_range(path, 0, NPY_HEADER_READ))
+        try:
+            dtype, (height, width), fortran_order = read_npy_header(header)
+        except ValueError:
+            fortran_order = True
+        if fortran_order:
+            return np.ascontiguousarray(self._read_plane_object(section, plane)[rows, cols])
+
+        rows = slice(*rows.indices(height)[:2])
+        row_count = max(0, rows.stop - rows.start)
+        row_bytes = width * dtype.itemsize
+        data = self.objects.read_range(path, header.tell() + rows.start * row_bytes, row_count * row_bytes)
+        return np.ascontiguousarray(np.frombuffer(data, dtype=dtype).reshape(row_count, width)[:, cols])
+
+    def read_cells(self, section: str, plane: str, rows, cols):
+        """
+        Values of the cells at rows, cols of a plane. A plane that isn't cached or memory-mapped
+        isn't read whole: only the rows from the first to the last cell are fetched.
+        """
+        if section not in self.manifest['sections']:
+            raise KeyError(section)
+        if not len(rows):
+            return np.zeros(0, dtype=PLANE_DTYPES[plane])
+        if self._legacy is not None:
+            return read_npz_plane(self._legacy, section, plane)[rows, cols]
+        local_path = self._local_path(self.plane_path(section, plane))
+        if local_path is not None:
+            # Only the pages holding the cells are read
+            return np.load(local_path, mmap_mode='r')[rows, cols]
+        if self._caching:
+            data = self.cache.get(self._cache_key(f'{section}/{plane}'))
+            if data is not None:
+                return data[rows, cols]
+
+        top = int(np.min(rows))
+        window = self._read_rows(section, plane, slice(top, int(np.max(rows)) + 1), slice(None))
+        return window[np.asarray(rows) - top, cols]
+
+    def read_section(self, section: str):
+        return PatternGrid(*(self.read_plane(section, plane) for plane in PLANES))
+
+    # WRITES
+    def _write(self, path: str, content: bytes):
+        self.cache.invalidate(self.pattern_id)
+        self.objects.write(path, content)
+
+    def _write_array(self, section: str, plane: str, data):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(data, dtype=PLANE_DTYPES[plane]))
+        self._write(self.plane_path(section, plane), buffer.getvalue())
+
+    def _write_manifest(self):
+        self._write(self.manifest_path, json.dumps(self._manifest).encode())
+
+    def _upgrade_legacy(self):
+        """
+        Moves every plane out of the legacy npz before any of them is changed, then writes the
+        manifest and deletes the npz, so no process keeps reading or upgrading the old planes.
+        If another process upgraded the pattern since it was loaded, its planes are used instead.
+        """
+        try:
+            manifest = self.objects.read(self.manifest_path, fresh=True)
+        except FileNotFoundError:
+            pass
+        else:
+            self._manifest, self._legacy = json.loads(manifest), None
+            return
+
+        legacy, self._legacy = self._legacy, None
+        for section in self._manifest['sections']:
+            for plane in PLANES:
+                self._write_array(section, plane, read_npz_plane(legacy, section, plane))
+        self._manifest['version'] = MANIFEST_VERSION
+        self._write_manifest()
+        # The pattern's sweater_file may still name the npz, deleting a missing file is harmless
+        self.objects.delete(self.legacy_path)
+
+    def save(self, grids: dict, color_map, journal_base: int = 0, color_map_version: int = None):
+        """
+        Writes every plane of {section: PatternGrid} and a fresh manifest, e.g. after a compile.
+        The manifest is written last, so readers never see sections that aren't there yet.
+        journal_base is the latest edit journal version, edits up to it don't apply to these planes.
+        color_map_version defaults to journal_base, pass it to keep a color_map saved later.
+        """
+        for section, grid in grids.items():
+            for plane in PLANES:
+                self._write_array(section, plane, grid[plane])
+
+        self._legacy = None
+        self._manifest = {
+            'version': MANIFEST_VERSION,
+            'sections': {section: {'shape': list(grid.shape),
+                                   'planes': {plane: PLANE_DTYPES[plane].name for plane in PLANES}}
+                         for section, grid in grids.items()},
+            'color_map': color_map,
+            'color_map_version': journal_base if color_map_version is None else color_map_version,
+            'journal_base': journal_base,
+        }
+        self._write_manifest()
+
+    def write_plane(self, section: str, plane: str, data):
+        """
+        Replaces one plane of a section. Only that plane's object is written.
+        """
+        if section not in self.manifest['sections']:
+            raise KeyError(section)
+        if tuple(np.shape(data)) != self.section_shape(section):
+            raise ValueError(f'Plane shape {np.shape(data)} does not match section shape {self.section_shape(section)}')
+
+        if self._legacy is not None:
+            self._upgrade_legacy()
+        self._write_array(section, plane, data)
+
+    def patch_plane(self, section: str, plane: str, patch):
+        """
+        Applies patch (anything with apply(array), e.g. a GridPatch) to a stored plane.
+        Local planes are patched in place through a writable memmap, so only the pages touched
+        are written back. Other storages read, patch and rewrite the plane.
+        """
+        if section not in self.manifest['sections']:
+            raise KeyError(section)
+        if self._legacy is not None:
+            self._upgrade_legacy()
+
+        local_path = self._local_path(self.plane_path(section, plane))
+        if local_path is None:
+            data = np.array(self._read_plane_object(section, plane))
+            patch.apply(data)
+            self._write_array(section, plane, data)
+            return
+
+        data = np.load(local_path, mmap_mode='r+')
+        try:
+            patch.apply(data)
+            data.flush()
+        finally:
+            del data
+
+    def write_color_map(self, color_map, version: int = 0):
+        """
+        Rewrites the manifest with a new color_map, saved at journal version. Only journal.write_color_map
+        should call this, it reloads the manifest under the pattern lock first.
+        """
+        if self._legacy is not None:
+            self._upgrade_legacy()
+        self.manifest['color_map'] = color_map
+        self.manifest['color_map_version'] = version
+        self._write_manifest()
+
+    def delete(self):
+        self.cache.invalidate(self.pattern_id)
+        try:
+            sections = self.sections()
+        except PatternNotFound:
+            return
+        for section in sections:
+            for plane in PLANES:
+                self.objects.delete(self.plane_path(section, plane))
+        self.objects.delete(self.manifest_path)
+        self.objects.delete(self.legacy_path)
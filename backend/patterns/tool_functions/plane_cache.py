@@ -0,0 +1,131 @@
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+
+class PlaneCache:
+    """
+    Bounded LRU cache of decoded pattern planes and manifests, keyed by
+    (pattern id, version, name) where version changes on every save of the pattern.
+
+    Entries of an old version are never read again and age out of the LRU. Saves also drop
+    every entry of their pattern from the cache of the process that made them.
+    With shared_alias set, misses fall back to that Django cache (e.g. Redis), so processes
+    share decoded planes; values are stored there as .npy bytes.
+    Planes are stored read-only and returned without copying.
+    """
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, shared_alias: str = None):
+        self.max_bytes = max_bytes
+        self.shared_alias = shared_alias
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _nbytes(value):
+        return value.nbytes if isinstance(value, np.ndarray) else len(value)
+
+    @staticmethod
+    def _shared_key(key):
+        return 'pattern_plane:' + ':'.join(str(part) for part in key)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.shared_alias:
+            payload = caches[self.shared_alias].get(self._shared_key(key))
+            if payload is not None:
+                value = np.load(io.BytesIO(payload)) if payload[:6] == b'\x93NUMPY' else payload
+                self._put_local(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Caches a plane (array) or a manifest (JSON bytes) for key.
+        """
+        if isinstance(value, np.ndarray):
+            value = np.array(value)
+            value.flags.writeable = False
+        value = self._put_local(key, value)
+
+        if self.shared_alias and value is not None:
+            if isinstance(value, np.ndarray):
+                buffer = io.BytesIO()
+                np.save(buffer, value)
+                payload = buffer.getvalue()
+            else:
+                payload = value
+            caches[self.shared_alias].set(self._shared_key(key), payload)
+
+    def _put_local(self, key, value):
+        nbytes = self._nbytes(value)
+        if nbytes > self.max_bytes:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._nbytes(self._entries.pop(key))
+            self._entries[key] = value
+            self.current_bytes += nbytes
+
+            # Evict least recently used entries until the memory bound holds
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                evicted_bytes = self._nbytes(evicted)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+                self.evicted_bytes += evicted_bytes
+        return value
+
+    def invalidate(self, pattern_id):
+        """
+        Drops every cached entry of a pattern from this process.
+        """
+        pattern_id = str(pattern_id)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == pattern_id]:
+                self.current_bytes -= self._nbytes(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+                'size': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Per-process cache used by PatternStore
+plane_cache = PlaneCache(settings.PATTERN_CACHE_BYTES, settings.PATTERN_CACHE_ALIAS)
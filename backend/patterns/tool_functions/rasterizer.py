@@ -0,0 +1,234 @@
+import logging
+
+import numpy as np
+
+from .tool_functions import bresenham_line, flood_fill_outside
+
+logger = logging.getLogger('patterns')
+
+
+# OUTLINES
+def path_segments(vertices):
+    """
+    Converts a vertex list [(x, y), ...] into an (N, 4) array of x0, y0, x1, y1 segments.
+    """
+    points = np.asarray(vertices, dtype=np.int64).reshape(-1, 2)
+    return np.hstack((points[:-1], points[1:]))
+
+
+def paths_to_segments(paths):
+    """
+    Stacks the segments of several vertex lists into a single (N, 4) array.
+    """
+    return np.vstack([path_segments(vertices) for vertices in paths] or [np.empty((0, 4), dtype=np.int64)])
+
+
+def segment_points(segments):
+    """
+    Expands an (N, 4) segment array into the x and y coordinates of every cell it covers.
+
+    Horizontal and vertical segments are expanded in one vectorized pass; only diagonal
+    segments fall back to bresenham_line.
+    """
+    segments = np.asarray(segments, dtype=np.int64).reshape(-1, 4)
+    x0, y0, x1, y1 = segments.T
+    axis_aligned = (x0 == x1) | (y0 == y1)
+
+    # Horizontal and vertical runs
+    x0, y0, x1, y1 = segments[axis_aligned].T
+    lengths = np.maximum(np.abs(x1 - x0), np.abs(y1 - y0)) + 1
+    steps = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    xs = [np.repeat(np.minimum(x0, x1), lengths) + steps * np.repeat(x0 != x1, lengths)]
+    ys = [np.repeat(np.minimum(y0, y1), lengths) + steps * np.repeat(y0 != y1, lengths)]
+
+    # Diagonal segments still need true Bresenham
+    for segment in segments[~axis_aligned]:
+        points = np.array(bresenham_line(*segment.tolist()), dtype=np.int64)
+        xs.append(points[:, 0])
+        ys.append(points[:, 1])
+
+    return np.concatenate(xs), np.concatenate(ys)
+
+
+def draw_segments(array, segments, value: int = 2):
+    """
+    Draws a batch of outline segments onto the shape plane.
+
+    Parameters:
+    - array: Pattern array created by initialize_array.
+    - segments: (N, 4) array of x0, y0, x1, y1 segments, see path_segments.
+    - value: The shape value written on the outline (default is 2).
+
+    Points outside the array are clipped in one pass and reported in a single warning.
+    """
+    shape = array['shape']
+    height, width = shape.shape
+    xs, ys = segment_points(segments)
+
+    in_bounds = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+    shape[ys[in_bounds], xs[in_bounds]] = value
+
+    clipped = in_bounds.size - np.count_nonzero(in_bounds)
+    if clipped:
+        logger.warning('Skipped %d outline points out of bounds for array with shape %s', clipped, shape.shape)
+
+
+def draw_paths(array, paths, value: int = 2):
+    """
+    Draws outline paths (lists of vertex lists) onto the shape plane, see draw_segments.
+    """
+    draw_segments(array, paths_to_segments(paths), value)
+
+
+# FILLS
+def row_runs(mask):
+    """
+    Finds every horizontal run of True cells in a 2D boolean mask.
+
+    Returns (rows, starts, ends) arrays ordered by row then start, with inclusive ends.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    rows, cols = np.nonzero(np.diff(padded, axis=1))
+
+    # Edges alternate rising/falling within each row
+    return rows[0::2], cols[0::2], cols[1::2] - 1
+
+
+def fill_outside_scanline(array, fill_value: int = 0):
+    """
+    Scanline flood fill of the blank (1) cells connected to the array border.
+
+    Works on horizontal runs instead of single cells: a run is outside if it touches the
+    border, or if it overlaps an outside run in the row above or below. This is the same
+    4-connected region flood_fill_outside finds, written back one row slice per run.
+    """
+    shape = array['shape']
+    height, width = shape.shape
+    run_rows, run_starts, run_ends = row_runs(shape == 1)
+    if run_rows.size == 0:
+        return
+
+    # Index of the first run in each row (runs are sorted by row)
+    row_offsets = np.searchsorted(run_rows, np.arange(height + 1))
+
+    # Seed with every run touching the border
+    outside = (run_rows == 0) | (run_rows == height - 1) | (run_starts == 0) | (run_ends == width - 1)
+    stack = list(np.flatnonzero(outside))
+
+    while stack:
+        run = stack.pop()
+        y, x_start, x_end = run_rows[run], run_starts[run], run_ends[run]
+        for ny in (y - 1, y + 1):
+            if not 0 <= ny < height:
+                continue
+            lo, hi = row_offsets[ny], row_offsets[ny + 1]
+
+            # Runs in a row are disjoint and sorted, so the overlapping ones are contiguous
+            first = lo + np.searchsorted(run_ends[lo:hi], x_start)
+            last = lo + np.searchsorted(run_starts[lo:hi], x_end, side='right')
+            for neighbour in range(first, last):
+                if not outside[neighbour]:
+                    outside[neighbour] = True
+                    stack.append(neighbour)
+
+    for y, x_start, x_end in zip(run_rows[outside], run_starts[outside], run_ends[outside]):
+        shape[y, x_start:x_end + 1] = fill_value
+
+
+def label_outside(mask):
+    """
+    Finds the cells of a 2D boolean mask that are 4-connected to the array border.
+
+    Labels connected components on the graph of horizontal runs (two runs are joined when
+    they overlap in adjacent rows) with vectorized union-find, so only a few whole-array
+    passes are made no matter how large the outside region is.
+    """
+    height, width = mask.shape
+    outside = np.zeros(mask.shape, dtype=bool)
+    run_rows, run_starts, run_ends = row_runs(mask)
+    if run_rows.size == 0:
+        return outside
+
+    # Each overlap between vertically adjacent runs is one contiguous segment of `both`
+    both = mask[:-1] & mask[1:]
+    segment_starts = both.copy()
+    segment_starts[:, 1:] &= ~both[:, :-1]
+    ys, xs = np.nonzero(segment_starts)
+
+    # Look up the run containing each segment start in the row above and below
+    run_keys = run_rows * (width + 1) + run_starts
+    upper = np.searchsorted(run_keys, ys * (width + 1) + xs, side='right') - 1
+    lower = np.searchsorted(run_keys, (ys + 1) * (width + 1) + xs, side='right') - 1
+
+    # Hook roots onto the smaller root of each edge, then pointer-jump until flat
+    parent = np.arange(run_rows.size)
+    while True:
+        while not np.array_equal(grand_parent := parent[parent], parent):
+            parent = grand_parent
+        upper_roots, lower_roots = parent[upper], parent[lower]
+        unjoined = upper_roots != lower_roots
+        if not unjoined.any():
+            break
+        np.minimum.at(parent, np.maximum(upper_roots, lower_roots)[unjoined],
+                      np.minimum(upper_roots, lower_roots)[unjoined])
+
+    # Any component holding a border run is outside
+    border_runs = (run_rows == 0) | (run_rows == height - 1) | (run_starts == 0) | (run_ends == width - 1)
+    outside_roots = np.zeros(run_rows.size, dtype=bool)
+    outside_roots[parent[border_runs]] = True
+    outside_runs = outside_roots[parent]
+
+    # Paint the outside runs back onto the mask
+    rows = run_rows[outside_runs]
+    starts = run_starts[outside_runs]
+    lengths = run_ends[outside_runs] - starts + 1
+    run_offsets = np.repeat(rows * width + starts - np.cumsum(lengths) + lengths, lengths)
+    outside.ravel()[run_offsets + np.arange(lengths.sum())] = True
+
+    return outside
+
+
+def fill_outside_labeled(array, fill_value: int = 0):
+    """
+    Array-based flood fill of the blank (1) cells connected to the array border.
+    Same result as flood_fill_outside without visiting cells one at a time.
+    """
+    shape = array['shape']
+    shape[label_outside(shape == 1)] = fill_value
+
+
+def _fill_outside_bfs(array, fill_value: int = 0):
+    if fill_value != 0:
+        raise ValueError("The bfs fill method only supports a fill value of 0")
+    flood_fill_outside(array)
+
+
+FILL_METHODS = {
+    'bfs': _fill_outside_bfs,
+    'scanline': fill_outside_scanline,
+    'label': fill_outside_labeled,
+}
+
+
+def fill_outside(array, method: str = 'label', fill_value: int = 0):
+    """
+    Fills the region outside the outline using one of FILL_METHODS:
+    - 'bfs': the original cell-by-cell flood_fill_outside.
+    - 'scanline': run-by-run scanline fill.
+    - 'label': whole-array connected region labeling.
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(f"Unknown fill method '{method}', expected one of {list(FILL_METHODS)}")
+    FILL_METHODS[method](array, fill_value)
+
+
+def rasterize(array, segments, value: int = 2, fill_value: int = 0, fill_method: str = 'label'):
+    """
+    Draws the outline segments and fills everything outside them.
+    Produces the same shape plane as draw_path_on_array followed by flood_fill_outside.
+    """
+    draw_segments(array, segments, value)
+    fill_outside(array, fill_method, fill_value)
+    return array
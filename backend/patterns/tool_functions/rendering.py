@@ -0,0 +1,136 @@
+import io
+import re
+
+import numpy as np
+from PIL import Image
+
+# RGBA of each shape plane value, as the pattern editor draws them (frontend PatternEditor/config.js)
+SHAPE_COLORS = {
+    0: (0, 0, 0, 0),          # Outside the piece
+    1: (255, 255, 255, 255),  # Inside
+    2: (0, 0, 0, 255),        # Outline
+    3: (215, 34, 197, 255),   # Pink
+}
+# Shape values of the old record-array files, see tool_functions.array_path_to_image
+LEGACY_SHAPE_COLORS = {
+    -1: (0, 0, 0, 0),             # Outside
+    0: (255, 255, 255, 255),      # Inside
+    1: (128, 128, 128, 255),      # Outline
+    2: (255, 192, 203, 255),      # Pink
+}
+DEFAULT_COLOR = (255, 255, 255, 255)
+# Planes an image is rendered from, edits to others don't change it
+RENDERED_PLANES = ('shape', 'color')
+
+# Thumbnails fit in THUMBNAIL_SIZE x THUMBNAIL_SIZE pixels, pieces are PIECE_GAP cells apart
+THUMBNAIL_SIZE = 256
+PIECE_GAP = 4
+
+HEX_COLOR = re.compile(r'^#?([0-9a-fA-F]{3}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})$')
+
+
+def parse_color(value):
+    """
+    RGBA tuple of a '#rgb', '#rrggbb' or '#rrggbbaa' color, or None if value isn't one.
+    """
+    match = HEX_COLOR.match(value) if isinstance(value, str) else None
+    if match is None:
+        return None
+    digits = match[1]
+    if len(digits) == 3:
+        digits = ''.join(digit * 2 for digit in digits)
+    if len(digits) == 6:
+        digits += 'ff'
+    return tuple(int(digits[i:i + 2], 16) for i in range(0, 8, 2))
+
+
+def build_lut(colors: dict, default=DEFAULT_COLOR):
+    """
+    (lut, offset) for {value: RGBA}: value's color is lut[value + offset].
+    The last row holds default, for values the table doesn't list.
+    """
+    low, high = min(colors), max(colors)
+    lut = np.empty((high - low + 2, 4), dtype=np.uint8)
+    lut[:] = default
+    for value, rgba in colors.items():
+        lut[value - low] = rgba
+    return lut, -low
+
+
+def lookup(plane, lut, offset: int = 0):
+    """
+    (height, width, 4) uint8 RGBA of a plane, every value mapped through a build_lut table in one gather.
+    """
+    index = np.asarray(plane, dtype=np.intp) + offset
+    index[(index < 0) | (index >= len(lut) - 1)] = len(lut) - 1
+    return lut[index]
+
+
+def palette_lut(color_map):
+    """
+    (lut, mapped) of a color_map as the editor saves it, {'idToColorArray': ['#rrggbb', ...]}:
+    lut[id] is the RGBA of color id and mapped[id] whether it holds a color at all.
+    Freshly compiled patterns have an empty list instead.
+    """
+    colors = (color_map.get('idToColorArray') or []) if isinstance(color_map, dict) else []
+    lut = np.zeros((len(colors), 4), dtype=np.uint8)
+    mapped = np.zeros(len(colors), dtype=bool)
+    for color_id, color in enumerate(colors):
+        rgba = parse_color(color)
+        if rgba is not None:
+            lut[color_id], mapped[color_id] = rgba, True
+    return lut, mapped
+
+
+def render_rgba(shape, color=None, color_map=None):
+    """
+    (height, width, 4) uint8 RGBA of a piece. Cells inside the piece take their color id's color
+    from color_map, cells without one the color of their shape value; outside stays transparent.
+    """
+    shape = np.asarray(shape)
+    rgba = lookup(shape, *build_lut(SHAPE_COLORS))
+    if color is None or not color_map:
+        return rgba
+
+    lut, mapped = palette_lut(color_map)
+    if not mapped.any():
+        return rgba
+    ids = np.asarray(color, dtype=np.intp)
+    painted = (shape != 0) & (ids >= 0) & (ids < len(lut))
+    painted[painted] = mapped[ids[painted]]
+    rgba[painted] = lut[ids[painted]]
+    return rgba
+
+
+def render_image(shape, color=None, color_map=None):
+    """
+    A piece as an RGBA image, one pixel per cell, see render_rgba.
+    """
+    return Image.fromarray(render_rgba(shape, color, color_map))
+
+
+def render_pieces(pieces: dict, color_map=None, size: int = THUMBNAIL_SIZE):
+    """
+    Every piece of {section: PatternGrid or {plane: array}} side by side, top aligned, scaled
+    down to fit size x size. The pieces are laid out on one RGBA array before PIL sees it.
+    """
+    rendered = [render_rgba(piece['shape'], piece['color'], color_map) for piece in pieces.values()]
+    height = max(rgba.shape[0] for rgba in rendered)
+    width = sum(rgba.shape[1] for rgba in rendered) + PIECE_GAP * (len(rendered) - 1)
+
+    canvas = np.zeros((height, width, 4), dtype=np.uint8)
+    left = 0
+    for rgba in rendered:
+        canvas[:rgba.shape[0], left:left + rgba.shape[1]] = rgba
+        left += rgba.shape[1] + PIECE_GAP
+
+    image = Image.fromarray(canvas)
+    # Nearest keeps stitches crisp instead of blurring colorwork into the background
+    image.thumbnail((size, size), Image.Resampling.NEAREST)
+    return image
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
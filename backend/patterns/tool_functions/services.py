@@ -1,16 +1,310 @@
 # Generate_Sweater_Pattern
-from datetime import timezone
-from pathlib import Path
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
 
-from django.core.files import File
-import asyncio
+import django
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
+from ..models import CompileJob, Pattern, PatternEdit, SeparatedSweater
 from ..sweater_objects import Sweater
+from .compile_executor import get_compile_executor
+from .journal import CellDelta, current_plane, latest_version, lock_pattern, touch_pattern
+from .pattern_grid import PLANES, SECTIONS, PatternGrid
+from .pattern_store import PatternNotFound, PatternStore
+from .thumbnails import save_thumbnail
 from django.conf import settings
 
+logger = logging.getLogger('patterns')
+
+
+def generate_sweater_pattern(sweater_info, executor=None):
+    if executor is None:
+        executor = get_compile_executor(settings.PATTERN_COMPILE_EXECUTOR, settings.PATTERN_COMPILE_WORKERS)
 
-def generate_sweater_pattern(sweater_info):
     sweater = Sweater(sweater_info)
-    front_torso_array, back_torso_array, left_sleeve_array, right_sleeve_array = asyncio.run(sweater.do_calculations())
+    front_torso_array, back_torso_array, left_sleeve_array, right_sleeve_array = sweater.do_calculations(executor)
 
     return front_torso_array, back_torso_array, left_sleeve_array, right_sleeve_array
+
+
+class EditsWouldBeLost(Exception):
+    """
+    Raised by compile_sweater_file when a recompile changes the shape of sections the user has edited.
+    """
+    def __init__(self, pattern_id, sections):
+        super().__init__(f"Recompiling pattern {pattern_id} would discard the edits of {', '.join(sections)}")
+        self.pattern_id = pattern_id
+        self.sections = sections
+
+
+def _compiled_shape(store, section):
+    # Shape plane as last compiled: the current one with every shape edit since the compile reverted
+    shape = np.array(current_plane(store, section, 'shape'))
+    entries = PatternEdit.objects.filter(pattern_id=store.pattern_id, version__gt=store.journal_base,
+                                         section=section, plane='shape')
+    for delta in entries.order_by('-version').values_list('delta', flat=True):
+        CellDelta.decode(delta).inverted().apply(shape)
+    return shape
+
+
+def _has_edits(store, section):
+    # Journaled edits since the compile, or colors and stitch types in its planes (legacy patterns have no journal)
+    if PatternEdit.objects.filter(pattern_id=store.pattern_id, version__gt=store.journal_base,
+                                  section=section).exists():
+        return True
+    return any(np.any(current_plane(store, section, plane)) for plane in ('color', 'stitch_type'))
+
+
+def compile_sweater_file(separated_sweater, executor=None, discard_edits=False):
+    """
+    Generates every piece of a sweater and writes them to its pattern store, one object per plane.
+    The sweater_file points at the store's manifest; a legacy pattern_pieces.npz it replaces is deleted.
+
+    Recompiling a stored pattern keeps its edits where the geometry allows: sections whose compiled
+    shape is unchanged keep their planes, and the color_map is kept. If no section changed the store
+    is left as it is. A section whose shape changed starts blank, so its edits would be lost; that raises
+    EditsWouldBeLost without writing anything unless discard_edits. Discarding closes the journal:
+    kept sections get its edits folded into their planes, and they can't be undone anymore.
+    Returns the sections whose edits were discarded.
+    The thumbnail is rendered from the written pieces too, a failure there doesn't fail the compile.
+    """
+    arrays = generate_sweater_pattern(separated_sweater, executor)
+
+    store = PatternStore(separated_sweater.id)
+    grids = dict(zip(SECTIONS, arrays))
+    # Under the pattern lock, so no edit or color_map save lands between reading the old planes and writing
+    with transaction.atomic():
+        lock_pattern(separated_sweater.id)
+        try:
+            store.load(fresh=True)
+        except PatternNotFound:
+            # Freshly compiled pieces start with an empty color_map
+            color_map, color_map_version, journal_base, discarded = [], 0, 0, []
+        else:
+            color_map, color_map_version, journal_base = \
+                store.color_map(), store.color_map_version, store.journal_base
+            changed = [section for section, grid in grids.items()
+                       if section not in store.sections() or store.section_shape(section) != grid.shape
+                       or not np.array_equal(_compiled_shape(store, section), grid['shape'])]
+            if not changed and set(store.sections()) == set(grids):
+                return []
+
+            discarded = [section for section in changed if section in store.sections() and _has_edits(store, section)]
+            if discarded and not discard_edits:
+                raise EditsWouldBeLost(separated_sweater.id, discarded)
+
+            # Kept sections carry their stored planes, the journal tail keeps applying on top of them...
+            kept = [section for section in grids if section not in changed]
+            # ... unless entries of a changed section have to be cut off, then the tail is folded in first.
+            # Copied, local planes are memory-mapped from the files about to be rewritten
+            for section in kept:
+                planes = [current_plane(store, section, plane) if discarded else store.read_plane(section, plane)
+                          for plane in PLANES]
+                grids[section] = PatternGrid(*(np.array(data) for data in planes))
+            if discarded:
+                journal_base = latest_version(separated_sweater.id)
+
+        store.save(grids, color_map=color_map, journal_base=journal_base, color_map_version=color_map_version)
+        PatternEdit.objects.filter(pattern_id=separated_sweater.id, compacted=False,
+                                   version__lte=journal_base).update(compacted=True)
+
+    if separated_sweater.sweater_file.name != store.manifest_path:
+        separated_sweater.sweater_file.name = store.manifest_path
+        separated_sweater.save()
+    touch_pattern(separated_sweater.id)
+
+    try:
+        save_thumbnail(separated_sweater.id, {section: PatternGrid(*(current_plane(store, section, plane)
+                                                                     for plane in PLANES))
+                                              for section in grids}, color_map=color_map)
+    except Exception:
+        logger.exception("Rendering the thumbnail of pattern %s failed", separated_sweater.id)
+    return discarded
+
+
+# PATTERN VERSIONS
+def pattern_version(pattern_id):
+    """
+    Version of a pattern's stored planes, from edited_on in microseconds, or None if the pattern doesn't exist.
+    Cached planes are keyed by it, so journal.touch_pattern after every write to the store or journal.
+    """
+    edited_on = Pattern.objects.filter(id=pattern_id).values_list('edited_on', flat=True).first()
+    return None if edited_on is None else int(edited_on.timestamp() * 1_000_000)
+
+
+# COMPILE JOBS
+def enqueue_compile(separated_sweater):
+    return CompileJob.objects.create(pattern=separated_sweater)
+
+
+def claim_compile_job(stale_after: timedelta = None):
+    """
+    Claims the oldest queued job and marks it running, or returns None if there is none.
+
+    Rows locked by another worker are skipped (SELECT ... FOR UPDATE SKIP LOCKED), so any
+    number of workers can poll the same table. Jobs left running for longer than
+    stale_after, e.g. by a worker that was killed, are claimed again.
+    """
+    claimable = Q(status=CompileJob.QUEUED)
+    if stale_after is not None:
+        claimable |= Q(status=CompileJob.RUNNING, started_on__lt=timezone.now() - stale_after)
+
+    with transaction.atomic():
+        job = (CompileJob.objects.select_for_update(skip_locked=True)
+               .filter(claimable)
+               .order_by('created_on')
+               .first())
+        if job is None:
+            return None
+
+        job.status = CompileJob.RUNNING
+        job.started_on = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'started_on', 'attempts'])
+    return job
+
+
+def run_compile_job(job, executor=None):
+    """
+    Compiles a claimed job's pattern and records whether it finished or failed.
+    """
+    try:
+        compile_sweater_file(job.pattern, executor)
+    except Exception as e:
+        logger.exception("Compile job %s failed", job.id)
+        job.status = CompileJob.FAILED
+        job.error = str(e)
+    else:
+        logger.info("Compile job %s finished", job.id)
+        job.status = CompileJob.DONE
+        job.error = ''
+
+    job.finished_on = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_on'])
+    return job
+
+
+# BULK RECOMPILE
+def recompile_pattern(pattern_id: int, discard_edits: bool = False):
+    """
+    Recompiles one stored pattern in place. Returns (pattern_id, error or None, discarded, skipped)
+    so a failure doesn't stop the rest of a bulk run: discarded are the sections whose edits the
+    recompile dropped (only with discard_edits), skipped those whose edits kept it from recompiling.
+    """
+    try:
+        sweater = (SeparatedSweater.objects
+                   .select_related('torso_projection', 'sleeve_projection')
+                   .get(id=pattern_id))
+        # Bulk runs already spread patterns over processes, build each one's pieces serially
+        discarded = compile_sweater_file(sweater, get_compile_executor('serial'), discard_edits)
+        return pattern_id, None, discarded, []
+    except EditsWouldBeLost as e:
+        logger.info("Skipped recompiling pattern %s: %s", pattern_id, e)
+        return pattern_id, None, [], e.sections
+    except Exception as e:
+        logger.exception("Recompiling pattern %s failed", pattern_id)
+        return pattern_id, str(e), [], []
+
+
+def load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return {'last_id': 0, 'done': 0, 'failed': {}, 'skipped': {}, 'discarded': {}}
+    with open(path) as file:
+        checkpoint = json.load(file)
+    # Checkpoints written before edits were kept across recompiles
+    checkpoint.setdefault('skipped', {})
+    checkpoint.setdefault('discarded', {})
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    if path is None:
+        return
+    # Write then rename so a crash mid-write never leaves a corrupt checkpoint
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, path)
+
+
+def recompile_patterns(queryset, chunk_size: int = 50, processes: int = None, checkpoint_path: str = None,
+                       on_chunk=None, discard_edits: bool = False):
+    """
+    Recompiles every SeparatedSweater in queryset, in id order and chunk_size ids at a time.
+
+    Chunks are fanned out over a pool of processes (processes=1 runs in this process).
+    After each chunk the highest finished id is written to checkpoint_path, so a rerun with
+    the same checkpoint resumes after it. on_chunk(stats) is called after every chunk with
+    the running totals: done, failed, skipped, elapsed and rate in patterns/sec.
+    Patterns whose edits a recompile would lose are skipped unless discard_edits, see compile_sweater_file.
+    Returns the final totals along with errors, the messages of failed patterns by id, and
+    skipped and discarded, the sections whose edits kept a pattern from recompiling or were dropped, by id.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    processes = processes or os.cpu_count() or 1
+    ids = queryset.order_by('id').values_list('id', flat=True)
+
+    pool = None
+    if processes > 1:
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        # Workers start in a fresh interpreter, load the app registry before any task touches models
+        pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(method),
+                                   initializer=django.setup)
+
+    done = 0
+    started = time.perf_counter()
+    stats = {'done': 0, 'failed': len(checkpoint['failed']), 'skipped': len(checkpoint['skipped']), 'elapsed': 0.0,
+             'rate': 0.0, 'last_id': checkpoint['last_id']}
+    try:
+        while True:
+            chunk = list(ids.filter(id__gt=checkpoint['last_id'])[:chunk_size])
+            if not chunk:
+                break
+
+            recompile = functools.partial(recompile_pattern, discard_edits=discard_edits)
+            if pool is None:
+                results = map(recompile, chunk)
+            else:
+                results = pool.map(recompile, chunk)
+
+            for pattern_id, error, discarded, skipped in results:
+                key = str(pattern_id)
+                checkpoint['failed'].pop(key, None)
+                checkpoint['skipped'].pop(key, None)
+                if error is not None:
+                    checkpoint['failed'][key] = error
+                elif skipped:
+                    checkpoint['skipped'][key] = skipped
+                else:
+                    done += 1
+                    if discarded:
+                        checkpoint['discarded'][key] = discarded
+
+            checkpoint['last_id'] = chunk[-1]
+            checkpoint['done'] += done - stats['done']
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = time.perf_counter() - started
+            stats = {'done': done, 'failed': len(checkpoint['failed']), 'skipped': len(checkpoint['skipped']),
+                     'elapsed': elapsed,
+                     'rate': done / elapsed if elapsed else 0.0, 'last_id': checkpoint['last_id']}
+            if on_chunk is not None:
+                on_chunk(stats)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # Errors of every pattern that is still failing, by id
+    stats['errors'] = checkpoint['failed']
+    stats['skipped_sections'] = checkpoint['skipped']
+    stats['discarded'] = checkpoint['discarded']
+    return stats
@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+
+
+class ShapeCache:
+    """
+    Bounded LRU cache of finished shape planes, keyed by Part.shape_key().
+
+    Front/back torsos and left/right sleeves share identical geometry, and the preset sizes
+    produce the same outlines across users, so most pieces only need rasterizing once.
+    Planes are stored read-only and copied out on every hit.
+    """
+    def __init__(self, maxsize: int = 64, max_bytes: int = 64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._planes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            plane = self._planes.get(key)
+            if plane is None:
+                self.misses += 1
+                return None
+            self._planes.move_to_end(key)
+            self.hits += 1
+        return plane.copy()
+
+    def put(self, key, plane):
+        plane = plane.copy()
+        plane.flags.writeable = False
+        if plane.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._planes:
+                self.current_bytes -= self._planes.pop(key).nbytes
+            self._planes[key] = plane
+            self.current_bytes += plane.nbytes
+
+            # Evict least recently used planes until both bounds hold
+            while len(self._planes) > self.maxsize or self.current_bytes > self.max_bytes:
+                _, evicted = self._planes.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def get_or_build(self, key, build):
+        """
+        Returns a copy of the cached plane for key, calling build() to make it on a miss.
+        """
+        plane = self.get(key)
+        if plane is None:
+            plane = build()
+            self.put(key, plane)
+        return plane
+
+    def clear(self):
+        with self._lock:
+            self._planes.clear()
+            self.current_bytes = 0
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._planes),
+                'maxsize': self.maxsize,
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Per-process cache used by Part.build_array
+shape_cache = ShapeCache()
@@ -0,0 +1,119 @@
+from math import isqrt
+
+import numpy as np
+
+
+# DISTRIBUTIONS
+def even_distribution(total: int, steps: int):
+    """
+    Spreads total over steps as evenly as possible, Bresenham style.
+    e.g. even_distribution(10, 4) -> [2, 3, 2, 3]
+    """
+    if steps <= 0:
+        return np.zeros(0, dtype=np.int64)
+    marks = (np.arange(steps + 1, dtype=np.int64) * total) // steps
+    return np.diff(marks)
+
+
+def front_loaded_distribution(total: int, steps: int):
+    """
+    Splits total into steps equal parts, adding the remainder to the first parts.
+    e.g. front_loaded_distribution(10, 4) -> [3, 3, 2, 2]
+    """
+    quotient, remainder = divmod(total, steps)
+    return quotient + (np.arange(steps, dtype=np.int64) < remainder)
+
+
+def triangular_distribution(target: int):
+    """
+    Successive integers 1, 2, 3, ... n whose sum fits in target, with the remainder
+    added one at a time to the first parts.
+    e.g. triangular_distribution(12) -> [2, 3, 3, 4]
+    """
+    if target <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Largest n with n(n + 1)/2 <= target
+    n = (isqrt(8 * target + 1) - 1) // 2
+    remainder = target - n * (n + 1) // 2
+    return np.arange(1, n + 1, dtype=np.int64) + (np.arange(n) < remainder)
+
+
+# SCHEDULES
+class ShapingSchedule:
+    """
+    Row and stitch counts for each step of a staircase edge, with their cumulative offsets.
+    Step i moves rows[i] rows and stitches[i] stitches.
+    """
+    def __init__(self, rows, stitches):
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.stitches = np.asarray(stitches, dtype=np.int64)
+        self.row_offsets = np.cumsum(self.rows)
+        self.stitch_offsets = np.cumsum(self.stitches)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return f'ShapingSchedule(rows={self.rows.tolist()}, stitches={self.stitches.tolist()})'
+
+    def key(self):
+        return tuple(self.rows.tolist()), tuple(self.stitches.tolist())
+
+    def staircase(self, x: int, y: int, x_step: int = 1, y_step: int = 1, rows_first: bool = True,
+                  reverse: bool = False):
+        """
+        Vertices of the staircase starting at (x, y) as a (2N + 1, 2) array.
+
+        Parameters:
+        - x_step, y_step: Direction to move along each axis (1 or -1).
+        - rows_first: Move down/up the rows of a step before moving across its stitches.
+        - reverse: Walk the steps from last to first.
+        """
+        row_offsets, stitch_offsets = self.row_offsets, self.stitch_offsets
+        if reverse:
+            # Offsets of the reversed steps, without recomputing the cumsum
+            row_offsets = row_offsets[-1:] - np.concatenate(([0], row_offsets[:-1]))[::-1]
+            stitch_offsets = stitch_offsets[-1:] - np.concatenate(([0], stitch_offsets[:-1]))[::-1]
+
+        ys = y + y_step * row_offsets
+        xs = x + x_step * stitch_offsets
+
+        vertices = np.empty((2 * len(self) + 1, 2), dtype=np.int64)
+        vertices[0] = x, y
+        vertices[2::2, 0] = xs
+        vertices[2::2, 1] = ys
+        if rows_first:
+            vertices[1::2, 0] = np.concatenate(([x], xs[:-1]))
+            vertices[1::2, 1] = ys
+        else:
+            vertices[1::2, 0] = xs
+            vertices[1::2, 1] = np.concatenate(([y], ys[:-1]))
+        return vertices
+
+
+def taper_schedule(remaining_rows: int, hem_offset: int):
+    """
+    Taper that moves in hem_offset stitches over remaining_rows rows.
+
+    Takes one step per row or per stitch, whichever there are fewer of, and spreads the
+    other evenly across the steps.
+    """
+    remaining_rows = max(0, remaining_rows)
+    hem_offset = max(0, hem_offset)
+    steps = min(remaining_rows, hem_offset)
+    return ShapingSchedule(even_distribution(remaining_rows, steps), even_distribution(hem_offset, steps))
+
+
+def neck_schedule(half_stitches: int, offset_rows: int, remaining_rows: int):
+    """
+    One side of a neckline: offset_rows straight down, then stitches decreasing 1, 2, 3, ...
+    with remaining_rows spread over the steps after the first.
+    """
+    stitches = triangular_distribution(half_stitches)
+    if len(stitches) > 1:
+        rows = np.concatenate(([offset_rows], front_loaded_distribution(remaining_rows, len(stitches) - 1)))
+    else:
+        # No later steps to spread the remaining rows over
+        rows = np.array([offset_rows + remaining_rows][:len(stitches)], dtype=np.int64)
+    return ShapingSchedule(rows, stitches)
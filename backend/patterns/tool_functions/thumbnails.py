@@ -0,0 +1,84 @@
+import hashlib
+import logging
+import threading
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from ..models import Pattern
+from .async_io import get_executor
+from .journal import current_plane
+from .pattern_store import PatternNotFound, PatternStore, pattern_directory
+from .rendering import RENDERED_PLANES, encode_png, render_pieces
+
+logger = logging.getLogger('patterns')
+
+# Patterns queued for a background render and not started yet
+_pending = set()
+_lock = threading.Lock()
+
+
+def save_thumbnail(pattern_id, pieces: dict, color_map):
+    """
+    Renders {section: planes} into the pattern's thumbnail. Names come from the image's content,
+    so a thumbnail never changes under its URL and can be cached for good; the one it replaces
+    is deleted. Returns the thumbnail's name.
+    """
+    png = encode_png(render_pieces(pieces, color_map))
+    name = f'{pattern_directory(pattern_id)}/thumbnail-{hashlib.blake2b(png, digest_size=8).hexdigest()}.png'
+
+    previous = Pattern.objects.filter(id=pattern_id).values_list('thumbnail', flat=True).first()
+    if previous == name:
+        return name
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(png))
+
+    # update() leaves edited_on alone, the planes and their cached versions haven't changed
+    Pattern.objects.filter(id=pattern_id).update(thumbnail=name)
+    if previous:
+        default_storage.delete(previous)
+    return name
+
+
+def render_thumbnail(pattern_id):
+    """
+    Renders the thumbnail of a stored pattern, edits in the journal included.
+    Raises PatternNotFound if the pattern has no stored planes.
+    """
+    store = PatternStore(pattern_id).load()
+    pieces = {section: {plane: current_plane(store, section, plane) for plane in RENDERED_PLANES}
+              for section in store.sections()}
+    return save_thumbnail(pattern_id, pieces, store.color_map())
+
+
+def _render_in_background(pattern_id):
+    # Edits saved from here on queue another render
+    with _lock:
+        _pending.discard(pattern_id)
+    try:
+        render_thumbnail(pattern_id)
+    except PatternNotFound:
+        pass
+    except Exception:
+        logger.exception('Rendering the thumbnail of pattern %s failed', pattern_id)
+    finally:
+        # Pool threads serve no requests, nothing else closes their connection
+        connection.close()
+
+
+def _submit(pattern_id):
+    with _lock:
+        if pattern_id in _pending:
+            return
+        _pending.add(pattern_id)
+    # One thread per process: thumbnails can lag behind, requests shouldn't
+    get_executor('thumbnail', 1).submit(_render_in_background, pattern_id)
+
+
+def schedule_thumbnail(pattern_id):
+    """
+    Re-renders a pattern's thumbnail in the background once the current transaction commits.
+    Saves made while a render is queued share it.
+    """
+    transaction.on_commit(lambda: _submit(pattern_id))
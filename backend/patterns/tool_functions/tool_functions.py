@@ -7,6 +7,10 @@ import sys
 
 from numpy import dtype
 
+from .shaping import triangular_distribution, front_loaded_distribution
+from .pattern_grid import PatternGrid
+from .rendering import LEGACY_SHAPE_COLORS, build_lut, lookup, render_image
+
 
 # SIMPLIFICATION FUNCTIONS
 def is_number(value):
@@ -19,36 +23,13 @@ def is_number(value):
 
 # NECK TOOLS
 def create_stitch_decreases(target):
-    result = []
-    i = 1
-
-    # Subtract successive integers from the target
-    while sum(result) + i <= target:
-        result.append(i)
-        i += 1
-
-    remainder = target - sum(result)
-
-    # Distribute the remainder by incrementing values in result
-    for j in range(remainder):
-        result[j] += 1
-
-    return result
+    # Successive integers whose sum fits in target, remainder spread over the first values
+    return triangular_distribution(target).tolist()
 
 
 def create_row_decreases(value, spaces):
-    # Calculate the base value for each space
-    quotient = value // spaces
-    remainder = value % spaces
-
-    # Create an array filled with the quotient value
-    result = [quotient] * spaces
-
-    # Distribute the remainder by adding 1 to some of the elements
-    for i in range(remainder):
-        result[i] += 1
-
-    return result
+    # value split into equal spaces, remainder spread over the first values
+    return front_loaded_distribution(value, spaces).tolist()
 
 
 # Change to potential just calc vertice
@@ -97,20 +78,8 @@ def standard_size_values(pattern, size):
 
 # ARRAY HANDLER #
 def initialize_array(width, height):
-    array_dtype = np.dtype([
-        ('shape', np.int8),
-        ('color', np.int16),
-        ('stitch_type', np.int8),
-    ])
-
-    pattern_array = np.zeros((height, width), dtype=array_dtype)
-
-    # Set default values
-    pattern_array['shape'] = 1
-    pattern_array['color'] = 0
-    pattern_array['stitch_type'] = 0
-
-    return pattern_array
+    # Separate contiguous shape/color/stitch_type planes, see PatternGrid
+    return PatternGrid.blank(width, height)
 
 
 def bresenham_line(x0, y0, x1, y1):
@@ -221,35 +190,13 @@ def array_path_to_image(array_file_path):
     # Load the array from the text file
     array = load_pattern(array_file_path)
 
-    # Get the dimensions of the array
-    height, width = array.shape[:2]
-
-    # Create a new image with a 1x1 pixel representation for each array element
-    image = Image.new('RGBA', (width, height), color=(255, 255, 255, 255))
-    pixels = image.load()
-
-    # Iterate through the array and set pixels
-    for y in range(height):
-        for x in range(width):
-            value = array['shape'][y, x]
-            if value == -1:
-                pixels[x, y] = (0, 0, 0, 0)  # Black for outside
-            elif value == 0:
-                pixels[x, y] = (255, 255, 255, 255)  # White for inside
-            elif value == 1:
-                pixels[x, y] = (128, 128, 128, 255)  # Grey for outlines
-            elif value == 2:
-                pixels[x, y] = (255, 192, 203, 255)  # Pink for special areas
-            else:
-                pixels[x, y] = (255, 255, 255, 255)  # Default to white
-
-    # Save the image
-    return image
+    # One pixel per array element, shape values mapped to RGBA through a lookup table
+    return Image.fromarray(lookup(array['shape'], *build_lut(LEGACY_SHAPE_COLORS)))
 
 
 # Depreciated
 def save_pattern(array, file_path):
-    np.savez(file_path, pattern_data=array, color_map=[])
+    np.savez(file_path, pattern_data=array.to_records(), color_map=[])
 
 
 # Depreciated
@@ -257,8 +204,9 @@ def load_pattern(file_path):
     return np.load(file_path)
 
 
-def render_snapshot(piece_data):
-    pass # Make this when you get a chance
+def render_snapshot(piece_data, color_map=None):
+    # One piece (PatternGrid or {plane: array}) as an RGBA image, see rendering.render_rgba
+    return render_image(piece_data['shape'], piece_data['color'], color_map)
 
 
 class KnittingConversions:
@@ -1,11 +1,18 @@
 from django.urls import path
 from .views import user_patterns, compile_pattern, save_pattern_changes, get_pattern_mode_data, \
-    get_pattern_file_data
+    get_pattern_file_data, get_compile_job, pattern_cache_stats, undo_pattern_edit, redo_pattern_edit, \
+    restore_pattern_version, pattern_edit_history
 
 urlpatterns = [
     path('user-patterns/', user_patterns, name='user_patterns'),
     path('pattern-compile/', compile_pattern, name='compile-pattern'),
+    path('compile-jobs/<int:job_id>', get_compile_job, name='get-compile-job'),
     path('patterns/<int:pattern_id>/file', get_pattern_file_data, name='get-pattern-file-data'),
     path('patterns/<int:pattern_id>/file-mode', get_pattern_mode_data, name='get-pattern-mode-data'),
     path('patterns/<int:pattern_id>/save_changes', save_pattern_changes, name='save-pattern-changes'),
+    path('patterns/<int:pattern_id>/undo', undo_pattern_edit, name='undo-pattern-edit'),
+    path('patterns/<int:pattern_id>/redo', redo_pattern_edit, name='redo-pattern-edit'),
+    path('patterns/<int:pattern_id>/restore', restore_pattern_version, name='restore-pattern-version'),
+    path('patterns/<int:pattern_id>/history', pattern_edit_history, name='pattern-edit-history'),
+    path('pattern-cache-stats/', pattern_cache_stats, name='pattern-cache-stats'),
 ]
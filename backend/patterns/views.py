@@ -1,60 +1,183 @@
+import asyncio
+import hashlib
 import io
+import json
 import os
 from importlib.metadata import metadata
 
 import numpy as np
+from adrf.decorators import api_view as async_api_view
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.db import transaction
-from rest_framework.decorators import api_view, permission_classes
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
-from .models import Pattern, SeparatedSweater
-from .serializers import GetPatternSerializer, SeparatedSweaterSerializer
-from .tool_functions.services import generate_sweater_pattern
+from .models import Pattern, SeparatedSweater, CompileJob, PatternEdit
+from .serializers import GetPatternSerializer, SeparatedSweaterSerializer, CompileJobSerializer, PatternEditSerializer
+from .renderers import PatternGridRenderer, PatternRLERenderer
+from .tool_functions.services import generate_sweater_pattern, enqueue_compile, pattern_version
+from .tool_functions.pattern_grid import PLANES, PLANE_DTYPES, WindowError, window_bounds
+from .tool_functions.pattern_store import PatternStore, PatternNotFound
+from .tool_functions.plane_cache import plane_cache
+from .tool_functions.grid_codec import GridPayload, rle_encode, rle_to_json, iter_grid_json, compress_chunks, \
+    negotiate_encoding
+from .tool_functions.grid_patch import GridPatch, PatchError
+from .tool_functions.journal import CellChange, JournalError, apply_tail, load_tail, record_edit, undo, redo, \
+    restore, version_at, latest_version, plane_versions, write_color_map
+from .tool_functions.async_io import run_io, run_decode, iterate_in_decode
+from .tool_functions.rendering import RENDERED_PLANES
+from .tool_functions.thumbnails import schedule_thumbnail
 import logging
-# Aws File Check Import
-import boto3
-from botocore.exceptions import ClientError
 
 logger = logging.getLogger('patterns')
 
 
-def custom_exist_check(file_path):
-    """
-    Check if a file exists in storage (either local filesystem or S3).
-    Uses boto3 directly for S3 because default_storage.exists() is unreliable.
-    :param file_path: The path to the file in storage.
-    :return: True if the file exists, False otherwise.
-    """
-    # Check if using S3 or local storage
-    if settings.STAGE == 'local':
-        # Use default_storage for local filesystem
-        try:
-            exists = default_storage.exists(file_path)
-            if exists:
-                logger.info(f"File exists in local storage: {file_path}")
-            else:
-                logger.error(f"File not found in local storage: {file_path}")
-            return exists
-        except Exception as e:
-            logger.error(f"Error checking file existence: {e}")
-            return False
+# Renderers for views returning grids, JSON stays the default for older clients
+GRID_RENDERERS = [JSONRenderer, BrowsableAPIRenderer, PatternGridRenderer, PatternRLERenderer]
+
+
+WINDOW_PARAMS = ('row_start', 'row_end', 'col_start', 'col_end')
+
+
+def parse_window(query_params):
+    """
+    Window bounds given in the query string, or None if no window was asked for.
+    Raises ValueError for bounds that aren't non-negative integers or end before they start.
+    Bounds past the section's end are only known once it's loaded, see window_bounds.
+    """
+    window = {}
+    for name in WINDOW_PARAMS:
+        value = query_params.get(name)
+        if value in (None, ''):
+            continue
+        if not value.isdigit():
+            raise ValueError(f"'{name}' must be a non-negative integer")
+        window[name] = int(value)
+    for start, end in (('row_start', 'row_end'), ('col_start', 'col_end')):
+        if start in window and end in window and window[end] <= window[start]:
+            raise ValueError(f"'{end}' must be greater than '{start}'")
+    return window or None
+
+
+async def read_planes(store, section, planes, window=None):
+    """
+    Reads the given planes of a section, only the rows and columns inside window if one is given.
+    Edits in the journal that aren't compacted into the stored planes yet are applied on top.
+    Returns ({plane: array}, window info or None). The window info holds the clipped bounds
+    and the full height and width of the section.
+
+    The planes are read concurrently on the storage I/O pool and the journal tail is applied
+    on the decode pool, see async_io; the event loop only waits.
+    """
+    tail = await sync_to_async(load_tail)(store, section, planes)
+    if window is None:
+        bounds, info = None, None
+        stored = await asyncio.gather(*(run_io(store.read_plane, section, plane) for plane in planes))
+    else:
+        height, width = store.section_shape(section)
+        rows, cols = window_bounds((height, width), **window)
+        bounds = (rows, cols)
+        info = {'row_start': rows.start, 'row_end': rows.stop, 'col_start': cols.start, 'col_end': cols.stop,
+                'height': height, 'width': width}
+        stored = await asyncio.gather(*(run_io(store.read_plane_window, section, plane, rows, cols)
+                                        for plane in planes))
+
+    data = dict(zip(planes, stored))
+    if any(tail.values()):
+        data = await run_decode(lambda: {plane: apply_tail(data[plane], tail[plane], bounds) for plane in planes})
+    return data, info
+
+
+async def grid_response(request, key, planes, color_map=None, window=None, version=None):
+    """
+    Responds with planes in the negotiated format.
+    - PatternGridRenderer: binary grid.
+    - PatternRLERenderer: JSON {key: {'encoding': 'rle', plane: runs, color_map}}, see rle_encode.
+    - JSONRenderer: JSON {key: {plane: nested lists, color_map}}, streamed, see stream_grid_json.
+    - Otherwise (browsable API) the same data as a regular Response.
+    Windowed reads also carry the window bounds and full section size under 'window', and
+    every read the journal version it includes under 'version', the base_version of later saves.
+    """
+    extra = {} if color_map is None else {'color_map': color_map}
+    if window is not None:
+        extra['window'] = window
+    if version is not None:
+        extra['version'] = version
+
+    if request.accepted_renderer.format == PatternGridRenderer.format:
+        # Encoded when Django renders the response, which it does off the event loop
+        return Response(GridPayload(planes, **extra))
+
+    if request.accepted_renderer.format == JSONRenderer.format:
+        return stream_grid_json(request, key, planes, **extra)
+
+    if request.accepted_renderer.format == PatternRLERenderer.format:
+        response_data = {'encoding': 'rle'}
+        response_data.update(await run_decode(
+            lambda: {plane: rle_to_json(rle_encode(data)) for plane, data in planes.items()}))
     else:
-        # Use boto3 directly for S3 (default_storage.exists() is broken for S3)
-        s3 = boto3.client('s3')
-        try:
-            s3.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=file_path)
-            logger.info(f"File exists in S3: {file_path}")
-            return True
-        except ClientError as e:
-            if e.response['Error']['Code'] == "404":
-                logger.error(f"File not found in S3: {file_path}")
-            else:
-                logger.error(f"Error accessing S3: {e}")
-            return False
+        response_data = await run_decode(lambda: {plane: data.tolist() for plane, data in planes.items()})
+    response_data.update(extra)
+    return Response({key: response_data})
+
+
+def stream_grid_json(request, key, planes, **extra):
+    """
+    Streams planes as nested-list JSON a block of rows at a time, gzip or deflate compressed
+    when the client accepts it, so memory per request doesn't grow with the size of the piece.
+    Under ASGI the blocks are encoded on the decode pool; Django would otherwise consume a
+    sync iterator in full before sending anything.
+    """
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+    chunks = compress_chunks(iter_grid_json(key, planes, **extra), encoding)
+    if isinstance(request._request, ASGIRequest):
+        chunks = iterate_in_decode(chunks)
+    response = StreamingHttpResponse(chunks, content_type='application/json')
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def grid_etag(request, pattern_id, version, section, planes, window=None):
+    """
+    Strong ETag for one representation of a section's planes: the pattern's stored version
+    plus everything that changes the response body (planes, negotiated format, window).
+    None if the pattern has no version, i.e. doesn't exist.
+    """
+    if version is None:
+        return None
+    representation = [pattern_id, version, section, list(planes), request.accepted_renderer.format,
+                      sorted((window or {}).items()), negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))]
+    digest = hashlib.blake2b(json.dumps(representation).encode(), digest_size=12).hexdigest()
+    return f'"{version}-{digest}"'
+
+
+def conditional_grid_response(request, etag):
+    """
+    304 Not Modified if If-None-Match matches etag, otherwise None.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_grid_cache_headers(response, etag)
+    return response
+
+
+def set_grid_cache_headers(response, etag):
+    # Browsers keep the grid but revalidate it on every use, edits change the ETag
+    if etag is not None and response.status_code in (200, 304):
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
 
 
 # Create your views here.
@@ -103,222 +226,356 @@ def compile_pattern(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     logger.info("Serializer validation passed.")
-    if serializer.is_valid():
-        # Wrap in transaction to delete partial data if on failure
+    try:
+        # Save the pattern and queue its compile together, a CompileWorker builds the file
         with transaction.atomic():
-            try:
-                # Save the pattern object
-                separated_sweater = serializer.save(author=request.user)
-                logger.info("Pattern object saved successfully.")
-
-                # Perform calculations and generate arrays
-                try:
-                    front_torso_array, back_torso_array, left_sleeve_array, right_sleeve_array = generate_sweater_pattern(separated_sweater)
-                    logger.info("Sweater pattern generated successfully.")
-                except Exception as e:
-                    logger.error("Error generating sweater pattern: %s", str(e))
-                    return Response({"error": "Failed to generate sweater pattern.", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                # Create an empty color_map
-                color_map = np.array([], dtype='U7')
-
-                # Save arrays and color_map to an .npz file
-                file_buffer = io.BytesIO()
-                np.savez(file_buffer,
-                         front_torso=front_torso_array,
-                         back_torso=back_torso_array,
-                         left_sleeve=left_sleeve_array,
-                         right_sleeve=right_sleeve_array,
-                         color_map=color_map)
-                file_buffer.seek(0)
-
-                storage_backend = 'S3' if settings.STAGE != 'local' else 'local storage'
-                logger.info("Saving file to %s", storage_backend)
-                separated_sweater.sweater_file.save('pattern_pieces.npz', ContentFile(file_buffer.read()))
-                logger.info("File successfully saved to %s.", storage_backend)
-
-                separated_sweater.save()
-                logger.info("Pattern file saved successfully to %s.", storage_backend)
-
-                return Response({
-                    "message": "Pattern created successfully",
-                    "pattern": serializer.data,
-                    "pattern_id": separated_sweater.id
-                }, status=status.HTTP_201_CREATED)
-
-            except Exception as e:
-                logger.error("Unexpected error during pattern creation: %s", str(e))
-                return Response({"error": "An unexpected error occurred.", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            separated_sweater = serializer.save(author=request.user)
+            job = enqueue_compile(separated_sweater)
+        logger.info("Pattern %s saved, queued compile job %s.", separated_sweater.id, job.id)
+    except Exception as e:
+        logger.error("Unexpected error during pattern creation: %s", str(e))
+        return Response({"error": "An unexpected error occurred.", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response({
+        "message": "Pattern queued for compiling",
+        "pattern": serializer.data,
+        "pattern_id": separated_sweater.id,
+        "job_id": job.id,
+        "status": job.status,
+    }, status=status.HTTP_202_ACCEPTED)
 
 
-# Returns information from the view_mode of a section
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def get_pattern_mode_data(request, pattern_id):
-    file_name = 'pattern_pieces.npz'
-    view_mode = request.query_params.get('view_mode')
-    section_key = request.query_params.get('section')
+def get_compile_job(request, job_id):
+    """
+    Status of a compile job queued by compile_pattern.
+    """
+    try:
+        job = CompileJob.objects.get(id=job_id, pattern__author=request.user)
+    except CompileJob.DoesNotExist:
+        return Response({'error': f'Compile job {job_id} not found'}, status=404)
 
-    # Construct the file path
-    file_path = f'patterns/pattern_{pattern_id}/{file_name}'
+    return Response(CompileJobSerializer(job).data)
 
-    if not custom_exist_check(file_path):
-        logger.error('Error: File does not exist at the specified path in storage.')
-        return Response({'error': f'File not found: {file_path}'}, status=404)
 
-    # Define a mapping for view_mode to index in the tuple
-    view_mode_to_index = {
-        'shape': 0,
-        'color': 1,
-        'stitch_type': 2,
-    }
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def pattern_cache_stats(request):
+    """
+    Hit ratio, evictions and size of this process's decoded plane cache.
+    """
+    return Response(plane_cache.info())
 
-    if view_mode not in view_mode_to_index:
-        return Response({'error': f"Invalid view mode '{view_mode}'"}, status=400)
 
-    try:
-        # Load the .npz file from storage
-        with default_storage.open(file_path, 'rb') as file:
-            npz_data = np.load(file, allow_pickle=True)
+# Returns information from the view_mode of a section
+@async_api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes(GRID_RENDERERS)
+async def get_pattern_mode_data(request, pattern_id):
+    view_mode = request.query_params.get('view_mode')
+    section_key = request.query_params.get('section')
 
-            if section_key not in npz_data:
-                return Response({'error': f"Invalid section '{section_key}' in file."}, status=400)
+    if view_mode not in PLANES:
+        return Response({'error': f"Invalid view mode '{view_mode}'"}, status=400)
 
-            # Extract the section data
-            section_data = npz_data[section_key]
-            index = view_mode_to_index[view_mode]
+    try:
+        window = parse_window(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
 
-            # Process the data for the requested view mode
-            grid_data = [[int(cell[index]) for cell in row] for row in section_data]
+    # Answer revalidations from the version alone, before touching storage
+    version = await sync_to_async(pattern_version)(pattern_id)
+    etag = grid_etag(request, pattern_id, version, section_key, [view_mode], window)
+    not_modified = conditional_grid_response(request, etag)
+    if not_modified is not None:
+        return not_modified
 
-            # Add color_map if view_mode is 'color'
-            response_data = {f'{view_mode}': grid_data}
-            if view_mode == 'color' and 'color_map' in npz_data:
-                response_data['color_map'] = npz_data.get('color_map', {}).tolist()
-                logger.info('Appended color_map to response:  %s', response_data['color_map'])
+    try:
+        store = await run_io(PatternStore(pattern_id, version=version).load)
+    except PatternNotFound:
+        logger.error('Error: No pattern data in storage for pattern %s.', pattern_id)
+        return Response({'error': f'Pattern data not found for pattern {pattern_id}'}, status=404)
 
-            logger.info('Extracted grid_data:  %s', grid_data)
-            return Response({'mode_data': response_data})
+    if section_key not in store.sections():
+        return Response({'error': f"Invalid section '{section_key}' in file."}, status=400)
 
+    try:
+        # Read before the planes, so the planes hold at least every edit up to it
+        journal_version = await sync_to_async(latest_version)(pattern_id)
+        # Read only the requested plane of the section, or just the window of it
+        planes, window = await read_planes(store, section_key, [view_mode], window)
+
+        # Add color_map if view_mode is 'color'
+        color_map = None
+        if view_mode == 'color':
+            color_map = store.color_map()
+            logger.info('Appended color_map to response:  %s', color_map)
+
+        logger.info('Extracted %s plane of %s:  %s', view_mode, section_key, planes[view_mode].shape)
+        return set_grid_cache_headers(
+            await grid_response(request, 'mode_data', planes, color_map, window, journal_version), etag)
+
+    except WindowError as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
         logger.error('Error processing pattern data:  %s', str(e))
         return Response({'error': str(e)}, status=500)
 
 
 # This returns all grid information for a section
-@api_view(['GET'])
+@async_api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def get_pattern_file_data(request, pattern_id):
-    file_name = 'pattern_pieces.npz'
+@renderer_classes(GRID_RENDERERS)
+async def get_pattern_file_data(request, pattern_id):
     section = request.query_params.get('section')
 
-    # Construct the file path
-    file_path = f'patterns/pattern_{pattern_id}/{file_name}'
-    logger.info('file path is %s', file_path)
+    try:
+        window = parse_window(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
 
-    if not custom_exist_check(file_path):
-        logger.error('Error: File does not exist at the specified path in storage.')
-        return Response({'error': f'File not found: {file_path}'}, status=404)
+    # Answer revalidations from the version alone, before touching storage
+    version = await sync_to_async(pattern_version)(pattern_id)
+    etag = grid_etag(request, pattern_id, version, section, PLANES, window)
+    not_modified = conditional_grid_response(request, etag)
+    if not_modified is not None:
+        return not_modified
 
     try:
-        # Load the .npz file from storage
-        with default_storage.open(file_path, 'rb') as file:
-            npz_data = np.load(file, allow_pickle=True)
-
-            if section not in npz_data:
-                return Response({'error': f"Invalid section '{section}' in file."}, status=400)
-
-            # Extract the specified section
-            section_data = npz_data[section]
-
-            response_data = {
-                'shape': [],
-                'color': [],
-                'stitch_type': [],
-                'color_map': npz_data.get('color_map', {}).tolist()
-            }
-
-            # Extract shape, color, and stitch_type from the data
-            for row in section_data:
-                shape_row = []
-                color_row = []
-                stitch_type_row = []
-
-                for cell in row:
-                    shape_row.append(int(cell[0]))  # Assuming the first index represents shape
-                    color_row.append(int(cell[1]))  # Assuming the second index represents color
-                    stitch_type_row.append(int(cell[2]))  # Assuming the third index represents stitch type
-
-                response_data['shape'].append(shape_row)
-                response_data['color'].append(color_row)
-                response_data['stitch_type'].append(stitch_type_row)
-
-            # Add any saved color_maps
-            logger.info('Extracted grid_data:  %s', response_data)
-            return Response({'file_data': response_data})
+        store = await run_io(PatternStore(pattern_id, version=version).load)
+    except PatternNotFound:
+        logger.error('Error: No pattern data in storage for pattern %s.', pattern_id)
+        return Response({'error': f'Pattern data not found for pattern {pattern_id}'}, status=404)
 
+    if section not in store.sections():
+        return Response({'error': f"Invalid section '{section}' in file."}, status=400)
+
+    try:
+        # Read before the planes, so the planes hold at least every edit up to it
+        journal_version = await sync_to_async(latest_version)(pattern_id)
+        # Read every plane of the section, or just the window of them
+        planes, window = await read_planes(store, section, PLANES, window)
+
+        # Add any saved color_maps
+        logger.info('Extracted grid_data:  %s', list(planes))
+        return set_grid_cache_headers(await grid_response(request, 'file_data', planes, store.color_map(), window,
+                                                          journal_version), etag)
+
+    except WindowError as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
-        logger.error(f"Error processing the .npz file: {e}")
+        logger.error(f"Error reading pattern data: {e}")
         return Response({'error': str(e)}, status=500)
 
 
-@api_view(['POST'])
+def merged_versions(pattern_id, section, plane, base_version, version):
+    # Versions of other saves since base_version that an edit at version was merged on top of
+    if base_version is None:
+        return []
+    return list(PatternEdit.objects.filter(pattern_id=pattern_id, section=section, plane=plane,
+                                           version__gt=base_version, version__lt=version)
+                .values_list('version', flat=True))
+
+
+@async_api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def save_pattern_changes(request, pattern_id):
+async def save_pattern_changes(request, pattern_id):
+    """
+    Saves edits to one plane of a section, sent either as
+    - patch: sparse changes, see GridPatch, or
+    - changed_data: the full plane as nested lists (older clients).
+    The cells that changed are appended to the pattern's edit journal, see journal.record_edit;
+    only the manifest is rewritten in storage, when the color_map changes.
+
+    base_version, the version of the grid the edits were made on (see grid_response), lets
+    concurrent editors save without overwriting each other: edits from other saves since then
+    are kept, and the save is refused with 409 only if they changed any of the same cells, or
+    gave a color id a different color, see journal.write_color_map.
+    Without it the edits overwrite whatever is stored, as for older clients.
+    Responds with the journal version of the edit and the versions of other saves merged under it.
+
+    The journal append and the color_map save work under the pattern's lock or retry loop, so they
+    run whole in the request's sync thread; loading the store and decoding the sent grid go to the
+    async_io pools.
+    """
     logger.info('Save Pattern Changes View is called')
 
     if request.user.is_test_account:
         return Response({'error': 'Test accounts cannot save pattern changes'}, status=status.HTTP_403_FORBIDDEN)
 
-    file_name = 'pattern_pieces.npz'
     section = request.data.get('section')
     view_mode = request.data.get('view_mode')
     new_grid_data = request.data.get('changed_data')
+    patch_data = request.data.get('patch')
     color_map = request.data.get('color_map')
+    base_version = request.data.get('base_version')
 
-    if not new_grid_data:
+    if not new_grid_data and not patch_data:
         logger.info(f'No Changes To Save for pattern_id={pattern_id}, section={section}, view_mode={view_mode}')
         return Response({'message': 'No Changes To Save'}, status=204)
 
-    file_path = f'patterns/pattern_{pattern_id}/{file_name}'
-    logger.info('file path is: %s', file_path)
+    if base_version is not None:
+        if not str(base_version).isdigit():
+            return Response({'error': "'base_version' must be a non-negative integer"}, status=400)
+        base_version = int(base_version)
 
     try:
-        # Convert the received grid data to a NumPy array
-        new_grid_array = np.array(new_grid_data)
-        logger.info('new grid converted: %s', new_grid_array)
+        # Versioned, so the cells the save reads come from cached planes when this process has them
+        stored_version = await sync_to_async(pattern_version)(pattern_id)
+        store = await run_io(PatternStore(pattern_id, version=stored_version).load)
+    except PatternNotFound:
+        return Response({'error': f'Pattern data not found for pattern {pattern_id}'}, status=404)
 
-        # Load the .npz file from storage
-        with default_storage.open(file_path, 'rb') as file:
-            npz_data = np.load(file, allow_pickle=True)
-
-            # Extract existing data
-            file_content = {key: npz_data[key] for key in npz_data}
-            logger.info('Loaded npz file data: %s', file_content.keys())
+    try:
+        if view_mode not in PLANES:
+            return Response({'error': f"Invalid view mode '{view_mode}'"}, status=400)
 
         # Ensure the section exists
-        if section not in file_content:
+        if section not in store.sections():
             return Response({'error': f"Section '{section}' not found in the file."}, status=400)
 
-        # Update the specific section's data
-        file_content[section][view_mode] = new_grid_array
-        logger.info(f"Updated {view_mode} data for section {section}.")
-
+        # Saved first: a color_map without the cells using it is harmless, the other way round isn't
         if view_mode == 'color' and color_map:
-            file_content['color_map'] = color_map
+            try:
+                await sync_to_async(write_color_map)(store, color_map, base_version)
+            except JournalError as e:
+                return await sync_to_async(conflict_response)(pattern_id, e)
             logger.info(f"Updated color_map data for section {section}. Color_Map consists of: %s", color_map)
 
-        # Save the updated content back to the .npz file in storage
-        with default_storage.open(file_path, 'wb') as file:
-            np.savez(file, **file_content)
-        logger.info('File successfully updated.')
+        if patch_data:
+            # Sparse changes, applied on top of the current plane
+            try:
+                patch = await run_decode(GridPatch.from_data, patch_data, PLANE_DTYPES[view_mode])
+                logger.info('patch received: %s cells', len(patch))
+                change = await run_decode(lambda: CellChange(*patch.cells(store.section_shape(section))))
+                edit = await sync_to_async(record_edit)(store, section, view_mode, change, request.user,
+                                                        base_version=base_version)
+            except PatchError as e:
+                return Response({'error': str(e)}, status=400)
+            except JournalError as e:
+                return await sync_to_async(conflict_response)(pattern_id, e)
+        else:
+            # Convert the received grid data to the plane's dtype
+            new_grid_array = await run_decode(np.asarray, new_grid_data, dtype=PLANE_DTYPES[view_mode])
+            logger.info('new grid converted: %s', new_grid_array.shape)
+            if new_grid_array.shape != store.section_shape(section):
+                return Response({'error': f"Grid shape {new_grid_array.shape} does not match section shape {store.section_shape(section)}."}, status=400)
+            # Only the cells that differ from the current plane are journaled
+            try:
+                change = await run_decode(CellChange.of_plane, new_grid_array)
+                edit = await sync_to_async(record_edit)(store, section, view_mode, change, request.user,
+                                                        base_version=base_version)
+            except JournalError as e:
+                return await sync_to_async(conflict_response)(pattern_id, e)
+
+        # record_edit and write_color_map moved the pattern to a new version
+        logger.info(f"Updated {view_mode} data for section {section}.")
+        if view_mode in RENDERED_PLANES:
+            await sync_to_async(schedule_thumbnail)(pattern_id)
 
-        return Response(status=200)
+        logger.info('File successfully updated.')
+        version = edit.version if edit else await sync_to_async(latest_version)(pattern_id)
+        merged = await sync_to_async(merged_versions)(pattern_id, section, view_mode, base_version, version)
+        return Response({'version': version, 'merged': merged}, status=200)
     except Exception as e:
         logger.error('Error during file update: %s', str(e))
         return Response({'error': str(e)}, status=500)
 
 
+def conflict_response(pattern_id, error):
+    """
+    409 for a JournalError, listing the conflicting entries of an EditConflict.
+    """
+    return Response({'error': str(error),
+                     'conflicts': PatternEditSerializer(getattr(error, 'entries', []), many=True).data,
+                     'version': latest_version(pattern_id)}, status=409)
+
+
+def journal_response(request, pattern_id, action):
+    """
+    Runs action(store) on the pattern's journal, e.g. undo, and responds with the edits it
+    produced or reverted and the journal's latest version. 409 if the journal can't do it.
+    """
+    if not SeparatedSweater.objects.filter(id=pattern_id, author=request.user).exists():
+        return Response({'error': f'Pattern {pattern_id} not found'}, status=404)
+    if request.user.is_test_account:
+        return Response({'error': 'Test accounts cannot save pattern changes'}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        store = PatternStore(pattern_id).load()
+    except PatternNotFound:
+        return Response({'error': f'Pattern data not found for pattern {pattern_id}'}, status=404)
+
+    try:
+        edits = action(store)
+    except JournalError as e:
+        return conflict_response(pattern_id, e)
+
+    edits = edits if isinstance(edits, list) else [edits]
+    schedule_thumbnail(pattern_id)
+    return Response({'edits': PatternEditSerializer(edits, many=True).data, 'version': latest_version(pattern_id)})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def undo_pattern_edit(request, pattern_id):
+    """
+    Undoes the latest edit of a pattern that isn't undone yet.
+    """
+    return journal_response(request, pattern_id, lambda store: undo(store, request.user))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def redo_pattern_edit(request, pattern_id):
+    """
+    Redoes the most recently undone edit of a pattern, unless it has been edited since.
+    """
+    return journal_response(request, pattern_id, lambda store: redo(store, request.user))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def restore_pattern_version(request, pattern_id):
+    """
+    Restores a pattern to a journal version, given as version or as an ISO 8601 timestamp.
+    The restore is itself journaled, so it can be undone.
+    """
+    version = request.data.get('version')
+    timestamp = request.data.get('timestamp')
+    if timestamp is not None:
+        timestamp = parse_datetime(str(timestamp))
+        if timestamp is None:
+            return Response({'error': "'timestamp' must be an ISO 8601 datetime"}, status=400)
+    elif not str(version).isdigit():
+        return Response({'error': "'version' or 'timestamp' is required"}, status=400)
+
+    def action(store):
+        return restore(store, version_at(store, timestamp) if timestamp is not None else int(version), request.user)
+
+    return journal_response(request, pattern_id, action)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def pattern_edit_history(request, pattern_id):
+    """
+    Edit journal of a pattern, newest first. ?limit= caps the entries returned (default 100).
+    Also returns the latest version overall and of each section's planes.
+    """
+    limit = request.query_params.get('limit', '100')
+    if not limit.isdigit():
+        return Response({'error': "'limit' must be a non-negative integer"}, status=400)
+    if not SeparatedSweater.objects.filter(id=pattern_id, author=request.user).exists():
+        return Response({'error': f'Pattern {pattern_id} not found'}, status=404)
+
+    edits = PatternEdit.objects.filter(pattern_id=pattern_id).select_related('reverts', 'author') \
+        .order_by('-version')[:int(limit)]
+    return Response({'edits': PatternEditSerializer(edits, many=True).data, 'version': latest_version(pattern_id),
+                     'planes': plane_versions(pattern_id)})
+
+
 # Very Broken || Very Depreciated
 # @api_view(['POST'])
 # @permission_classes([IsAuthenticated])
@@ -41,6 +41,7 @@ const Patterns = () => {
             <div className="card-container">
                 {patterns.map((pattern, index) => (
                     <Card key={pattern.id} index={index} onClick={() => navigate(`/pattern-view/${pattern.id}`)}>
+                        {pattern.thumbnail && <img className="card-thumbnail" src={pattern.thumbnail} alt={pattern.name} />}
                         <h2>{pattern.name}</h2>
                         <p>{pattern.content}</p>
                         <small>Created at: {new Date(pattern.created_on).toLocaleString()}</small>
@@ -43,6 +43,7 @@ const Dashboard = () => {
               <div className="card-container">
                   {recentPatterns.map((pattern, index) => (
                       <Card key={pattern.id} index={index} onClick={() => navigate(`/pattern-view/${pattern.id}`)}>
+                          {pattern.thumbnail && <img className="card-thumbnail" src={pattern.thumbnail} alt={pattern.name} />}
                           <h2>{pattern.name}</h2>
                           <p>{pattern.content}</p>
                           <small>Created: {new Date(pattern.created_on).toLocaleDateString()}</small>
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import './PatternCreate.css'
-import { compilePattern } from '../../services/data.service.ts'
+import { compilePattern, waitForCompileJob } from '../../services/data.service.ts'
 import { useNavigate } from 'react-router-dom';
 import { useTheme } from '../../context/ThemeContext';
 
@@ -109,7 +109,10 @@ const PatternCreate = () => {
     try {
       // Call the TypeScript service function to compile the pattern
       const response = await compilePattern(data);
-      alert(response.message || "Pattern compiled successfully!");
+
+      // The pattern is compiled by a background worker, wait for it to finish
+      await waitForCompileJob(response.job_id);
+      alert("Pattern compiled successfully!");
       const patternId = response.pattern_id;
 
       navigate(`/pattern-view/${patternId}`);
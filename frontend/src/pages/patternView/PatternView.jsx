@@ -1,7 +1,13 @@
 // PatternView.jsx
 import React, {useEffect, useRef, useState} from 'react';
 import {useParams} from 'react-router-dom';
-import {fetchPatternDataByFile, fetchPatternDataByMode, savePatternChanges} from '../../services/data.service';
+import {
+  diffGrids,
+  fetchPatternDataByFile,
+  fetchPatternDataByMode,
+  savePatternChanges,
+  savePatternPatch
+} from '../../services/data.service';
 import PatternGrid from "../../components/PatternEditor/PatternGrid.jsx";
 import {
   ColorMapper,
@@ -26,6 +32,10 @@ const PatternView = () => {
     stitch_type: [[]]
   });
   const [isLoading, setIsLoading] = useState(false);
+  // Last grids known to match the server, per view mode, so saves can send only the changed cells
+  const savedGrids = useRef({});
+  // Journal version each saved grid reflects, sent with patches so concurrent saves are merged
+  const savedVersions = useRef({});
 
   const LOCAL_STORAGE_KEY = `patternEditor-${patternId}-${selectedSection}-${viewMode}`;
   const colorMapper = useRef(new ColorMapper(`patternEditor-${patternId}-${selectedSection}-color`)).current;
@@ -65,6 +75,8 @@ const PatternView = () => {
             for (const mode of viewModes) {
               newGridData[mode] = fetchedData[mode]
               newChanges[mode] = {};
+              savedGrids.current[mode] = fetchedData[mode];
+              savedVersions.current[mode] = fetchedData.version;
             }
             colorMapper.updateValuesFromBackend(fetchedData['color_map'])
           } else {
@@ -78,6 +90,9 @@ const PatternView = () => {
                   const parsedData = JSON.parse(savedData);
                   newGridData[mode] = parsedData;
                   newChanges[mode] = parsedData;
+                  // May hold unsaved edits, so it can't be diffed against
+                  delete savedGrids.current[mode];
+                  delete savedVersions.current[mode];
                   //console.log(`Loaded ${mode} from local storage`, savedData);
                 } catch (error) {
                   console.error(`Failed to parse ${mode} data from local storage`, error);
@@ -91,6 +106,8 @@ const PatternView = () => {
                 });
                 newGridData[mode] = fetchedData[mode];
                 newChanges[mode] = {};
+                savedGrids.current[mode] = fetchedData[mode];
+                savedVersions.current[mode] = fetchedData.version;
                 if (mode === 'color') {
                   colorMapper.updateValuesFromBackend(fetchedData['color_map'])
                 }
@@ -144,7 +161,23 @@ const PatternView = () => {
       }
 
 
-      const status_code = await savePatternChanges(dataToSave);
+      // Send only the changed cells when the grid on the server is known
+      const updatedGrid = changes[viewMode];
+      const patch = Array.isArray(updatedGrid) ? diffGrids(savedGrids.current[viewMode], updatedGrid) : null;
+
+      let status_code;
+      if (patch && patch.cells.rows.length === 0 && viewMode !== 'color') {
+        status_code = 204;
+      } else if (patch) {
+        const saved = await savePatternPatch({ ...dataToSave, patch, baseVersion: savedVersions.current[viewMode] });
+        status_code = saved.status;
+        savedVersions.current[viewMode] = saved.version;
+      } else {
+        status_code = await savePatternChanges(dataToSave);
+      }
+      if (Array.isArray(updatedGrid) && (status_code === 200 || status_code === 204)) {
+        savedGrids.current[viewMode] = updatedGrid;
+      }
       if (status_code === 204) {
         alert('No changes needed to be made');
       } else if (status_code === 200) {
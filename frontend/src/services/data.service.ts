@@ -83,6 +83,43 @@ export const compilePattern = async (data: CompilePatternData) => {
   }
 };
 
+export interface CompileJob {
+  job_id: number;
+  pattern_id: number;
+  status: 'queued' | 'running' | 'done' | 'failed';
+  error: string;
+  attempts: number;
+  created_on: string;
+  started_on: string | null;
+  finished_on: string | null;
+}
+
+export const fetchCompileJob = async (jobId: number): Promise<CompileJob> => {
+  try {
+    const response = await axiosInstance.get(`/compile-jobs/${encodeURIComponent(jobId)}`);
+    return response.data;
+  } catch (error: any) {
+    console.error('API error:', error);
+    throw new Error(error.response?.data?.error || 'Failed to fetch compile job.');
+  }
+};
+
+// Polls a compile job until the worker has finished or failed it
+export const waitForCompileJob = async (jobId: number, intervalMs = 1000, timeoutMs = 120000): Promise<CompileJob> => {
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    const job = await fetchCompileJob(jobId);
+    if (job.status === 'done') {
+      return job;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Failed to compile the pattern.');
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+  throw new Error('Timed out waiting for the pattern to compile.');
+};
+
 export const fetchPatternDataByMode = async ({patternId, section, viewMode}: { patternId: any, section: any, viewMode: any }) => {
   try {
   //console.log("fetchPatternDataByMode called with:", { patternId, fileName, viewMode });
@@ -139,6 +176,103 @@ export const fetchPatternDataByFile = async ({patternId, section}: { patternId:
   }
 };
 
+// Binary section format, see backend patterns/tool_functions/grid_codec.py
+// 'KTKG' | header length (uint32 LE) | JSON header | little-endian planes at 8 byte aligned offsets
+const TYPED_ARRAYS: Record<string, any> = {
+  int8: Int8Array,
+  uint8: Uint8Array,
+  int16: Int16Array,
+  uint16: Uint16Array,
+  int32: Int32Array,
+  uint32: Uint32Array,
+  float32: Float32Array,
+  float64: Float64Array,
+};
+
+export interface GridPlane {
+  dtype: string;
+  rows: number;
+  cols: number;
+  data: Int8Array | Int16Array | Int32Array | Uint8Array | Uint16Array | Uint32Array | Float32Array | Float64Array;
+}
+
+export interface DecodedGrid {
+  planes: Record<string, GridPlane>;
+  color_map?: any;
+  window?: Required<GridWindow> & { height: number, width: number };
+}
+
+export const decodePatternGrid = (buffer: ArrayBuffer): DecodedGrid => {
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'KTKG') {
+    throw new Error('Response is not a binary pattern grid.');
+  }
+  const headerLength = new DataView(buffer).getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+
+  // Typed arrays view the planes in place, in platform byte order (little-endian in every browser we support)
+  const planes: Record<string, GridPlane> = {};
+  for (const entry of header.planes) {
+    const TypedArray = TYPED_ARRAYS[entry.dtype];
+    if (!TypedArray) {
+      throw new Error(`Unsupported plane dtype '${entry.dtype}'.`);
+    }
+    const [rows, cols] = entry.shape;
+    planes[entry.name] = { dtype: entry.dtype, rows, cols, data: new TypedArray(buffer, entry.offset, rows * cols) };
+  }
+  return { planes, color_map: header.color_map, window: header.window };
+};
+
+// Nested row arrays like the JSON endpoints return, for code that still expects them
+export const planeToRows = (plane: GridPlane): number[][] =>
+  Array.from({ length: plane.rows }, (_, row) => Array.from(plane.data.subarray(row * plane.cols, (row + 1) * plane.cols)));
+
+// Run-length encoded plane from ?format=rle, runs of row r are values/lengths[row_offsets[r]..row_offsets[r + 1]]
+export interface RLEPlane {
+  shape: [number, number];
+  values: number[];
+  lengths: number[];
+  row_offsets: number[];
+}
+
+export const decodeRLEPlane = (encoded: RLEPlane): GridPlane => {
+  const [rows, cols] = encoded.shape;
+  const data = new Int32Array(rows * cols);
+  let position = 0;
+  for (let run = 0; run < encoded.values.length; run++) {
+    data.fill(encoded.values[run], position, position + encoded.lengths[run]);
+    position += encoded.lengths[run];
+  }
+  return { dtype: 'int32', rows, cols, data };
+};
+
+// Optional viewport, rows and columns are end-exclusive and clipped to the section by the server
+export interface GridWindow {
+  row_start?: number;
+  row_end?: number;
+  col_start?: number;
+  col_end?: number;
+}
+
+export const fetchPatternGrid = async ({patternId, section, viewMode, window}: { patternId: any, section: string, viewMode?: string, window?: GridWindow }): Promise<DecodedGrid> => {
+  try {
+    const url = viewMode
+      ? `/patterns/${encodeURIComponent(patternId)}/file-mode`
+      : `/patterns/${encodeURIComponent(patternId)}/file`;
+
+    const response = await axiosInstance.get(url, {
+      headers: { Accept: 'application/octet-stream' },
+      params: { section, ...(viewMode ? { view_mode: viewMode } : {}), ...window },
+      responseType: 'arraybuffer',
+    });
+
+    return decodePatternGrid(response.data);
+  } catch (error: any) {
+    console.error('API error:', error);
+    throw new Error(error.response?.data?.error || 'Failed to fetch pattern grid.');
+  }
+};
+
 interface SavePatternChangesParams {
   patternId: string;
   section: string;
@@ -191,4 +325,164 @@ export const savePatternChanges = async ({
     console.error('API error:', error);
     throw new Error(error.response?.data?.error || 'Failed to save pattern changes.');
   }
-};
\ No newline at end of file
+};
+// Sparse plane edits, see backend patterns/tool_functions/grid_patch.py
+export interface GridPatch {
+  cells?: { rows: number[]; cols: number[]; values: number[] | number };
+  rects?: [number, number, number, number, number][]; // [row, col, height, width, value]
+}
+
+// Cells that differ between two grids of the same size, or null if their sizes differ
+export const diffGrids = (base: number[][], updated: number[][]): GridPatch | null => {
+  if (!base || !updated || base.length !== updated.length) {
+    return null;
+  }
+  const rows: number[] = [];
+  const cols: number[] = [];
+  const values: number[] = [];
+  for (let row = 0; row < updated.length; row++) {
+    if (base[row].length !== updated[row].length) {
+      return null;
+    }
+    for (let col = 0; col < updated[row].length; col++) {
+      if (base[row][col] !== updated[row][col]) {
+        rows.push(row);
+        cols.push(col);
+        values.push(updated[row][col]);
+      }
+    }
+  }
+  return { cells: { rows, cols, values } };
+};
+
+// baseVersion is the 'version' of the read the patched grid came from. Saves from other tabs since
+// then are kept, and the save fails if they changed any of the same cells.
+// Resolves to the response status and the journal version of the save.
+export const savePatternPatch = async ({
+  patternId,
+  section,
+  viewMode,
+  patch,
+  colorMap,
+  baseVersion,
+}: { patternId: string, section: string, viewMode: string, patch: GridPatch, colorMap?: { idToColorArray: string[] }, baseVersion?: number }): Promise<{ status: number, version?: number }> => {
+  try {
+    const requestBody: any = {
+      section,
+      view_mode: viewMode,
+      patch,
+    };
+
+    if (baseVersion !== undefined) {
+      requestBody.base_version = baseVersion;
+    }
+
+    if (viewMode === 'color' && colorMap) {
+      requestBody.color_map = colorMap;
+    }
+
+    const response = await axiosInstance.post(
+      `/patterns/${encodeURIComponent(patternId)}/save_changes`,
+      requestBody,
+      {
+        headers: {
+          'X-CSRFToken': getCsrfToken(),
+          'Content-Type': 'application/json',
+        },
+      }
+    );
+
+    return { status: response.status, version: response.data?.version };
+  } catch (error: any) {
+    console.error('API error:', error);
+    throw new Error(error.response?.data?.error || 'Failed to save pattern changes.');
+  }
+};
+
+// Edit journal, see backend patterns/tool_functions/journal.py
+export interface PatternEdit {
+  version: number;
+  batch: number;
+  section: string;
+  plane: string;
+  kind: 'edit' | 'undo' | 'redo' | 'restore';
+  reverts: number | null;
+  undone: boolean;
+  compacted: boolean;
+  cells: number;
+  author: string | null;
+  created_on: string;
+}
+
+export interface JournalResponse {
+  edits: PatternEdit[];
+  version: number;
+}
+
+const postJournalAction = async (patternId: string, action: string, body: any = {}): Promise<JournalResponse> => {
+  try {
+    const response = await axiosInstance.post(
+      `/patterns/${encodeURIComponent(patternId)}/${action}`,
+      body,
+      {
+        headers: {
+          'X-CSRFToken': getCsrfToken(),
+          'Content-Type': 'application/json',
+        },
+      }
+    );
+    return response.data;
+  } catch (error: any) {
+    console.error('API error:', error);
+    throw new Error(error.response?.data?.error || `Failed to ${action} pattern changes.`);
+  }
+};
+
+export const undoPatternEdit = (patternId: string) => postJournalAction(patternId, 'undo');
+
+export const redoPatternEdit = (patternId: string) => postJournalAction(patternId, 'redo');
+
+// Restores a journal version, or the version current at an ISO 8601 timestamp
+export const restorePatternVersion = (patternId: string, { version, timestamp }: { version?: number, timestamp?: string }) =>
+  postJournalAction(patternId, 'restore', timestamp !== undefined ? { timestamp } : { version });
+
+export const getPatternHistory = async (patternId: string, limit = 100): Promise<JournalResponse> => {
+  try {
+    const response = await axiosInstance.get(`/patterns/${encodeURIComponent(patternId)}/history`, { params: { limit } });
+    return response.data;
+  } catch (error: any) {
+    console.error('API error:', error);
+    throw new Error(error.response?.data?.error || 'Failed to fetch pattern history.');
+  }
+};
+
+// Live editing channel, see backend patterns/consumers.py for the messages
+export interface LiveMessage {
+  type: 'plane' | 'delta' | 'ack' | 'error' | 'saved' | 'reload' | 'viewers';
+  [key: string]: any;
+}
+
+export const openPatternLiveChannel = (patternId: string, onMessage: (message: LiveMessage) => void) => {
+  // Same host and path prefix as the API, over ws(s)://. The API base may be relative (VITE_API_URL=/api/),
+  // so resolve it against the page first
+  const base = new URL(axiosInstance.defaults.baseURL ?? '', window.location.href);
+  const url = new URL(`patterns/${encodeURIComponent(patternId)}/live`, base);
+  url.protocol = url.protocol === 'https:' ? 'wss:' : 'ws:';
+  const socket = new WebSocket(url.toString());
+  socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+
+  let nextId = 0;
+  const send = (message: object) => socket.send(JSON.stringify(message));
+  return {
+    socket,
+    load: (section: string, plane: string) => send({ type: 'load', section, plane }),
+    // Returns the id the 'ack' or 'error' for this batch will carry
+    edit: (section: string, plane: string, patch: GridPatch) => {
+      const id = ++nextId;
+      send({ type: 'edit', section, plane, patch, id });
+      return id;
+    },
+    flush: () => send({ type: 'flush' }),
+    close: () => socket.close(),
+  };
+};